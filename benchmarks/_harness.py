@@ -0,0 +1,261 @@
+"""Shared helpers of the benchmark scripts: timing, result output and synthetic fixtures"""
+
+import argparse
+import datetime
+import json
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+import timeit
+from typing import Callable, Optional
+
+from pydantic import BaseModel
+
+from chetan.actions import Action, ActionGroup
+from chetan.core.context import ContextManager
+from chetan.core.context.iteration import (
+    PreludeItem,
+    Processing,
+    Results,
+    ToolCalling,
+    UserMessage,
+)
+from chetan.core.types import FunctionCall, ToolCall
+from chetan.lm import LanguageModel
+
+_WORDS = (
+    "search fetch read write file web page user message code run python shell "
+    "database query table row index vector memory summary plan task schedule "
+    "email calendar image audio translate math compute weather news wiki"
+).split()
+
+
+class NoArgs(BaseModel):
+    pass
+
+
+class ExitArgs(BaseModel):
+    reason: str
+    code: int
+
+
+async def _noop(args):
+    return "ok"
+
+
+def build_tree(size: int, fanout: int = 10, seed: int = 0) -> ActionGroup:
+    """A tree of `size` no-op actions plus `exit`, nested in groups of `fanout`"""
+    rng = random.Random(seed)
+    nodes = [
+        Action(
+            name=f"action_{i}",
+            description=" ".join(rng.sample(_WORDS, 6)),
+            args=NoArgs,
+            output=None,
+            fn=_noop,
+        )
+        for i in range(size)
+    ]
+
+    level = 0
+    while len(nodes) > fanout:
+        nodes = [
+            ActionGroup(name=f"group_{level}_{i}", actions=nodes[j : j + fanout])
+            for i, j in enumerate(range(0, len(nodes), fanout))
+        ]
+        level += 1
+
+    exit_action = Action(
+        name="exit", description="Exit the loop", args=ExitArgs, output=None, fn=_noop
+    )
+    return ActionGroup(name="root", actions=[*nodes, exit_action])
+
+
+def deepest_path(root: ActionGroup) -> str:
+    """Dotted path of the last action of the first branch, the longest walk for `traverse`"""
+    path, node = [], root
+    while isinstance(node, ActionGroup):
+        node = node.actions[0]
+        path.append(node.name)
+    return ".".join(path)
+
+
+def iteration_items(i: int, result_size: int = 200) -> list:
+    call = ToolCall(
+        id=f"call_{i}",
+        function=FunctionCall(name="group_0_0-action_0", arguments="{}"),
+        type="function",
+    )
+    return [
+        PreludeItem(content="Recommended available actions:\n- 'exit': Exit", tag="Recommendation"),
+        Processing(content=f"Thinking about step {i} " * 8),
+        ToolCalling(calls=[call]),
+        Results(results="x" * result_size, id=call["id"]),
+    ]
+
+
+def fill_context(ctx: ContextManager, iterations: int) -> ContextManager:
+    """Add a user message and `iterations` complete iterations to a context"""
+    ctx.add(UserMessage(content="Benchmark the framework"))
+    for i in range(iterations):
+        ctx.iteration(i)
+        for item in iteration_items(i):
+            ctx.add(item)
+    return ctx
+
+
+class StubLM(LanguageModel):
+    """Zero latency language model, calling the first recommended action that is not `exit`"""
+
+    def _generate_structured(self, context, target_model, iterable, *args, **kwargs):
+        return [] if iterable else target_model.model_construct()
+
+    def _generate_raw(self, context, *args, tools=None, **kwargs):
+        if not tools:
+            return "Calling the next action"
+
+        name = next(
+            (t["function"]["name"] for t in tools if t["function"]["name"] != "exit"),
+            tools[0]["function"]["name"],
+        )
+        return [
+            ToolCall(
+                id=f"call_{len(context)}",
+                function=FunctionCall(name=name, arguments="{}"),
+                type="function",
+            )
+        ]
+
+    async def _agenerate_structured(self, context, target_model, iterable, *args, **kwargs):
+        return self._generate_structured(context, target_model, iterable, *args, **kwargs)
+
+    async def _agenerate_raw(self, context, *args, tools=None, **kwargs):
+        return self._generate_raw(context, *args, tools=tools, **kwargs)
+
+
+def _summary(seconds: list[float]) -> dict:
+    us = sorted(s * 1e6 for s in seconds)
+    return {
+        "mean_us": statistics.fmean(us),
+        "median_us": statistics.median(us),
+        "min_us": us[0],
+        "max_us": us[-1],
+        "p95_us": us[min(len(us) - 1, int(len(us) * 0.95))],
+        "stdev_us": statistics.stdev(us) if len(us) > 1 else 0.0,
+    }
+
+
+class Suite:
+    """Collects benchmark timings and writes them as a JSON document"""
+
+    def __init__(self, name: str, argv: Optional[list[str]] = None):
+        parser = argparse.ArgumentParser(description=f"chetan {name} benchmarks")
+        parser.add_argument("--quick", action="store_true", help="Smaller sizes, fewer repeats")
+        parser.add_argument("--filter", default="", help="Only run benchmarks containing this text")
+        parser.add_argument("--output", help="Write the results to this file instead of stdout")
+        parser.add_argument("--repeat", type=int, default=None, help="Timing repeats per benchmark")
+        self.args = parser.parse_args(argv)
+
+        self.name = name
+        self.quick: bool = self.args.quick
+        self.repeat: int = self.args.repeat or (3 if self.quick else 7)
+        self.results: list[dict] = []
+
+    def wanted(self, benchmark: str) -> bool:
+        return self.args.filter in benchmark
+
+    def bench(self, benchmark: str, fn: Callable[[], object], **params):
+        """Time a callable, looping it enough times for each repeat to last ~0.2s"""
+        if not self.wanted(benchmark):
+            return
+
+        timer = timeit.Timer(fn)
+        number, _ = timer.autorange()
+        runs = [t / number for t in timer.repeat(self.repeat, number)]
+        self._add(benchmark, params, runs, number)
+
+    def bench_runs(
+        self,
+        benchmark: str,
+        setup: Callable[[], object],
+        run: Callable[[object], object],
+        per: int = 1,
+        **params,
+    ):
+        """Time `run` on a fresh `setup()` state each repeat, reported per `per` operations"""
+        if not self.wanted(benchmark):
+            return
+
+        runs = []
+        for _ in range(self.repeat):
+            state = setup()
+            start = time.perf_counter()
+            run(state)
+            runs.append((time.perf_counter() - start) / per)
+        self._add(benchmark, params, runs, per)
+
+    def record(self, benchmark: str, runs: list[float], **params):
+        """Add timings measured by the caller, e.g. in a subprocess, one per run"""
+        if self.wanted(benchmark):
+            self._add(benchmark, params, runs, 1)
+
+    def measure(self, benchmark: str, value: float, unit: str, **params):
+        """Add a single non-timing measurement, e.g. a memory size"""
+        if not self.wanted(benchmark):
+            return
+
+        self.results.append(
+            {"benchmark": benchmark, "params": params, "value": value, "unit": unit}
+        )
+        print(f"{benchmark:<20} {json.dumps(params):<52} {value:>14.2f} {unit}", file=sys.stderr)
+
+    def _add(self, benchmark: str, params: dict, runs: list[float], number: int):
+        result = {
+            "benchmark": benchmark,
+            "params": params,
+            "number": number,
+            "repeat": len(runs),
+            **_summary(runs),
+        }
+        self.results.append(result)
+        print(
+            f"{benchmark:<20} {json.dumps(params):<52} {result['median_us']:>14.2f} us",
+            file=sys.stderr,
+        )
+
+    def write(self):
+        document = {
+            "suite": self.name,
+            "meta": _meta(),
+            "results": self.results,
+        }
+        data = json.dumps(document, indent=2)
+        if self.args.output:
+            with open(self.args.output, "w") as f:
+                f.write(data + "\n")
+        else:
+            print(data)
+
+
+def _meta() -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        "commit": commit,
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "machine": platform.machine(),
+        "platform": platform.platform(),
+    }
@@ -0,0 +1,119 @@
+"""Memory and serialization cost of the persistent context, as models and as compact rows
+
+    python benchmarks/bench_codec.py [--quick] [--filter loads] [--output codec.json]
+
+`pydantic` is the per-item `model_dump_json` / `model_validate_json` encoding, the one
+database stores used before rows, `marshal` and `jsonl` are `chetan.core.context.codec`.
+The `-lazy` loads hand the rows to a `CompactContextStore`, which decodes entries on access.
+`codec.speedup` is the median time of the `pydantic` baseline over the one of each format,
+above 1 when the format is faster. Timings run with the cyclic GC off, as `timeit` does.
+"""
+
+import gc
+import tracemalloc
+from typing import Optional
+
+from _harness import Suite, fill_context
+
+from chetan.core.context import ContextManager, codec
+from chetan.core.context.iteration import _NAME_MAP, _TYPE_MAP, PersistentContext
+from chetan.core.context.store import CompactContextStore
+
+
+def build(items: int) -> PersistentContext:
+    # 4 items per iteration, plus the opening user message
+    return fill_context(ContextManager(), items // 4).context
+
+
+def allocated(fn) -> int:
+    """Bytes still allocated by what `fn` returns"""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    value = fn()
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del value
+    return size
+
+
+def pydantic_dumps(context: PersistentContext) -> list[tuple[str, str]]:
+    return [
+        (_NAME_MAP[type(item)], item.model_dump_json())
+        for entry in context.items
+        for item in getattr(entry, "items", [entry])
+    ]
+
+
+def pydantic_loads(lines: list[tuple[str, str]]):
+    return [_TYPE_MAP[kind].model_validate_json(data) for kind, data in lines]
+
+
+def median(suite: Suite, benchmark: str, **params) -> Optional[float]:
+    for result in suite.results:
+        if result["benchmark"] == benchmark and result["params"] == params:
+            return result["median_us"]
+    return None
+
+
+def bench_memory(suite: Suite, sizes: list[int]):
+    for size in sizes:
+        context = build(size)
+        count = sum(len(getattr(entry, "items", [entry])) for entry in context.items)
+        rows = codec.dumps(context)
+
+        models = allocated(lambda: codec.loads(rows))
+        compact = allocated(lambda: [codec.encode_entry(e) for e in codec.loads(rows).items])
+        suite.measure("memory.item", models / count, "B", items=size, representation="model")
+        suite.measure("memory.item", compact / count, "B", items=size, representation="row")
+
+
+def bench_serialization(suite: Suite, sizes: list[int]):
+    for size in sizes:
+        context = build(size)
+
+        lines = pydantic_dumps(context)
+        suite.bench("codec.dumps", lambda: pydantic_dumps(context), items=size, format="pydantic")
+        suite.bench("codec.loads", lambda: pydantic_loads(lines), items=size, format="pydantic")
+
+        for format in ("marshal", "jsonl"):
+            data = codec.dumps(context, format)
+            suite.bench(
+                "codec.dumps", lambda: codec.dumps(context, format), items=size, format=format
+            )
+            suite.bench(
+                "codec.loads", lambda: codec.loads(data, format), items=size, format=format
+            )
+            suite.bench(
+                "codec.loads",
+                lambda: CompactContextStore(rows=codec.loads_rows(data, format)),
+                items=size,
+                format=f"{format}-lazy",
+            )
+
+        for operation in ("dumps", "loads"):
+            baseline = median(suite, f"codec.{operation}", items=size, format="pydantic")
+            for format in ("marshal", "jsonl", "marshal-lazy", "jsonl-lazy"):
+                timing = median(suite, f"codec.{operation}", items=size, format=format)
+                if baseline and timing:
+                    suite.measure(
+                        "codec.speedup",
+                        baseline / timing,
+                        "x",
+                        operation=operation,
+                        items=size,
+                        format=format,
+                    )
+
+
+def main():
+    suite = Suite("codec")
+    sizes = [1000] if suite.quick else [1000, 10000]
+
+    bench_memory(suite, sizes)
+    bench_serialization(suite, sizes)
+    suite.write()
+
+
+if __name__ == "__main__":
+    main()
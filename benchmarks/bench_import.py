@@ -0,0 +1,70 @@
+"""Cold import time of chetan modules, as paid by every new worker process or serverless handler
+
+    python benchmarks/bench_import.py [--quick] [--filter chetan.lm] [--output import.json]
+
+Each run imports a module in a fresh interpreter and reports the time spent importing it,
+along with the optional heavy dependencies it loaded.
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+from _harness import Suite
+
+MODULES = [
+    "chetan",
+    "chetan.core.context",
+    "chetan.actions",
+    "chetan.lm",
+    "chetan.lm.openai",
+    "chetan.lm.groq",
+    "chetan.lm.ollama",
+    "chetan.lm.llama_cpp",
+]
+HEAVY = ["llama_cpp", "numpy", "instructor", "openai", "groq", "ollama", "yaml"]
+
+_PROBE = """
+import sys, time, json
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps([elapsed, [m for m in {heavy!r} if m in sys.modules]]))
+"""
+
+
+def import_once(module: str) -> tuple[float, list[str]]:
+    env = {**os.environ, "PYTHONDONTWRITEBYTECODE": "1"}
+    src = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [src, env.get("PYTHONPATH")]))
+    out = subprocess.run(
+        [sys.executable, "-c", _PROBE.format(module=module, heavy=HEAVY)],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    elapsed, loaded = json.loads(out.splitlines()[-1])
+    return elapsed, loaded
+
+
+def main():
+    suite = Suite("import")
+    for module in MODULES:
+        if not suite.wanted(f"import.{module}"):
+            continue
+        try:
+            runs = [import_once(module) for _ in range(suite.repeat)]
+        except subprocess.CalledProcessError:
+            continue  # The backend's dependencies are not installed
+        suite.record(
+            f"import.{module}",
+            [elapsed for elapsed, _ in runs],
+            loaded=",".join(runs[-1][1]) or None,
+        )
+    suite.write()
+
+
+if __name__ == "__main__":
+    main()
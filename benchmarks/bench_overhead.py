@@ -0,0 +1,151 @@
+"""Framework overhead of the agent loop, without any language model or action latency
+
+    python benchmarks/bench_overhead.py [--quick] [--filter recommend] [--output overhead.json]
+
+Timings are written as JSON, to stdout or `--output`, so runs on different commits can be diffed.
+"""
+
+import asyncio
+
+from _harness import (
+    StubLM,
+    Suite,
+    build_tree,
+    deepest_path,
+    fill_context,
+    iteration_items,
+)
+
+from chetan import AgentLoop
+from chetan.actions import ActionSystem
+from chetan.actions.catalog import ActionCatalog
+from chetan.core.context import ContextManager
+from chetan.core.context.iteration import Iteration
+from chetan.core.loop import AgentLoopConfig
+from chetan.utils import stringify
+
+
+def action_system(tree, **kwargs) -> ActionSystem:
+    system = ActionSystem(**kwargs)
+    system.actions = tree
+    system.catalog  # Compiled up front, `catalog.compile` measures it separately
+    return system
+
+
+def bench_actions(suite: Suite, sizes: list[int]):
+    messages = fill_context(ContextManager(), 4).exported
+
+    for size in sizes:
+        tree = build_tree(size)
+        path = deepest_path(tree)
+        suite.bench("catalog.compile", lambda: ActionCatalog(tree, 0), actions=size)
+
+        for top_k in (None, 8):
+            system = action_system(tree, top_k=top_k)
+            system.catalog.search_index  # Built once per catalog version
+            suite.bench(
+                "actions.recommend",
+                lambda: system.recommend(messages),
+                actions=size,
+                top_k=top_k,
+            )
+
+        suite.bench("actions.traverse", lambda: tree.traverse(path), actions=size)
+        suite.bench("actions.lookup", lambda: system.lookup(path), actions=size)
+
+
+def bench_context(suite: Suite, sizes: list[int]):
+    def add_iteration():
+        iteration = Iteration()
+        for item in items:
+            iteration.add(item)
+
+    items = iteration_items(0)
+    suite.bench("iteration.add", add_iteration, items=len(items))
+
+    def add_iterations(ctx: ContextManager, start: int, count: int = 10):
+        for i in range(start, start + count):
+            ctx.iteration(i)
+            for item in iteration_items(i):
+                ctx.add(item)
+
+    for size in sizes:
+        suite.bench_runs(
+            "context.add",
+            lambda: fill_context(ContextManager(), size),
+            lambda ctx: add_iterations(ctx, size),
+            per=10,
+            iterations=size,
+        )
+
+        ctx = fill_context(ContextManager(), size)
+        suite.bench(
+            "context.export",
+            lambda: [
+                item.export()
+                for entry in ctx.context.items
+                for item in getattr(entry, "items", [entry])
+            ],
+            iterations=size,
+        )
+        suite.bench("context.window", ctx.window, iterations=size, budget=None)
+        suite.bench(
+            "context.window", lambda: ctx.window(4000), iterations=size, budget=4000
+        )
+
+
+def bench_stringify(suite: Suite):
+    results = {
+        "str": "x" * 1000,
+        "dict": {f"key_{i}": {"value": i, "tags": ["a", "b"]} for i in range(50)},
+        "list": [{"id": i, "name": f"item {i}"} for i in range(100)],
+        "model": iteration_items(0)[1],
+    }
+    for kind, value in results.items():
+        suite.bench("stringify", lambda: stringify(value), kind=kind)
+
+
+def bench_loop(suite: Suite, action_sizes: list[int], context_sizes: list[int]):
+    iterations = 10
+
+    for size in action_sizes:
+        system = action_system(build_tree(size))
+        for prefill in context_sizes:
+            for stream in (False, True):
+
+                def setup():
+                    return AgentLoop(
+                        StubLM(),
+                        ctx_manager=fill_context(ContextManager(), prefill),
+                        action_system=system,
+                        config=AgentLoopConfig(stream=stream),
+                    )
+
+                def run(agent):
+                    asyncio.run(agent(max_iter=iterations))
+
+                suite.bench_runs(
+                    "loop.iteration",
+                    setup,
+                    run,
+                    per=iterations,
+                    actions=size,
+                    context=prefill,
+                    stream=stream,
+                )
+
+
+def main():
+    suite = Suite("overhead")
+    action_sizes = [10, 100, 1000] if suite.quick else [10, 100, 1000, 10000]
+    context_sizes = [1, 10, 100] if suite.quick else [1, 10, 100, 500]
+
+    bench_actions(suite, action_sizes)
+    bench_context(suite, context_sizes)
+    bench_stringify(suite)
+    bench_loop(suite, action_sizes, context_sizes)
+    suite.write()
+
+
+if __name__ == "__main__":
+    main()
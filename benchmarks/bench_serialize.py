@@ -0,0 +1,79 @@
+"""Cost of encoding large nested action results for the context
+
+    python benchmarks/bench_serialize.py [--quick] [--filter bounded] [--output serialize.json]
+
+`stringify` is the recursive conversion results went through before, `output` the
+`ResultSerializer` compiled from the action's output model, and `bounded` the same with
+`max_chars` set, as `AgentLoopConfig.max_result_chars` does.
+"""
+
+from pydantic import BaseModel
+
+from _harness import Suite
+
+from chetan.actions.serialization import ResultSerializer
+from chetan.utils import stringify
+
+
+class Link(BaseModel):
+    url: str
+    text: str
+
+
+class Section(BaseModel):
+    heading: str
+    paragraphs: list[str]
+    links: list[Link]
+
+
+class Page(BaseModel):
+    url: str
+    title: str
+    sections: list[Section]
+    metadata: dict[str, str]
+
+
+def build(sections: int) -> dict:
+    """A crawled page like result, as plain data, with `sections` sections of ~1 KB each"""
+    return {
+        "url": "https://example.com/article",
+        "title": "An example article",
+        "sections": [
+            {
+                "heading": f"Section {i}",
+                "paragraphs": [f"Paragraph {j} of section {i}. " * 6 for j in range(4)],
+                "links": [
+                    {"url": f"https://example.com/{i}/{j}", "text": f"Link {j}"}
+                    for j in range(5)
+                ],
+            }
+            for i in range(sections)
+        ],
+        "metadata": {f"key_{i}": f"value {i}" for i in range(20)},
+    }
+
+
+def main():
+    suite = Suite("serialize")
+    sizes = [10, 100] if suite.quick else [10, 100, 1000]
+    serializer = ResultSerializer(Page)
+
+    for size in sizes:
+        result = build(size)
+        chars = len(serializer(result))
+
+        suite.bench("serialize", lambda: stringify(result), sections=size, chars=chars, path="stringify")
+        suite.bench("serialize", lambda: serializer(result), sections=size, chars=chars, path="output")
+        suite.bench(
+            "serialize",
+            lambda: serializer(result, max_chars=4000),
+            sections=size,
+            chars=chars,
+            path="bounded",
+        )
+
+    suite.write()
+
+
+if __name__ == "__main__":
+    main()
@@ -1 +1,6 @@
+import logging
+
 from chetan.core.loop import *
+
+# Library logging stays silent until the application configures it, see `chetan.utils.log_to_console`
+logging.getLogger("chetan").addHandler(logging.NullHandler())
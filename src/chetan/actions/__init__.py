@@ -1,10 +1,21 @@
+import asyncio
+import copy
+import inspect
 from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from typing import Callable, Coroutine, Literal, Optional, Type, Union, Any
 from pydantic import BaseModel, SerializeAsAny, ConfigDict, ValidationError
 from chetan.core.context import Message
+from chetan.core.telemetry import Telemetry
 from chetan.core.tool import Tool
+from chetan.actions.catalog import ActionCatalog
+from chetan.actions.recommender import tokenize
+from chetan.utils import stringify
 import json
-import yaml
+import logging
+
+logger = logging.getLogger(__name__)
+_EXECUTED = {"color": "blue"}  # Console color, see `chetan.utils.log_to_console`
 
 
 class Action(BaseModel):
@@ -107,15 +118,167 @@ class ActionInvocationWithArgs[T](BaseModel):
     args: T
 
 
+_NO_TELEMETRY = Telemetry()
+
+
+def _copy_groups(group: ActionGroup) -> ActionGroup:
+    return ActionGroup.model_construct(
+        name=group.name,
+        actions=[
+            _copy_groups(node) if isinstance(node, ActionGroup) else node
+            for node in group.actions
+        ],
+    )
+
+
 class ActionSystem:
-    actions: ActionGroup
+    _actions: ActionGroup
+    _catalog: Optional[ActionCatalog]
+
+    version: int  # Bumped on every change of the action tree
+    catalog_stats: dict[str, int]
 
-    def __init__(self):
+    top_k: Optional[int]
+    pinned: tuple[str, ...]
+    query_window: int
+
+    def __init__(
+        self,
+        max_workers: Optional[int] = None,
+        *,
+        top_k: Optional[int] = None,
+        pinned: tuple[str, ...] = ("exit",),
+        query_window: int = 4,
+    ):
+        """
+        Args:
+            max_workers (int, optional): Size of the thread pool sync action functions are offloaded to
+            top_k (int, optional): Number of actions recommended on top of the pinned ones. All actions are recommended when not set.
+            pinned (tuple[str, ...], optional): Qualified names of actions that are always recommended
+            query_window (int, optional): Number of recent non-system messages recommendations are ranked against
+        """
+        self.top_k = top_k
+        self.pinned = pinned
+        self.query_window = query_window
+        self.version = 0
+        self.catalog_stats = {"hits": 0, "misses": 0}
         self.actions = ActionGroup(name="root", actions=[])
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="chetan-action"
+        )
+
+    @property
+    def actions(self) -> ActionGroup:
+        return self._actions
+
+    @actions.setter
+    def actions(self, actions: ActionGroup):
+        self._actions = actions
+        self.invalidate()
+
+    def invalidate(self):
+        """Discard the compiled catalog
+
+        Call this after mutating the action tree in place, instead of through `register` or `remove`.
+        """
+        self._catalog = None
+        self.version += 1
+
+    @property
+    def catalog(self) -> ActionCatalog:
+        """The compiled catalog of the current action tree, rebuilt only when the tree changed"""
+        if self._catalog is not None and self._catalog.version == self.version:
+            self.catalog_stats["hits"] += 1
+            return self._catalog
+
+        self.catalog_stats["misses"] += 1
+        self._catalog = ActionCatalog(self._actions, self.version, self._catalog)
+        return self._catalog
+
+    def _current_catalog(self) -> ActionCatalog:
+        # Per call lookups go through the compiled catalog without counting as hits,
+        # so `catalog_stats` keeps reflecting how often the tree is recompiled per use
+        if self._catalog is not None and self._catalog.version == self.version:
+            return self._catalog
+        return self.catalog
+
+    def fork(self) -> "ActionSystem":
+        """An independent action system over a copy of the action tree
+
+        Groups are copied, so `register` and `remove` on the fork leave this system untouched,
+        while actions, compiled tool definitions and the thread pool are shared.
+        """
+        # Attributes are shared unless overridden here, only the tree and the counters are per fork
+        fork = copy.copy(self)
+        fork.catalog_stats = {"hits": 0, "misses": 0}
+        fork._actions = _copy_groups(self._actions)
+        fork._catalog = ActionCatalog(fork._actions, fork.version, self._current_catalog())
+        return fork
+
+    def register(self, action: Union[Action, ActionGroup], group: str = "root"):
+        """Add an action or a group to the tree
+
+        Args:
+            action (Union[Action, ActionGroup]): The action or group to add
+            group (str, optional): Qualified name of the group to add it to. Defaults to the root.
+        """
+        parent = self.lookup(group)
+        if not isinstance(parent, ActionGroup):
+            raise ValueError(f"Group {group} does not exist")
+        if any(a.name == action.name for a in parent.actions):
+            raise ValueError(f"{action.name} already exists in {group}")
+
+        parent.actions.append(action)
+        # Tool definitions of the untouched actions stay valid, keep them for the rebuild
+        self.version += 1
+
+    def remove(self, name: str) -> Union[Action, ActionGroup]:
+        """Remove an action or a group from the tree
+
+        Args:
+            name (str): Qualified name of the action or group
+
+        Returns:
+            Union[Action, ActionGroup]: The removed action or group
+        """
+        group, _, leaf = name.rpartition(".")
+        parent = self.lookup(group or self._actions.name)
+        if isinstance(parent, ActionGroup):
+            for i, action in enumerate(parent.actions):
+                if action.name == leaf:
+                    self.version += 1
+                    return parent.actions.pop(i)
+
+        raise ValueError(f"Action {name} does not exist")
+
+    async def _call(self, fn: Callable, args: BaseModel):
+        if inspect.iscoroutinefunction(fn):
+            return await fn(args)
+
+        # Sync functions would block the event loop, so they run on the bounded pool
+        result = await asyncio.get_running_loop().run_in_executor(
+            self._executor, partial(fn, args)
+        )
+        if inspect.isawaitable(result):
+            result = await result
+        return result
+
+    def lookup(self, name: str) -> Optional[Union[Action, ActionGroup]]:
+        """Find an action or a group by its qualified name
 
-    async def execute(self, action: str, args: BaseModel):
+        Args:
+            name (str): Dotted (`math.trig.sin`) or hyphenated (`math-trig-sin`) qualified name
 
-        action_obj = self.actions.traverse(action)
+        Returns:
+            Optional[Union[Action, ActionGroup]]: The matching node, None if there is none
+        """
+        return self._current_catalog().index.get(name)
+
+    async def execute(
+        self, action: str, args: BaseModel, telemetry: Optional[Telemetry] = None
+    ):
+
+        action_obj = self.lookup(action)
 
         if not action_obj:
             return "A nonexistent action was called."
@@ -123,71 +286,128 @@ class ActionSystem:
         if isinstance(action_obj, ActionGroup):
             return "A group was called, not an action."
 
-        # Check if the invocation args are valid
-        try:
-            action_obj.args.model_validate(args)
-
-            result = await action_obj.fn(args)
-
-            return result
-        except Exception as e:
-            return repr(e)
+        telemetry = telemetry or _NO_TELEMETRY
+        with telemetry.span("action", action=action):
+            # Check if the invocation args are valid
+            try:
+                action_obj.args.model_validate(args)
+
+                result = await self._call(action_obj.fn, args)
+
+                return result
+            except Exception as e:
+                # Failures are reported to the model, not raised, so they are counted here
+                telemetry.count("errors", span="action", error=type(e).__name__)
+                return repr(e)
+
+    def serialize(self, action: str, result: Any, max_chars: Optional[int] = None) -> str:
+        """Encode the result of an action for the context, after the action's `output`
+
+        Args:
+            action (str): Qualified name of the action that returned the result
+            result (Any): The result
+            max_chars (int, optional): Results longer than this are truncated. Unbounded when not set.
+        """
+        action_obj = self.lookup(action)
+        if not isinstance(action_obj, Action):
+            return stringify(result)
+        return self._current_catalog().serializer(action_obj)(result, max_chars)
 
     def validate(self, actions: list[str]):
         issues = []
         for action in actions:
-            action_obj = self.actions.traverse(action)
+            action_obj = self.lookup(action)
             if not action_obj:
                 issues.append(f"Action {action} does not exist.")
         return issues, len(issues) == 0
 
     def recommend(self, context: list[Message]):
-        flattened_actions = self.actions.get_flattened_actions()
-        actions_list = [
-            f"- '{qualified_name.replace(".", "-")}': {action.description}"
-            for qualified_name, action in flattened_actions
-        ]
-        toolified_actions = [
-            (Tool.create(action, qualified_name))
-            for qualified_name, action in flattened_actions
-        ]
-        return (
-            "Recommended available actions:\n" + "\n".join(actions_list),
-            toolified_actions,
+        """Recommend the actions relevant to the recent context
+
+        Returns:
+            tuple[str, list[dict]]: The description listing and the tool definitions of the recommended actions
+        """
+        catalog = self.catalog
+        # The compiled tool definitions are shared between calls, they must not be mutated
+        if self.top_k is None or len(catalog) <= self.top_k:
+            return catalog.listing, catalog.tools
+
+        pinned = {
+            catalog.positions[name] for name in self.pinned if name in catalog.positions
+        }
+        selected = pinned | set(
+            catalog.search_index.search(self._query(context), self.top_k)
         )
 
+        # Without enough matches, fill up with the actions in tree order
+        for position in range(len(catalog)):
+            if len(selected) >= self.top_k + len(pinned):
+                break
+            selected.add(position)
+
+        positions = sorted(selected)
+        return catalog.render(positions), [catalog.tools[i] for i in positions]
+
+    def _query(self, context: list[Message]) -> list[str]:
+        terms = []
+        recent = 0
+        for message in reversed(context):
+            if recent >= self.query_window:
+                break
+            # Released by the context once compacted
+            if message is None or message["role"] == "system":
+                continue
+
+            recent += 1
+            if isinstance(message.get("content"), str):
+                # Bounded, so a huge tool result does not dominate the cost or the ranking
+                terms.extend(tokenize(message["content"][:2000]))
+            for call in message.get("tool_calls", []):
+                terms.extend(tokenize(call["function"]["name"]))
+        return terms
+
     async def invoke_actions(
         self,
         invocations: list[ActionInvocationWithArgs],
         method: Literal["linear", "parallel"],
+        max_concurrency: Optional[int] = None,
+        telemetry: Optional[Telemetry] = None,
         **kwargs,
     ) -> dict[Any]:
+        """Execute a batch of invocations
+
+        Args:
+            invocations (list[ActionInvocationWithArgs]): The invocations to execute
+            method (Literal["linear", "parallel"]): Run the invocations one after another, or concurrently
+            max_concurrency (int, optional): Maximum number of invocations running at once in parallel mode
+            telemetry (Telemetry, optional): Records an `action` span per invocation
+
+        Returns:
+            dict[Any]: Results keyed by invocation id, in invocation order
+        """
 
         actions = [invocation.action for invocation in invocations]
         if not self.validate(actions):
             return "Invalid actions specified"
 
-        # print all the executed actions names in blue color
-        print("\033[94m" + "Executed actions: " + str(actions) + "\033[0m")
+        logger.debug("Executed actions: %s", actions, extra=_EXECUTED)
 
         if method == "parallel":
-            with ThreadPoolExecutor() as executor:
-                futures = [
-                    executor.submit(
-                        self.execute,
-                        invocation.action,
-                        invocation.args,
-                        **kwargs,
+            semaphore = asyncio.Semaphore(max_concurrency or len(invocations) or 1)
+
+            async def run(invocation: ActionInvocationWithArgs):
+                async with semaphore:
+                    return await self.execute(
+                        invocation.action, invocation.args, telemetry, **kwargs
                     )
-                    for invocation in invocations
-                ]
-                results = dict((i.id, f.result()) for f, i in zip(futures, invocations))
-            return results
+
+            outputs = await asyncio.gather(*(run(i) for i in invocations))
+            return {i.id: output for i, output in zip(invocations, outputs)}
         elif method == "linear":
             results = {}
             for invocation in invocations:
                 results[invocation.id] = await self.execute(
-                    invocation.action, invocation.args, **kwargs
+                    invocation.action, invocation.args, telemetry, **kwargs
                 )
             return results
         else:
@@ -0,0 +1,114 @@
+from typing import TYPE_CHECKING, Iterable, Optional, Union
+
+from chetan.actions.recommender import BM25Index
+from chetan.actions.serialization import ResultSerializer
+from chetan.core.tool import Tool
+
+if TYPE_CHECKING:
+    from chetan.actions import Action, ActionGroup
+
+
+class ActionCatalog:
+    """Compiled view of an `ActionGroup` tree
+
+    Holds everything the agent loop needs from the tree on every iteration, so that
+    flattening and JSON schema generation only happen when the tree changes.
+    Catalogs are read-only, a new one is compiled for every tree version.
+    """
+
+    version: int
+    names: list[str]  # Qualified, dot separated names
+    actions: list["Action"]
+    tools: list[dict]  # Tool definitions, in the same order as `names`
+    lines: list[str]  # Listing line of each action
+    listing: str  # Description listing of every action
+    index: dict[str, Union["Action", "ActionGroup"]]  # Every accepted name of every node
+
+    def __init__(
+        self,
+        root: "ActionGroup",
+        version: int,
+        previous: Optional["ActionCatalog"] = None,
+    ):
+        """
+        Args:
+            root (ActionGroup): The root of the action tree
+            version (int): The tree version this catalog is compiled for
+            previous (ActionCatalog, optional): A catalog of an earlier version, whose tool
+                definitions are reused for actions that did not change
+        """
+        self.version = version
+
+        flattened = root.get_flattened_actions()
+        self.names = [qualified_name for qualified_name, _ in flattened]
+        self.actions = [action for _, action in flattened]
+
+        reusable = previous._compiled if previous is not None else {}
+        self._compiled: dict[tuple[str, int], dict] = {}
+        self.tools = []
+        for qualified_name, action in flattened:
+            key = (qualified_name, id(action))
+            tool = reusable.get(key) or Tool.create(action, qualified_name)
+            self._compiled[key] = tool
+            self.tools.append(tool)
+
+        self.index = self._build_index(root)
+        # Serializers are compiled on first use, most actions of a large tree never run.
+        # They only depend on the output model, so they are shared with later versions.
+        self._serializers: dict[Optional[type], ResultSerializer] = (
+            previous._serializers if previous is not None else {}
+        )
+
+        self.positions = {name: i for i, name in enumerate(self.names)}
+        self.lines = [
+            f"- '{qualified_name.replace(".", "-")}': {action.description}"
+            for qualified_name, action in flattened
+        ]
+        self.listing = self.render(range(len(self.lines)))
+        self._search_index = None
+
+    @property
+    def search_index(self) -> BM25Index:
+        """Retrieval index over the actions, built on first use"""
+        if self._search_index is None:
+            self._search_index = BM25Index(
+                self.names, [action.description for action in self.actions], self.tools
+            )
+        return self._search_index
+
+    def serializer(self, action: "Action") -> ResultSerializer:
+        """The result serializer of an action, compiled from its `output`"""
+        serializer = self._serializers.get(action.output)
+        if serializer is None:
+            serializer = self._serializers[action.output] = ResultSerializer(action.output)
+        return serializer
+
+    def render(self, positions: Iterable[int]) -> str:
+        """Description listing of the actions at the given positions"""
+        return "Recommended available actions:\n" + "\n".join(
+            self.lines[i] for i in positions
+        )
+
+    @staticmethod
+    def _build_index(root: "ActionGroup") -> dict:
+        # Nodes are reachable by their dotted name, with or without the root prefix,
+        # and by the hyphenated name OpenAI sends back in tool calls
+        dotted = {root.name: root}
+        stack = [(root, "")]
+        while stack:
+            group, prefix = stack.pop()
+            for node in group.actions:
+                name = f"{prefix}{node.name}"
+                dotted.setdefault(name, node)
+                if hasattr(node, "actions"):
+                    stack.append((node, f"{name}."))
+
+        index = dict(dotted)
+        for name, node in dotted.items():
+            # Exact names win over aliases when a hyphenated name is ambiguous
+            index.setdefault(f"{root.name}.{name}", node)
+            index.setdefault(name.replace(".", "-"), node)
+        return index
+
+    def __len__(self) -> int:
+        return len(self.names)
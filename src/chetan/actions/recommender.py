@@ -0,0 +1,97 @@
+import heapq
+import math
+import re
+from collections import Counter
+from typing import Iterable
+
+_CAMEL = re.compile(r"([a-z0-9])([A-Z])")
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+_STOPWORDS = frozenset(
+    "a an and are as at be by can do for from has have i if in is it its me my "
+    "of on or so that the this to was we what when which with you your".split()
+)
+
+
+def tokenize(text: str) -> list[str]:
+    """Split text into lowercase terms, breaking snake_case, camelCase and qualified names apart"""
+    return [
+        token
+        for token in _TOKEN.findall(_CAMEL.sub(r"\1 \2", text).lower())
+        if token not in _STOPWORDS
+    ]
+
+
+def _schema_text(schema: dict) -> Iterable[str]:
+    for name, prop in schema.get("properties", {}).items():
+        yield name
+        if isinstance(prop, dict) and prop.get("description"):
+            yield prop["description"]
+
+
+class BM25Index:
+    """Local lexical retrieval index over a list of actions
+
+    Each action is indexed by its qualified name, description and argument schema. Scoring
+    walks only the postings of the query terms, so its cost depends on how many actions
+    share the query terms rather than on the size of the catalog.
+    """
+
+    k1: float = 1.5
+    b: float = 0.75
+    name_weight: int = 2  # Name terms count this many times as much as description terms
+
+    def __init__(self, names: list[str], descriptions: list[str], tools: list[dict]):
+        """
+        Args:
+            names (list[str]): Qualified names of the actions
+            descriptions (list[str]): Descriptions, in the same order as `names`
+            tools (list[dict]): Tool definitions, in the same order as `names`
+        """
+        self.postings: dict[str, list[tuple[int, int]]] = {}
+        self.lengths: list[int] = []
+
+        for doc, (name, description, tool) in enumerate(zip(names, descriptions, tools)):
+            terms = tokenize(name) * self.name_weight + tokenize(description)
+            for text in _schema_text(tool["function"]["parameters"]):
+                terms.extend(tokenize(text))
+
+            self.lengths.append(len(terms))
+            for term, tf in Counter(terms).items():
+                self.postings.setdefault(term, []).append((doc, tf))
+
+        n = len(self.lengths)
+        self.avg_length = (sum(self.lengths) / n) if n else 0.0
+        self.idf = {
+            term: math.log(1 + (n - len(p) + 0.5) / (len(p) + 0.5))
+            for term, p in self.postings.items()
+        }
+        # Length normalization only depends on the document, so it is computed once
+        self._norms = [
+            self.k1 * (1 - self.b + self.b * length / (self.avg_length or 1.0))
+            for length in self.lengths
+        ]
+
+    def search(self, query: Iterable[str], k: int) -> list[int]:
+        """Rank the actions against query terms
+
+        Args:
+            query (Iterable[str]): Query terms, see `tokenize`
+            k (int): Maximum number of actions to return
+
+        Returns:
+            list[int]: Positions of the best matching actions, best first. Actions sharing no
+                term with the query are never returned.
+        """
+        scores: dict[int, float] = {}
+        for term, qtf in Counter(query).items():
+            postings = self.postings.get(term)
+            if postings is None:
+                continue
+
+            weight = qtf * self.idf[term] * (self.k1 + 1)
+            norms = self._norms
+            for doc, tf in postings:
+                scores[doc] = scores.get(doc, 0.0) + weight * tf / (tf + norms[doc])
+
+        return heapq.nlargest(k, scores, key=scores.__getitem__)
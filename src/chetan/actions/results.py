@@ -0,0 +1,257 @@
+import contextlib
+import mmap
+import os
+import re
+import shutil
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Optional
+
+from pydantic import BaseModel, Field
+
+from chetan.actions import Action
+from chetan.lm import current_session
+from chetan.utils import primitive_base_model
+
+
+class ReadResultArgs(BaseModel):
+    handle: str = Field(description="Handle of the stored result, e.g. 'r_3f2a9c01d4e6'")
+    offset: int = Field(0, description="Byte offset to read from")
+    query: Optional[str] = Field(
+        None, description="Search the result for this text instead of reading a page"
+    )
+
+
+class _Stored:
+    __slots__ = ("path", "size")
+
+    def __init__(self, path: str, size: int):
+        self.path = path
+        self.size = size
+
+    @contextlib.contextmanager
+    def mapped(self):
+        # Mapped per read, so stored results hold no file descriptors in between
+        with open(self.path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            yield data
+
+    def close(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class _Session:
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.results: OrderedDict[str, _Stored] = OrderedDict()
+        self.size = 0
+
+
+def _boundary(data: mmap.mmap, offset: int) -> int:
+    """Move an offset forward to the start of a UTF-8 character"""
+    while offset < len(data) and data[offset] & 0xC0 == 0x80:
+        offset += 1
+    return offset
+
+
+class ResultStore:
+    """Keeps large action results out of the context, in memory mapped files
+
+    Results longer than `threshold` characters are written to a file under a directory of
+    their session (see `current_session`) and replaced in the context by a handle and a
+    preview. The model reads them through the `read_result` action (see `action`), one page
+    at a time or by searching for a term. Files are mapped while they are read rather than
+    loaded, so stored results take neither memory nor file descriptors in between.
+
+    Each session keeps at most `max_bytes` and `max_results` of stored results, the oldest
+    are dropped beyond that and reading them reports that they expired. Sessions are kept
+    until `discard` or `close` is called, as a loop may run again on the same context: the
+    owner of a loop discards its session (`discard(agent.session)`) once done with it.
+    """
+
+    def __init__(
+        self,
+        directory: str = ".chetan/results",
+        threshold: int = 8000,
+        preview: int = 1000,
+        page_size: int = 4000,
+        max_bytes: int = 64 << 20,
+        max_results: int = 256,
+    ):
+        """
+        Args:
+            directory (str, optional): Directory the session directories are created in
+            threshold (int, optional): Results longer than this, in characters, are stored
+            preview (int, optional): Characters of a stored result kept in the context
+            page_size (int, optional): Bytes returned per read
+            max_bytes (int, optional): Bytes of stored results kept per session
+            max_results (int, optional): Stored results kept per session
+        """
+        self.directory = directory
+        self.threshold = threshold
+        self.preview = preview
+        self.page_size = page_size
+        self.max_bytes = max_bytes
+        self.max_results = max_results
+
+        self._lock = threading.Lock()
+        self._sessions: dict[str, _Session] = {}
+        self._stats = {"stored": 0, "stored_bytes": 0, "evicted": 0, "reads": 0}
+
+    def _session(self, session: str) -> _Session:
+        if session not in self._sessions:
+            name = re.sub(r"[^\w.-]", "_", session)
+            directory = os.path.join(self.directory, name)
+            os.makedirs(directory, exist_ok=True)
+            self._sessions[session] = _Session(directory)
+        return self._sessions[session]
+
+    def offload(self, content: str, session: Optional[str] = None) -> str:
+        """Store a result if it is large, and return what the context should hold instead
+
+        Args:
+            content (str): The stringified result
+            session (str, optional): Session the result belongs to. Defaults to `current_session`.
+        """
+        if len(content) <= self.threshold:
+            return content
+
+        data = content.encode()
+        handle = f"r_{uuid.uuid4().hex[:12]}"
+        with self._lock:
+            state = self._session(session or current_session.get())
+            path = os.path.join(state.directory, f"{handle}.txt")
+            with open(path, "wb") as f:
+                f.write(data)
+            state.results[handle] = _Stored(path, len(data))
+            state.size += len(data)
+            self._stats["stored"] += 1
+            self._stats["stored_bytes"] += len(data)
+            self._evict(state, keep=handle)
+
+        preview = content[: self.preview]
+        return (
+            f"{preview}\n[... {len(data)} bytes in total, stored as {handle}. "
+            f"Call read_result with handle '{handle}' and offset {len(preview.encode())} "
+            "to read on, or with a query to search it.]"
+        )
+
+    def _evict(self, state: _Session, keep: str):
+        while len(state.results) > 1 and (
+            state.size > self.max_bytes or len(state.results) > self.max_results
+        ):
+            handle = next(iter(state.results))
+            if handle == keep:
+                break
+            stored = state.results.pop(handle)
+            state.size -= stored.size
+            stored.close()
+            self._stats["evicted"] += 1
+
+    def _get(self, handle: str, session: Optional[str]) -> Optional[_Stored]:
+        state = self._sessions.get(session or current_session.get())
+        stored = state.results.get(handle) if state is not None else None
+        # Removed from the disk behind the store's back
+        return stored if stored is not None and os.path.exists(stored.path) else None
+
+    def read(self, handle: str, offset: int = 0, session: Optional[str] = None) -> str:
+        """A page of a stored result, starting at a byte offset"""
+        with self._lock:
+            stored = self._get(handle, session)
+            if stored is None:
+                return f"No stored result {handle}, it may have expired."
+            self._stats["reads"] += 1
+
+            with stored.mapped() as data:
+                start = _boundary(data, min(max(0, offset), stored.size))
+                end = _boundary(data, min(stored.size, start + self.page_size))
+                page = data[start:end].decode()
+
+        if end >= stored.size:
+            return f"[{handle}, bytes {start}-{end} of {stored.size}, end of result]\n{page}"
+        return f"[{handle}, bytes {start}-{end} of {stored.size}, continue at offset {end}]\n{page}"
+
+    def search(
+        self,
+        handle: str,
+        query: str,
+        session: Optional[str] = None,
+        max_matches: int = 5,
+        radius: int = 200,
+    ) -> str:
+        """Excerpts of a stored result around the matches of a term, case insensitive for ASCII
+
+        Args:
+            handle (str): Handle of the stored result
+            query (str): The term to look for
+            session (str, optional): Session the result belongs to. Defaults to `current_session`.
+            max_matches (int, optional): Excerpts returned at most
+            radius (int, optional): Bytes shown before and after each match
+        """
+        with self._lock:
+            stored = self._get(handle, session)
+            if stored is None:
+                return f"No stored result {handle}, it may have expired."
+            self._stats["reads"] += 1
+
+            pattern = re.compile(re.escape(query.encode()), re.IGNORECASE)
+            excerpts = []
+            with stored.mapped() as data:
+                for match in pattern.finditer(data):
+                    if len(excerpts) == max_matches:
+                        break
+                    start = _boundary(data, max(0, match.start() - radius))
+                    end = _boundary(data, min(stored.size, match.end() + radius))
+                    excerpt = data[start:end].decode()
+                    excerpts.append(f"[match at offset {match.start()}]\n{excerpt}")
+
+        if not excerpts:
+            return f"No match for {query!r} in {handle}."
+        return "\n\n".join(excerpts)
+
+    def action(self, name: str = "read_result") -> Action:
+        """The action letting the model read the results stored for its session"""
+
+        async def read_result(args: ReadResultArgs) -> str:
+            # Async, so it runs in the loop's context and sees its `current_session`
+            if args.query:
+                return self.search(args.handle, args.query)
+            return self.read(args.handle, args.offset)
+
+        return Action(
+            name=name,
+            description="Read a large stored result by its handle, a page at a given byte "
+            "offset at a time, or search it for a term",
+            args=ReadResultArgs,
+            output=primitive_base_model(str),
+            fn=read_result,
+        )
+
+    def discard(self, session: Optional[str] = None):
+        """Delete the stored results of a session"""
+        with self._lock:
+            state = self._sessions.pop(session or current_session.get(), None)
+        if state is None:
+            return
+        for stored in state.results.values():
+            stored.close()
+        shutil.rmtree(state.directory, ignore_errors=True)
+
+    def close(self):
+        """Delete the stored results of every session"""
+        for session in list(self._sessions):
+            self.discard(session)
+
+    @property
+    def stats(self) -> dict:
+        """Counters, and results and bytes currently stored per session"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["sessions"] = {
+                session: {"results": len(state.results), "bytes": state.size}
+                for session, state in self._sessions.items()
+            }
+        return stats
@@ -0,0 +1,162 @@
+import json
+from typing import Any, Optional
+
+from pydantic import BaseModel, TypeAdapter, ValidationError
+from pydantic_core import PydanticSerializationError, to_jsonable_python
+
+from chetan.utils import stringify
+
+# Room kept for the marker closing a truncated container
+_MARKER = 24
+
+
+def _scalar(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False)
+
+
+def _bounded(value: Any, budget: int, parts: list[str]) -> int:
+    """Append the JSON of `value` to `parts`, within about `budget` characters, and return its length"""
+    if isinstance(value, str):
+        text = _scalar(value)
+        if len(text) > budget:
+            suffix = f"... ({len(value)} characters)"
+            text = _scalar(value[: max(budget - len(suffix) - 2, 0)] + suffix)
+        parts.append(text)
+        return len(text)
+
+    if isinstance(value, dict):
+        return _container(
+            value.items(), len(value), budget, parts, "{", "}", "keys", keyed=True
+        )
+    if isinstance(value, (list, tuple)):
+        return _container(value, len(value), budget, parts, "[", "]", "items", keyed=False)
+    if value is None or isinstance(value, (bool, int, float)):
+        text = _scalar(value)
+        parts.append(text)
+        return len(text)
+    if isinstance(value, BaseModel):
+        # Field by field, so the fields past the budget are never converted
+        names = _field_names(value)
+        return _container(
+            _dumped_fields(value, names), len(names), budget, parts, "{", "}", "keys", keyed=True
+        )
+
+    # Dataclasses, datetimes and the like, converted only when reached
+    return _bounded(to_jsonable_python(value, fallback=str), budget, parts)
+
+
+def _field_names(model: BaseModel) -> list[str]:
+    cls = type(model)
+    return [*cls.model_fields, *cls.model_computed_fields, *(model.__pydantic_extra__ or ())]
+
+
+def _dumped_fields(model: BaseModel, names: list[str]):
+    """The fields of a model, each dumped as the model's serializer writes it, aliases included"""
+    for name in names:
+        # Excluded fields dump to nothing
+        yield from model.model_dump(mode="json", include={name}).items()
+
+
+def _container(entries, count, budget, parts, opening, closing, unit, keyed) -> int:
+    parts.append(opening)
+    used = 1
+    for written, entry in enumerate(entries):
+        remaining = budget - used
+        if remaining <= 0:
+            marker = _scalar(f"... {count - written} more {unit}")
+            parts.append(("," if written else "") + (f'"...":{marker}' if keyed else marker))
+            used += len(parts[-1])
+            break
+        if written:
+            parts.append(",")
+            used += 1
+        if keyed:
+            key = _scalar(str(entry[0])) + ":"
+            parts.append(key)
+            used += len(key) + _bounded(entry[1], remaining - len(key), parts)
+        else:
+            used += _bounded(entry, remaining, parts)
+    parts.append(closing)
+    return used + 1
+
+
+def bounded_json(value: Any, max_chars: int) -> str:
+    """Encode a value as JSON of about `max_chars` characters at most
+
+    Long strings are cut, and containers end with a marker counting the entries left out
+    once the budget is spent, so the output stays valid JSON. Only the part of the value
+    that is written is walked.
+    """
+    parts: list[str] = []
+    # Room for a marker is kept once, for the whole value rather than at each nesting level
+    _bounded(value, max(max_chars - _MARKER, 0), parts)
+    return "".join(parts)
+
+
+def _truncate(text: str, max_chars: Optional[int]) -> str:
+    if max_chars is None or len(text) <= max_chars:
+        return text
+    return text[:max_chars] + f"... ({len(text)} characters)"
+
+
+class ResultSerializer:
+    """Validates and encodes the results of an action after its declared `output`
+
+    The validator and JSON serializer of the output model are compiled once, by pydantic,
+    so a result is checked and encoded without walking it in Python. Models with a single
+    field, e.g. `primitive_base_model(float)`, also accept the bare value of the field, and
+    encode it without the wrapping object.
+
+    Strings are passed as they are. Results not matching the output, including results with
+    keys it does not declare, and results of actions without one, are converted with
+    `stringify`, so that nothing is dropped from them.
+    """
+
+    def __init__(self, output: Optional[type[BaseModel]]):
+        """
+        Args:
+            output (type[BaseModel], optional): The `output` of the action
+        """
+        self.output = output
+        # Undeclared keys fail validation, rather than being ignored, unless the output keeps them
+        self._extra = None
+        if output is not None:
+            self._extra = "allow" if output.model_config.get("extra") == "allow" else "forbid"
+        self._field: Optional[TypeAdapter] = None
+        if output is not None and len(output.model_fields) == 1:
+            (field,) = output.model_fields.values()
+            self._field = TypeAdapter(field.annotation)
+
+    def _validate(self, result: Any) -> tuple[Any, Any]:
+        """The validated result and the serializer to encode it with"""
+        output = self.output
+        if isinstance(result, output):
+            return result, output.__pydantic_serializer__
+        if self._field is not None and not isinstance(result, (dict, BaseModel)):
+            return self._field.validate_python(result, extra=self._extra), self._field.serializer
+        if isinstance(result, BaseModel):
+            result = result.model_dump()  # A model of another type with matching fields
+        value = output.__pydantic_validator__.validate_python(result, extra=self._extra)
+        return value, output.__pydantic_serializer__
+
+    def __call__(self, result: Any, max_chars: Optional[int] = None) -> str:
+        """Encode a result for the context
+
+        Args:
+            result (Any): What the action returned
+            max_chars (int, optional): Results longer than this are truncated. Unbounded when not set.
+        """
+        if isinstance(result, str):
+            return _truncate(result, max_chars)
+        if self.output is None:
+            return _truncate(stringify(result), max_chars)
+
+        try:
+            value, serializer = self._validate(result)
+            text = serializer.to_json(value).decode()
+        except (ValidationError, PydanticSerializationError):
+            return _truncate(stringify(result), max_chars)
+
+        if max_chars is None or len(text) <= max_chars:
+            return text
+        return bounded_json(value, max_chars)
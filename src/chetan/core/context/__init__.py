@@ -1,3 +1,8 @@
+import asyncio
+import os
+from typing import Optional
+
+from chetan.core.context.compaction import Block, Summarizer
 from chetan.core.context.iteration import (
     Iteration,
     IterationItem,
@@ -5,53 +10,262 @@ from chetan.core.context.iteration import (
     PersistentContext,
     UserMessage,
 )
+from chetan.core.context.store import ContextStore, MemoryContextStore
+from chetan.utils import estimate_tokens
 
 
 class ContextManager:
-    """Context manager bound to an agent loop instance"""
+    """Context manager bound to an agent loop instance
+
+    With a `token_budget`, the messages of older iterations are released from `exported` (set
+    to None, pinned ones excepted) once `window` compacted them, so only their compacted form
+    is kept. With a database backed store, memory then grows with the compacted size of the
+    run rather than its full size.
+    """
 
     # We will have a persistent context and a working context
 
-    # The persistent context will be used to store an observable, debuggable context that can be used to analyze the agent's behavior. We generally want to keep this context in a database, to reduce memory usage
+    # The persistent context will be used to store an observable, debuggable context that can be used to analyze the agent's behavior. It lives in a `ContextStore`, which can keep it in a database to reduce memory usage
 
     # The working context will be used to facilitate Chat formatted messages that is directly used in the context
 
-    # TODO: Implement smart context cleaning to remove unnecessary, irrelevant context items to reduce memory usage and improve performance
+    # The working context is never trimmed. Instead, `window` builds a budgeted view of it, where older iterations are compacted, and their messages released
 
     current_iteration: int = -1
 
-    exported: list[Message]
-    context: PersistentContext  # TODO: Move persistent context to a database, to reduce memory usage
+    exported: list[Optional[Message]]  # None for released messages
+    store: ContextStore
+
+    token_budget: Optional[int]
+    keep_recent: int
+    summarizer: Optional[Summarizer]
 
-    def __init__(self):
-        with open(
-            "/Users/arjo/Work/snayu/oss/chetan_v0/chetan/src/chetan/core/context/system.prompt.txt"
-        ) as f:
+    def __init__(
+        self,
+        *,
+        token_budget: Optional[int] = None,
+        keep_recent: int = 2,
+        summarizer: Optional[Summarizer] = None,
+        store: Optional[ContextStore] = None,
+    ):
+        """
+        Args:
+            token_budget (int, optional): Estimated prompt tokens `window` may use. The whole exported context is used when not set.
+            keep_recent (int, optional): Number of latest iterations that are always kept verbatim
+            summarizer (Summarizer, optional): Async function condensing the messages of an iteration, see `lm_summarizer`.
+                Without it, older iterations are only elided.
+            store (ContextStore, optional): Backend of the persistent context. Defaults to keeping it in memory,
+                use `SQLiteContextStore` for long-lived sessions.
+        """
+        with open(os.path.join(os.path.dirname(__file__), "system.prompt.txt")) as f:
             system_message = Message(role="system", content=f.read())
 
             self.exported = [system_message]
-        self.context = PersistentContext(iterations=[])
+        self.store = store if store is not None else MemoryContextStore()
+
+        self.token_budget = token_budget
+        self.keep_recent = keep_recent
+        self.summarizer = summarizer
+
+        self._blocks: list[Block] = []
+        self._iterations = 0  # Iterations started over the lifetime of the context
+        self._summarizing: set[asyncio.Task] = set()
+
+    @property
+    def context(self) -> PersistentContext:
+        """The persistent context. With a database backed store, this loads every iteration."""
+        return self.store.context
 
     def iteration(self, iteration: int):
         self.current_iteration = iteration
-        self.context.items.append(Iteration())
+        self.store.append(Iteration())
+        self._iterations += 1
+        self._blocks.append(Block(len(self.exported), self._iterations))
 
     def add(
         self,
         item: IterationItem,
+        pinned: bool = False,
     ):
         """Add an item to the context
 
         Args:
             item (IterationItem): The item to add to the context
+            pinned (bool, optional): Keep the item verbatim when its iteration is compacted
         """
 
         if type(item) is UserMessage:
-            self.context.items.append(item)
+            self.store.append(item)
         else:
-            if type(self.context.items[-1]) is not Iteration:
+            last = self.store.last()
+            if type(last) is not Iteration:
                 raise RuntimeError("Non-user message item must go within an iteration")
 
-            self.context.items[-1].add(item)
+            last.add(item)
+            self.store.extend(item)
+
+        message = item.export()
+        self.exported.append(message)
+
+        # User messages get a block of their own, and the rest of the iteration continues in a new one
+        if type(item) is UserMessage:
+            self._blocks.append(Block(len(self.exported) - 1, None))
+        elif self._blocks[-1].iteration is None:
+            self._blocks.append(Block(len(self.exported) - 1, self._iterations))
+
+        block = self._blocks[-1]
+        block.end = len(self.exported)
+        tokens = estimate_tokens(message)
+        block.tokens += tokens
+        if pinned:
+            block.pinned.append(len(self.exported) - 1)
+            block.pinned_tokens += tokens
+
+    def _recent(self) -> set[int]:
+        return set(range(self._iterations - self.keep_recent + 1, self._iterations + 1))
+
+    def window(self, budget: Optional[int] = None) -> list[Message]:
+        """Build a view of the exported context that fits in a token budget
+
+        The system prompt, user messages, pinned items and the latest iterations are kept
+        verbatim. Older iterations are kept verbatim while they fit, newest first, and are
+        compacted (summarized, or elided while no summary is ready) once they do not. Compacted
+        iterations that still do not fit are left out, except for their pinned items.
+        The persistent context is untouched.
+
+        Compaction is final: the messages of a compacted iteration are released from `exported`,
+        once a summarizer, if any, has been handed them. An iteration left out even once
+        compacted, with no summary pending, is left out for good and its compacted form dropped.
+
+        Args:
+            budget (int, optional): Estimated prompt tokens the view may use. Defaults to `token_budget`.
+
+        Returns:
+            list[Message]: The messages to send to the language model
+        """
+        budget = budget or self.token_budget
+        if budget is None:
+            return self.exported
+
+        recent = self._recent()
+        remaining = budget - estimate_tokens(self.exported[0])
+        for block in self._blocks:
+            if block.iteration is None or block.iteration in recent:
+                remaining -= block.tokens
+            else:
+                remaining -= block.pinned_tokens
+
+        # A user message added during an iteration splits it into several blocks, e.g. its
+        # tool calls and their results. They are kept, compacted or left out together, so a
+        # tool result never outlives its call.
+        units: dict[int, list[int]] = {}
+        for i, block in enumerate(self._blocks):
+            if block.iteration is not None:
+                units.setdefault(block.iteration, []).append(i)
+
+        chosen: list[Optional[list[Message]]] = [None] * len(self._blocks)
+        decided: set[int] = set()
+        verbatim = True
+        for i in range(len(self._blocks) - 1, -1, -1):
+            block = self._blocks[i]
+
+            if block.iteration is None or block.iteration in recent:
+                chosen[i] = self.exported[block.start : block.end]
+                continue
+            if block.iteration in decided:
+                continue
+            decided.add(block.iteration)
+            unit = units[block.iteration]
+
+            # Pinned items are already accounted for, they are sent whatever form the rest takes
+            pinned = sum(self._blocks[j].pinned_tokens for j in unit)
+
+            if any(self._blocks[j].dropped for j in unit):
+                verbatim = False
+                for j in unit:
+                    chosen[j] = [self.exported[k] for k in self._blocks[j].pinned]
+                continue
+
+            # Once an iteration does not fit verbatim, every older one is compacted too
+            tokens = sum(self._blocks[j].tokens for j in unit) - pinned
+            released = any(self._blocks[j].released for j in unit)
+            if verbatim and not released and tokens <= remaining:
+                for j in unit:
+                    chosen[j] = self.exported[self._blocks[j].start : self._blocks[j].end]
+                remaining -= tokens
+                continue
+
+            verbatim = False
+            # Summaries only when every part has one, a summarized part would drop tool calls
+            # whose results are kept in an elided part
+            summary = all(self._blocks[j].summary is not None for j in unit)
+            compacted = [self._blocks[j].compacted(self.exported, summary) for j in unit]
+            for j in unit:
+                self._release(self._blocks[j])
+            tokens = sum(t for _, t in compacted) - pinned
+            if tokens <= remaining:
+                for j, (messages, _) in zip(unit, compacted):
+                    chosen[j] = messages
+                remaining -= tokens
+            else:
+                for j in unit:
+                    chosen[j] = [self.exported[k] for k in self._blocks[j].pinned]
+                # Left out for good once no pending summary could make it fit
+                if all(self._blocks[j].released for j in unit) and (
+                    self.summarizer is None or summary
+                ):
+                    for j in unit:
+                        self._blocks[j].drop()
+
+        view = self.exported[:1]
+        for messages in chosen:
+            if messages:
+                view.extend(messages)
+        return view
+
+    def _release(self, block: Block):
+        """Drop the messages of a compacted block from `exported`, keeping the pinned ones"""
+        # Without a compacted form, or before its summarization took the messages, the block
+        # still needs them
+        if block.released or (block._elided is None and block._compacted is None):
+            return
+        if self.summarizer is not None and block._task is None:
+            return
+
+        pinned = set(block.pinned)
+        for i in range(block.start, block.end):
+            if i not in pinned:
+                self.exported[i] = None
+        block.released = True
+
+    def compact(self):
+        """Summarize iterations that left the recent window, in the background
+
+        Summaries are picked up by `window` once they are ready, so this never delays the
+        next generation. Does nothing without a summarizer.
+        """
+        if self.summarizer is None:
+            return
+
+        recent = self._recent()
+        for block in self._blocks:
+            if (
+                block.iteration is None
+                or block.iteration in recent
+                or block.summary is not None
+                or block._task is not None
+            ):
+                continue
+
+            block._task = asyncio.create_task(
+                self._summarize(block, self.exported[block.start : block.end])
+            )
+            self._summarizing.add(block._task)
+            block._task.add_done_callback(self._summarizing.discard)
 
-        self.exported.append(item.export())
+    async def _summarize(self, block: Block, messages: list[Message]):
+        try:
+            block.summarized(await self.summarizer(messages))
+        except Exception:
+            # The elided form is kept, summaries are only an optimization
+            pass
@@ -0,0 +1,302 @@
+"""Compact row encoding of the persistent context, and its JSONL and binary dumps
+
+An item is encoded as a flat tuple, its kind followed by its field values in declaration
+order, with ids as 16 bytes and naive timestamps as integer microseconds. Rows take a
+fraction of the memory of the models, and are decoded by a function generated per item
+kind, which builds the model without validating it.
+
+    row = encode_item(item)          # ("processing", b"...", 1718000000000000, "agent", None, "...")
+    item = decode_item(row)
+    dump(context, "session.jsonl")   # Or "session.bin", written with marshal
+    context = load("session.jsonl")
+    store = CompactContextStore(rows=load_rows("session.bin"))  # Decoded on access
+
+Binary dumps use `marshal`, which is fast but not safe against malicious data: only load
+files written by chetan.
+"""
+
+import datetime
+import gc
+import json
+import marshal
+import operator
+from typing import Any, Callable, Literal, Optional, Union, get_args
+from uuid import UUID, SafeUUID
+
+from pydantic import BaseModel
+from pydantic_core import to_jsonable_python
+
+from chetan.core.context.iteration import (
+    _NAME_MAP,
+    _TYPE_MAP,
+    Iteration,
+    IterationItem,
+    PersistentContext,
+    UserMessage,
+)
+
+Row = tuple
+Entry = Union[Iteration, UserMessage]
+Format = Literal["jsonl", "marshal"]
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+_MICROSECOND = datetime.timedelta(microseconds=1)
+
+
+def _encode_uuid(value: UUID) -> bytes:
+    return value.bytes
+
+
+_new = object.__new__
+_from_bytes = int.from_bytes
+_set_uuid_int = UUID.__dict__["int"].__set__
+_set_uuid_safe = UUID.__dict__["is_safe"].__set__
+
+
+def _decode_uuid(value: Union[bytes, str]) -> UUID:
+    # Skips the argument checks of `UUID.__init__`, the value comes from `UUID.bytes`,
+    # written as hex in JSONL dumps
+    uuid = _new(UUID)
+    _set_uuid_int(uuid, int(value, 16) if value.__class__ is str else _from_bytes(value))
+    _set_uuid_safe(uuid, SafeUUID.unknown)
+    return uuid
+
+
+def _encode_datetime(value: datetime.datetime) -> Union[int, str]:
+    if value.tzinfo is not None:
+        return value.isoformat()
+    return (value - _EPOCH) // _MICROSECOND
+
+
+def _decode_datetime(value: Union[int, str]) -> datetime.datetime:
+    if value.__class__ is str:
+        return datetime.datetime.fromisoformat(value)
+    return _EPOCH + value * _MICROSECOND
+
+
+def _encode_value(value: Any) -> Any:
+    # Free-form values may hold models, datetimes, UUIDs or decimals, neither marshal nor
+    # JSON can write them as they are
+    return value if type(value) is str else to_jsonable_python(value, fallback=str)
+
+
+def _codecs(annotation) -> Optional[tuple[Callable, Optional[Callable]]]:
+    """Encoder and decoder of a field, None for values stored as they are"""
+    if annotation is UUID:
+        return _encode_uuid, _decode_uuid
+    if annotation is datetime.datetime:
+        return _encode_datetime, _decode_datetime
+    if annotation in (Any, dict) or {dict, BaseModel} & set(get_args(annotation)):
+        return _encode_value, None
+    return None
+
+
+class _Layout:
+    """Field order of an item kind, the fields needing conversion, and its compiled decoder"""
+
+    def __init__(self, type_: type[BaseModel]):
+        self.type = type_
+        self.names = tuple(type_.model_fields)
+        self.get = operator.itemgetter(*self.names)
+
+        codecs = [_codecs(type_.model_fields[name].annotation) for name in self.names]
+        self.encoders = [
+            (position, codec[0]) for position, codec in enumerate(codecs) if codec
+        ]
+        self.decode = _compile_decoder(
+            type_, self.names, [codec[1] if codec else None for codec in codecs]
+        )
+
+
+# Setters of the slots `model_construct` fills, called directly to skip `BaseModel.__setattr__`
+_set_dict = BaseModel.__dict__["__dict__"].__set__
+_set_fields_set = BaseModel.__dict__["__pydantic_fields_set__"].__set__
+_set_extra = BaseModel.__dict__["__pydantic_extra__"].__set__
+_set_private = BaseModel.__dict__["__pydantic_private__"].__set__
+
+
+def _compile_decoder(
+    type_: type[BaseModel], names: tuple[str, ...], decoders: list[Optional[Callable]]
+) -> Callable[[Row], BaseModel]:
+    """Generate the function rebuilding a model from its row, its kind followed by `names`
+
+    What `model_construct` does, unrolled for the fields of the model: the values go straight
+    into a dict display, without a per-field loop or validation. Fields sets are shared, as
+    every field is set and pydantic only ever adds to them.
+    """
+    namespace = {
+        "new": _new,
+        "cls": type_,
+        "fields_set": set(names),
+        "set_dict": _set_dict,
+        "set_fields_set": _set_fields_set,
+        "set_extra": _set_extra,
+        "set_private": _set_private,
+    }
+    values = []
+    for position, (name, decode) in enumerate(zip(names, decoders), start=1):
+        value = f"row[{position}]"
+        if decode is not None:
+            namespace[f"decode_{position}"] = decode
+            value = f"decode_{position}({value})"
+        values.append(f"{name!r}: {value}")
+    private = (
+        repr({name: None for name in type_.__private_attributes__})
+        if type_.__private_attributes__
+        else "None"
+    )
+
+    source = (
+        "def decode(row):\n"
+        "    model = new(cls)\n"
+        f"    set_dict(model, {{{', '.join(values)}}})\n"
+        "    set_fields_set(model, fields_set)\n"
+        "    set_extra(model, None)\n"
+        f"    set_private(model, {private})\n"
+        "    return model\n"
+    )
+    exec(source, namespace)
+    return namespace["decode"]
+
+
+_LAYOUTS = {kind: _Layout(type_) for kind, type_ in _TYPE_MAP.items()}
+
+
+def encode_item(item: IterationItem) -> Row:
+    """Encode an item, user messages included, as a row"""
+    kind = _NAME_MAP[type(item)]
+    layout = _LAYOUTS[kind]
+    values = list(layout.get(item.__dict__))
+    for position, encode in layout.encoders:
+        values[position] = encode(values[position])
+    return (kind, *values)
+
+
+def decode_item(row: Row) -> IterationItem:
+    """Rebuild an item from its row, without validating it again"""
+    return _LAYOUTS[row[0]].decode(row)
+
+
+def encode_iteration(iteration: Iteration, items: bool = True) -> Row:
+    """Encode an iteration as a row, with its item rows unless `items` is False"""
+    return (
+        "iteration",
+        iteration.id.bytes,
+        iteration.counter,
+        iteration.ended,
+        [encode_item(item) for item in iteration.items] if items else [],
+    )
+
+
+_ITERATION_FIELDS = set(Iteration.model_fields)
+
+
+def decode_iteration(row: Row, items: Optional[list[IterationItem]] = None) -> Iteration:
+    """Rebuild an iteration from its row, or from its header row and separately decoded items"""
+    _, id, counter, ended, item_rows = row
+    iteration = _new(Iteration)
+    _set_dict(
+        iteration,
+        {
+            "id": _decode_uuid(id),
+            "counter": counter,
+            "items": items if items is not None else [decode_item(r) for r in item_rows],
+            "ended": ended,
+        },
+    )
+    _set_fields_set(iteration, _ITERATION_FIELDS)
+    _set_extra(iteration, None)
+    _set_private(iteration, None)
+    return iteration
+
+
+def encode_entry(entry: Entry) -> Row:
+    if isinstance(entry, Iteration):
+        return encode_iteration(entry)
+    return encode_item(entry)
+
+
+def decode_entry(row: Row) -> Entry:
+    if row[0] == "iteration":
+        return decode_iteration(row)
+    return decode_item(row)
+
+
+def _json_default(value):
+    if isinstance(value, bytes):
+        return value.hex()
+    return str(value)
+
+
+_JSON = json.JSONEncoder(default=_json_default, separators=(",", ":"))
+
+
+def row_to_json(row: Row) -> str:
+    """Encode a row as JSON, with ids as hex, e.g. for storage meant to outlive the Python version"""
+    return _JSON.encode(row)
+
+
+def dumps(context: PersistentContext, format: Format = "marshal") -> Union[bytes, str]:
+    """Serialize a persistent context, as a `marshal` blob or as JSONL, one entry per line"""
+    rows = [encode_entry(entry) for entry in context.items]
+    if format == "marshal":
+        return marshal.dumps(rows)
+    if format == "jsonl":
+        return "".join(row_to_json(row) + "\n" for row in rows)
+    raise ValueError(f"Unknown format {format}")
+
+
+def loads_rows(data: Union[bytes, str], format: Format = "marshal") -> list[Row]:
+    """The rows of a persistent context written by `dumps`, left undecoded"""
+    if format == "marshal":
+        return marshal.loads(data)
+    if format == "jsonl":
+        return [json.loads(line) for line in data.splitlines() if line]
+    raise ValueError(f"Unknown format {format}")
+
+
+def loads(data: Union[bytes, str], format: Format = "marshal") -> PersistentContext:
+    """Deserialize a persistent context written by `dumps`
+
+    This builds a model per item. To resume a session, prefer handing the rows to a
+    `CompactContextStore`, which decodes entries only when they are accessed:
+
+        store = CompactContextStore(rows=loads_rows(data))
+    """
+    rows = loads_rows(data, format)
+    # Every decoded object survives, the collections the cyclic GC runs meanwhile find nothing
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return PersistentContext.model_construct(items=[decode_entry(row) for row in rows])
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def _format_of(path: str, format: Optional[Format]) -> Format:
+    if format is not None:
+        return format
+    return "jsonl" if path.endswith((".jsonl", ".json")) else "marshal"
+
+
+def dump(context: PersistentContext, path: str, format: Optional[Format] = None):
+    """Write a persistent context to a file, as JSONL for `.jsonl` paths and `marshal` otherwise"""
+    format = _format_of(path, format)
+    data = dumps(context, format)
+    with open(path, "w" if format == "jsonl" else "wb") as f:
+        f.write(data)
+
+
+def load_rows(path: str, format: Optional[Format] = None) -> list[Row]:
+    """Read the rows of a persistent context written by `dump`, see `loads_rows`"""
+    format = _format_of(path, format)
+    with open(path, "r" if format == "jsonl" else "rb") as f:
+        return loads_rows(f.read(), format)
+
+
+def load(path: str, format: Optional[Format] = None) -> PersistentContext:
+    """Read a persistent context written by `dump`"""
+    format = _format_of(path, format)
+    with open(path, "r" if format == "jsonl" else "rb") as f:
+        return loads(f.read(), format)
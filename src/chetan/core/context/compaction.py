@@ -0,0 +1,132 @@
+import asyncio
+from typing import TYPE_CHECKING, Awaitable, Callable, Optional
+
+from chetan.core.context.iteration import Message
+from chetan.utils import estimate_tokens
+
+if TYPE_CHECKING:
+    from chetan.lm import LanguageModel
+
+
+Summarizer = Callable[[list[Message]], Awaitable[str]]
+
+
+class Block:
+    """A contiguous run of exported messages belonging to one iteration, or a single user message"""
+
+    start: int
+    end: int
+    iteration: Optional[int]  # None for user messages, which are never compacted
+    tokens: int
+    pinned: list[int]  # Positions in the exported context of messages that are never compacted
+    pinned_tokens: int
+    released: bool  # Whether its messages, pinned ones excepted, were dropped from the exported context
+    dropped: bool  # Whether it is left out of every window, its compacted forms dropped
+    summary: Optional[str] = None
+    _compacted: Optional[tuple[list[Message], int]] = None  # Summarized form
+    _elided: Optional[tuple[list[Message], int]] = None
+    _task: Optional[asyncio.Task] = None  # Pending or finished summarization
+
+    def __init__(self, start: int, iteration: Optional[int]):
+        self.start = start
+        self.end = start
+        self.iteration = iteration
+        self.tokens = 0
+        self.pinned = []
+        self.pinned_tokens = 0
+        self.released = False
+        self.dropped = False
+
+    def compacted(
+        self, exported: list[Message], summary: bool = True
+    ) -> tuple[list[Message], int]:
+        """The compacted form of the block and its estimated tokens
+
+        The summary is used when available and `summary` is set, the elided messages otherwise.
+        """
+        if summary and self.summary is not None:
+            if self._compacted is None:
+                messages = [exported[i] for i in self.pinned] + [
+                    Message(
+                        role="system",
+                        content=f"Summary of an earlier iteration: {self.summary}",
+                    )
+                ]
+                self._compacted = (messages, message_tokens(messages))
+            return self._compacted
+
+        if self._elided is None:
+            messages = elide(
+                exported[self.start : self.end],
+                keep={i - self.start for i in self.pinned},
+            )
+            self._elided = (messages, message_tokens(messages))
+        return self._elided
+
+    def drop(self):
+        self.dropped = True
+        self.summary = None
+        self._compacted = None
+        self._elided = None
+
+    def summarized(self, summary: str):
+        self.summary = summary
+        self._compacted = None
+
+
+def elide(
+    messages: list[Message], preview: int = 200, keep: set[int] = frozenset()
+) -> list[Message]:
+    """Shrink messages of a past iteration
+
+    Stale action recommendations are dropped, and assistant texts and tool results are cut
+    down to a preview. Tool calls are kept, so every tool result still follows its call.
+    Messages at the positions in `keep` are left as they are.
+    """
+    elided = []
+    for position, message in enumerate(messages):
+        content = message.get("content")
+        if position in keep:
+            elided.append(message)
+            continue
+        if message["role"] == "system":
+            continue
+        if isinstance(content, str) and len(content) > preview:
+            message = Message(
+                message,
+                content=f"{content[:preview]}... [{len(content) - preview} characters elided]",
+            )
+        elided.append(message)
+    return elided
+
+
+def lm_summarizer(lm: "LanguageModel", **kwargs) -> Summarizer:
+    """Build a summarizer that asks `lm` to condense an iteration
+
+    Args:
+        lm (LanguageModel): The model used for summaries, ideally a small and fast one
+        **kwargs: Generation arguments passed to `lm.agenerate`
+    """
+
+    async def summarize(messages: list[Message]) -> str:
+        transcript = "\n".join(
+            f"{m['role']}: {str(m.get('content') or m.get('tool_calls'))[:2000]}"
+            for m in messages
+        )
+        return await lm.agenerate(
+            [
+                Message(
+                    role="system",
+                    content="Summarize this step of an agent's work in at most three sentences. "
+                    "Keep facts, results and decisions, drop everything else.",
+                ),
+                Message(role="user", content=transcript),
+            ],
+            **kwargs,
+        )
+
+    return summarize
+
+
+def message_tokens(messages: list[Message]) -> int:
+    return sum(estimate_tokens(m) for m in messages)
@@ -1,8 +1,7 @@
 import datetime
-from typing import Any, NotRequired, Optional, Required, Self, TypedDict
+from typing import Any, List, Literal, NotRequired, Optional, Required, Self, TypedDict, Union
 from uuid import UUID, uuid4
-from llama_cpp import List, Literal, Union
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, PrivateAttr
 
 from chetan.core.types import FunctionCall, ToolCall
 
@@ -31,20 +30,31 @@ class Message(TypedDict):
 
 
 class IterationItem(BaseModel):
-    id: UUID = uuid4()
-    timestamp: datetime.datetime = datetime.datetime.now()
+    id: UUID = Field(default_factory=uuid4)
+    timestamp: datetime.datetime = Field(default_factory=datetime.datetime.now)
     source: Source
     feedback: Optional[str] = None
 
+    _message: Optional[Message] = PrivateAttr(default=None)
+
     def export(self) -> Message:
-        raise NotImplementedError("Export method must be implemented")
+        """The chat message of the item, built on the first call only
+
+        Items are not meant to change once added to a context, so the message is shared.
+        """
+        if self._message is None:
+            self._message = self.to_message()
+        return self._message
+
+    def to_message(self) -> Message:
+        raise NotImplementedError("to_message method must be implemented")
 
 
 class UserMessage(IterationItem):
     content: str
     source: Source = "user"
 
-    def export(self) -> Message:
+    def to_message(self) -> Message:
         return Message(
             role="user",
             content=self.content,
@@ -56,7 +66,7 @@ class PreludeItem(IterationItem):
     tag: Tag
     source: Source = "system"
 
-    def export(self) -> Message:
+    def to_message(self) -> Message:
         return Message(
             role="system",
             content=self.content,
@@ -67,7 +77,7 @@ class Processing(IterationItem):
     content: str
     source: Source = "agent"
 
-    def export(self) -> Message:
+    def to_message(self) -> Message:
         return Message(
             role="assistant",
             content=self.content,
@@ -78,7 +88,7 @@ class ToolCalling(IterationItem):
     calls: List[ToolCall]
     source: Source = "agent"
 
-    def export(self) -> Message:
+    def to_message(self) -> Message:
         return Message(
             role="assistant",
             tool_calls=[
@@ -100,7 +110,7 @@ class Results(IterationItem):
     id: str
     source: Source = "system"
 
-    def export(self) -> Message:
+    def to_message(self) -> Message:
         return Message(
             role="tool",
             content=self.results,
@@ -112,7 +122,7 @@ class StateUpdate(IterationItem):
     state: dict
     source: Source = "agent"
 
-    def export(self) -> Message:
+    def to_message(self) -> Message:
         return Message(
             role="system",
             content=str(self.state),
@@ -138,7 +148,7 @@ _VALID_ITEM_ORDER = {
 
 
 class Iteration(BaseModel):
-    id: UUID = uuid4()
+    id: UUID = Field(default_factory=uuid4)
     counter: int = 0
     items: List[IterationItem] = []
     ended: bool = False
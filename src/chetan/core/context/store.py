@@ -0,0 +1,275 @@
+import json
+import sqlite3
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Iterator, Optional, Union
+from uuid import uuid4
+
+from chetan.core.context.codec import (
+    decode_entry,
+    decode_item,
+    decode_iteration,
+    encode_entry,
+    encode_item,
+    encode_iteration,
+    row_to_json,
+)
+from chetan.core.context.iteration import (
+    Iteration,
+    IterationItem,
+    PersistentContext,
+    UserMessage,
+)
+
+Entry = Union[Iteration, UserMessage]
+
+
+class ContextStore(ABC):
+    """Persistence backend of the persistent context
+
+    Entries are the top level items of a `PersistentContext`: iterations and user messages.
+    The last entry stays in memory, since it is the one items are added to.
+    """
+
+    @abstractmethod
+    def append(self, entry: Entry):
+        """Add a new top level entry"""
+        ...
+
+    @abstractmethod
+    def extend(self, item: IterationItem):
+        """Persist an item that was just added to the last entry, which is an iteration"""
+        ...
+
+    @abstractmethod
+    def last(self) -> Optional[Entry]: ...
+
+    @abstractmethod
+    def __len__(self) -> int: ...
+
+    @abstractmethod
+    def __getitem__(self, index: int) -> Entry: ...
+
+    def __iter__(self) -> Iterator[Entry]:
+        for i in range(len(self)):
+            yield self[i]
+
+    @property
+    def context(self) -> PersistentContext:
+        """The whole persistent context, loaded in memory"""
+        return PersistentContext(items=list(self))
+
+
+class MemoryContextStore(ContextStore):
+    """Keeps the persistent context in memory"""
+
+    def __init__(self):
+        self._context = PersistentContext(items=[])
+
+    def append(self, entry: Entry):
+        self._context.items.append(entry)
+
+    def extend(self, item: IterationItem):
+        pass  # The iteration in memory already holds the item
+
+    def last(self) -> Optional[Entry]:
+        return self._context.items[-1] if self._context.items else None
+
+    def __len__(self) -> int:
+        return len(self._context.items)
+
+    def __getitem__(self, index: int) -> Entry:
+        return self._context.items[index]
+
+    @property
+    def context(self) -> PersistentContext:
+        return self._context
+
+
+class CompactContextStore(ContextStore):
+    """Keeps the persistent context in memory, as compact rows
+
+    Past entries are held as rows (see `chetan.core.context.codec`), a fraction of the
+    memory of the models, and decoded again on access. The last entry stays a model.
+    A session dumped with `codec.dump` resumes from its rows, without decoding them all.
+    """
+
+    def __init__(self, cache_size: int = 8, rows: Optional[list[tuple]] = None):
+        """
+        Args:
+            cache_size (int, optional): Number of decoded past entries kept
+            rows (list[tuple], optional): Rows to start from, e.g. from `codec.load_rows`
+        """
+        self.cache_size = cache_size
+        self._rows: list[tuple] = list(rows) if rows else []
+        self._last: Optional[Entry] = decode_entry(self._rows.pop()) if self._rows else None
+        self._cache: OrderedDict[int, Entry] = OrderedDict()
+
+    def append(self, entry: Entry):
+        if self._last is not None:
+            self._rows.append(encode_entry(self._last))
+        self._last = entry
+
+    def extend(self, item: IterationItem):
+        pass  # The last iteration is a model, it already holds the item
+
+    def last(self) -> Optional[Entry]:
+        return self._last
+
+    def __len__(self) -> int:
+        return len(self._rows) + (self._last is not None)
+
+    def __getitem__(self, index: int) -> Entry:
+        length = len(self)
+        if index < 0:
+            index += length
+        if not 0 <= index < length:
+            raise IndexError("context entry index out of range")
+
+        if index == length - 1:
+            return self._last
+
+        if index in self._cache:
+            self._cache.move_to_end(index)
+            return self._cache[index]
+
+        entry = decode_entry(self._rows[index])
+        self._cache[index] = entry
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return entry
+
+
+class SQLiteContextStore(ContextStore):
+    """Keeps the persistent context in a SQLite database
+
+    Items are written as they are added. Only the open iteration and a few recently
+    queried ones are held in memory, older iterations are loaded back on access.
+    Several sessions can share one database file.
+    """
+
+    def __init__(
+        self,
+        path: str = "chetan_context.db",
+        session: Optional[str] = None,
+        cache_size: int = 8,
+    ):
+        """
+        Args:
+            path (str, optional): Database file, ":memory:" for a throwaway database
+            session (str, optional): Session to read and write. A new one is created when not set.
+            cache_size (int, optional): Number of loaded past iterations kept in memory
+        """
+        self.session = session or uuid4().hex
+        self.cache_size = cache_size
+        self._cache: OrderedDict[int, Entry] = OrderedDict()
+
+        self._db = sqlite3.connect(path)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS entries (
+                session TEXT, position INTEGER, kind TEXT, data TEXT,
+                PRIMARY KEY (session, position)
+            );
+            CREATE TABLE IF NOT EXISTS items (
+                session TEXT, position INTEGER, seq INTEGER, kind TEXT, data TEXT,
+                PRIMARY KEY (session, position, seq)
+            );
+            """
+        )
+
+        (self._length,) = self._db.execute(
+            "SELECT COUNT(*) FROM entries WHERE session = ?", (self.session,)
+        ).fetchone()
+        self._last = self._load(self._length - 1) if self._length else None
+
+    def append(self, entry: Entry):
+        if isinstance(entry, Iteration):
+            kind, data = "iteration", _header(entry)
+        else:
+            kind, data = "user_message", row_to_json(encode_item(entry))
+
+        with self._db:
+            self._db.execute(
+                "INSERT INTO entries VALUES (?, ?, ?, ?)",
+                (self.session, self._length, kind, data),
+            )
+            for seq, item in enumerate(getattr(entry, "items", [])):
+                self._insert_item(self._length, seq, item)
+
+        self._length += 1
+        self._last = entry
+
+    def extend(self, item: IterationItem):
+        iteration: Iteration = self._last
+        with self._db:
+            self._insert_item(self._length - 1, len(iteration.items) - 1, item)
+            if iteration.ended:
+                self._db.execute(
+                    "UPDATE entries SET data = ? WHERE session = ? AND position = ?",
+                    (_header(iteration), self.session, self._length - 1),
+                )
+
+    def _insert_item(self, position: int, seq: int, item: IterationItem):
+        row = encode_item(item)
+        self._db.execute(
+            "INSERT INTO items VALUES (?, ?, ?, ?, ?)",
+            (self.session, position, seq, row[0], row_to_json(row)),
+        )
+
+    def last(self) -> Optional[Entry]:
+        return self._last
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __getitem__(self, index: int) -> Entry:
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("context entry index out of range")
+
+        if index == self._length - 1:
+            return self._last
+
+        if index in self._cache:
+            self._cache.move_to_end(index)
+            return self._cache[index]
+
+        entry = self._load(index)
+        self._cache[index] = entry
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return entry
+
+    def _load(self, index: int) -> Entry:
+        kind, data = self._db.execute(
+            "SELECT kind, data FROM entries WHERE session = ? AND position = ?",
+            (self.session, index),
+        ).fetchone()
+
+        if kind == "user_message":
+            return _load_item(data)
+
+        items = [
+            _load_item(item_data)
+            for (item_data,) in self._db.execute(
+                "SELECT data FROM items WHERE session = ? AND position = ? ORDER BY seq",
+                (self.session, index),
+            )
+        ]
+        return decode_iteration(json.loads(data), items)
+
+    def close(self):
+        self._db.close()
+
+
+def _header(iteration: Iteration) -> str:
+    return row_to_json(encode_iteration(iteration, items=False))
+
+
+# Data is a JSON row, stable across Python versions
+def _load_item(data: str) -> IterationItem:
+    return decode_item(json.loads(data))
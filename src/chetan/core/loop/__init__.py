@@ -1,8 +1,10 @@
-from typing import Dict, List, Literal, Optional, Self, Type, Union
+from typing import AsyncIterator, Callable, Dict, List, Literal, Optional, Self, Type, Union
 from pydantic import BaseModel, create_model
 from chetan.actions import Action, ActionInvocationWithArgs, ActionSystem
+from chetan.actions.results import ResultStore
 from chetan.core.tool import Tool
 from chetan.core.context import ContextManager
+from chetan.core.telemetry import Telemetry
 from chetan.core.context.iteration import (
     PreludeItem,
     Processing,
@@ -10,20 +12,35 @@ from chetan.core.context.iteration import (
     ToolCall,
     ToolCalling,
 )
-from chetan.lm import LanguageModel
+from chetan.core.types import StreamChunk
+from chetan.lm import LanguageModel, current_session
+from contextlib import aclosing
 from functools import wraps
-from termcolor import colored
+import asyncio
 import json
-from chetan.utils import rand_code_name_pairs, stringify
+import logging
+import time
+from uuid import uuid4
+from chetan.utils import Preview, estimate_tokens, rand_code_name_pairs
+
+logger = logging.getLogger(__name__)
+
+# Console colors, see `chetan.utils.log_to_console`
+_STAGE = {"color": "green"}
+_PROCESS = {"color": "yellow"}
+_TOOL_CALL = {"color": "cyan"}
+_RESULT = {"color": "magenta"}
 
 
 def iteration_stage(stage_name):
     def decorator(func):
         @wraps(func)
-        def wrapper(self, *args, **kwargs):
-            print(colored(f"[STAGE] : {stage_name}", "green"))
-            result = func(self, *args, **kwargs)
-            return result
+        async def wrapper(self, *args, **kwargs):
+            logger.debug("[STAGE] : %s", stage_name, extra=_STAGE)
+            with self.telemetry.span(
+                "stage", stage=stage_name, iteration=self.context.current_iteration
+            ):
+                return await func(self, *args, **kwargs)
 
         return wrapper
 
@@ -32,30 +49,85 @@ def iteration_stage(stage_name):
 
 class AgentLoopConfig(BaseModel):
     max_iterations: int = 20
+    stream: bool = True  # Stream generations, so progress is visible before the completion ends
+    action_execution: Literal["linear", "parallel"] = "linear"
+    max_concurrent_actions: Optional[int] = None  # Unbounded when not set
+    # How recommended actions are announced: a full listing every iteration, a single
+    # listing in the first one, or the first listing followed by what changed.
+    # "once" and "diff" keep the prompt prefix stable, so providers can cache it.
+    prelude: Literal["every", "once", "diff"] = "every"
+    # "two_calls" generates the reasoning, then the tool calls, in two generations over the context.
+    # "single_call" takes both from a single generation, halving latency and prompt tokens. The model
+    # must be free to answer with content besides tool calls, e.g. `GroqLM(..., tool_choice="auto")`.
+    iteration_mode: Literal["two_calls", "single_call"] = "two_calls"
+    # Start the actions marked `metadata={"speculative": True}` as soon as their call is streamed,
+    # while the rest of the generation goes on. Only mark actions without side effects, since
+    # they are cancelled if the model exits in the same generation.
+    speculative_execution: bool = False
+    # Results are encoded after the `output` of their action, and truncated beyond this many characters
+    max_result_chars: Optional[int] = None
 
 
 class AgentLoop:
-    id: str
+    id: str  # Code name, for display
+    session: str  # Unique key of the loop's generations and stored results
     context: ContextManager
     action_system: ActionSystem
     lm: LanguageModel
 
     config: AgentLoopConfig
+    on_stream: Optional[Callable[[StreamChunk], None]]
+    stats: dict[str, int]
+    telemetry: Telemetry
+    result_store: Optional[ResultStore]
+    iteration_wide_storage: dict
 
     def __init__(
         self,
         lm: LanguageModel,
         *,
-        ctx_manager: ContextManager = ContextManager(),
-        action_system: ActionSystem = ActionSystem(),
-        config: AgentLoopConfig = AgentLoopConfig(),
+        ctx_manager: Optional[ContextManager] = None,
+        action_system: Optional[ActionSystem] = None,
+        config: Optional[AgentLoopConfig] = None,
+        on_stream: Optional[Callable[[StreamChunk], None]] = None,
+        telemetry: Optional[Telemetry] = None,
+        result_store: Optional[ResultStore] = None,
     ):
+        """
+        Args:
+            lm (LanguageModel): The language model driving the loop
+            ctx_manager (ContextManager, optional): The context of the loop. A new one is created when not set.
+            action_system (ActionSystem, optional): The actions available to the loop. A new, empty one is created when not set.
+            config (AgentLoopConfig, optional): The loop configuration. Defaults apply when not set.
+            on_stream (Callable[[StreamChunk], None], optional): Called with every streamed chunk
+            telemetry (Telemetry, optional): Records stage, action and generation spans and metrics, tagged with the loop id
+            result_store (ResultStore, optional): Keeps large action results out of the context, behind a handle and a preview.
+                Its `read_result` action is added to the action system if missing. The results are kept across runs,
+                call `result_store.discard(loop.session)` once done with the loop.
+        """
         self.id = rand_code_name_pairs()
-
-        self.context = ctx_manager
-        self.action_system = action_system
+        # Code names often repeat across many loops, sessions must not be shared between them
+        self.session = uuid4().hex
+        self.telemetry = (telemetry or Telemetry()).bind(agent=self.id)
+
+        # Defaults are created per loop, so that loops never share their state
+        self.context = ctx_manager if ctx_manager is not None else ContextManager()
+        self.action_system = (
+            action_system if action_system is not None else ActionSystem()
+        )
         self.lm = lm
-        self.config = config
+        self.config = config if config is not None else AgentLoopConfig()
+        self.on_stream = on_stream
+        self.result_store = result_store
+        if result_store is not None and self.action_system.lookup("read_result") is None:
+            self.action_system.register(result_store.action())
+        self.iteration_wide_storage = {}
+        self.exit_call: Optional[ToolCall] = None  # The `exit` call that ended the last run
+
+        # Estimated prompt tokens not sent, compared to a full prelude every iteration
+        self.stats = {"prelude_tokens_saved": 0}
+        self._announced: Optional[set[str]] = None  # Actions already listed in the context
+        self._omitted_tokens = 0  # Listing tokens left out of the context so far
 
     def generate(
         self,
@@ -64,36 +136,104 @@ class AgentLoop:
         tools: Optional[List[Tool]] = None,
         **kwargs,
     ) -> Union[BaseModel, str]:
-        return self.lm.generate(
-            target_model=target_model,
-            tools=tools,
-            context=self.context.exported,
-            *args,
-            **kwargs,
-        )
+        self.stats["prelude_tokens_saved"] += self._omitted_tokens
+        with self.telemetry.span(
+            "lm", mode="generate", structured=target_model is not None
+        ), self.lm.track_usage() as usages:
+            res = self.lm.generate(
+                target_model=target_model,
+                tools=tools,
+                context=self.context.window(),
+                *args,
+                **kwargs,
+            )
+        for usage in usages:
+            self._count_tokens(usage)
+        return res
+
+    async def agenerate(
+        self,
+        *args,
+        target_model: Union[Type[BaseModel], None] = None,
+        tools: Optional[List[Tool]] = None,
+        **kwargs,
+    ) -> Union[BaseModel, str]:
+        self.stats["prelude_tokens_saved"] += self._omitted_tokens
+        with self.telemetry.span(
+            "lm", mode="generate", structured=target_model is not None
+        ), self.lm.track_usage() as usages:
+            res = await self.lm.agenerate(
+                target_model=target_model,
+                tools=tools,
+                context=self.context.window(),
+                *args,
+                **kwargs,
+            )
+        for usage in usages:
+            self._count_tokens(usage)
+        return res
 
-    iteration_wide_storage: dict = {}
+    async def astream(
+        self,
+        *args,
+        tools: Optional[List[Tool]] = None,
+        **kwargs,
+    ) -> AsyncIterator[StreamChunk]:
+        """Stream a generation over the context window, forwarding every chunk to `on_stream`"""
+        self.stats["prelude_tokens_saved"] += self._omitted_tokens
+        with self.telemetry.span("lm", mode="stream", structured=False):
+            started = time.perf_counter()
+            first = True
+            async with aclosing(
+                self.lm.astream(self.context.window(), tools, *args, **kwargs)
+            ) as stream:
+                async for chunk in stream:
+                    if first:
+                        self.telemetry.observe("lm.ttft", time.perf_counter() - started)
+                        first = False
+                    if chunk["type"] == "done":
+                        self._count_tokens(chunk.get("usage"))
+                    if self.on_stream is not None:
+                        self.on_stream(chunk)
+                    yield chunk
+
+    def _count_tokens(self, usage):
+        for kind, tokens in (usage or {}).items():
+            self.telemetry.count("lm.tokens", tokens, kind=kind)
 
     async def __call__(self, max_iter=None):
         current_iteration = 0
         self.iteration_wide_storage.clear()
-
-        for iteration in range((max_iter or self.config.max_iterations)):
-            self.context.iteration(iteration)
-            await self._prelude()
-            await self._processing()
-            exited = await self._tool_calling()
-
-            if exited:
-                break
-
-            await self._action_execution()
-            await self._state_synthesis()
-
-            # TODO: Implement feedback
-            # self.feedback_system.active_feedback()
-            current_iteration += 1
-            self.iteration_wide_storage.clear()
+        self.exit_call = None
+
+        # Generations of this run are attributed to the loop, e.g. for scheduling fairness
+        session = current_session.set(self.session)
+        try:
+            for iteration in range((max_iter or self.config.max_iterations)):
+                self.context.iteration(iteration)
+                with self.telemetry.span("iteration", iteration=iteration):
+                    await self._prelude()
+                    if self.config.iteration_mode == "single_call":
+                        exited = await self._single_call()
+                    else:
+                        await self._processing()
+                        exited = await self._tool_calling()
+
+                    if exited:
+                        break
+
+                    await self._action_execution()
+                    await self._state_synthesis()
+                    self.context.compact()
+
+                # TODO: Implement feedback
+                # self.feedback_system.active_feedback()
+                current_iteration += 1
+                self.iteration_wide_storage.clear()
+        finally:
+            # A generation that failed mid-stream leaves its speculated actions running
+            self._cancel_speculation()
+            current_session.reset(session)
 
     def current_iteration(self) -> int:
         """Get the current iteration number
@@ -107,55 +247,213 @@ class AgentLoop:
     async def _prelude(self):
         # TODO: Implement module systems to run certain functions before the main loop starts
         recommendation, actions = self.action_system.recommend(self.context.exported)
-        self.context.add(PreludeItem(content=recommendation, tag="Recommendation"))
         self.iteration_wide_storage["rec_actions"] = actions
 
+        if self.config.prelude == "every":
+            self.context.add(PreludeItem(content=recommendation, tag="Recommendation"))
+            return
+
+        names = {tool["function"]["name"] for tool in actions}
+        if self._announced is None:
+            content = recommendation
+        elif self.config.prelude == "diff":
+            content = self._prelude_diff(actions, names)
+        else:
+            content = None
+
+        full = estimate_tokens({"content": recommendation})
+        if content is None:
+            self._omitted_tokens += full
+            return
+
+        # Listings are pinned, compacting them away would leave actions unannounced
+        self.context.add(PreludeItem(content=content, tag="Recommendation"), pinned=True)
+        self._omitted_tokens += full - estimate_tokens({"content": content})
+        self._announced = names
+
+    def _prelude_diff(self, actions: list[dict], names: set[str]) -> Optional[str]:
+        added = [
+            f"- '{tool['function']['name']}': {tool['function']['description']}"
+            for tool in actions
+            if tool["function"]["name"] not in self._announced
+        ]
+        removed = sorted(self._announced - names)
+        if not added and not removed:
+            return None
+
+        sections = []
+        if added:
+            sections.append("Newly recommended actions:\n" + "\n".join(added))
+        if removed:
+            sections.append(
+                "No longer recommended: " + ", ".join(f"'{name}'" for name in removed)
+            )
+        return "\n".join(sections)
+
     @iteration_stage("Processing")
     async def _processing(self):
-        content: str = (
-            self.generate()
-        )  # We do open ended generation for maximum flexibility
-        print(colored(f"[PROCESS]: {content}", "yellow"))
+        # We do open ended generation for maximum flexibility
+        if self.config.stream:
+            async for chunk in self.astream():
+                if chunk["type"] == "done":
+                    content: str = chunk["content"]
+        else:
+            content: str = await self.agenerate()
+
+        logger.info("[PROCESS]: %s", Preview(content, 1000), extra=_PROCESS)
         self.context.add(Processing(content=content))
         pass
 
     @iteration_stage("Tool Calling")
     async def _tool_calling(self) -> bool:
-        tool_calls: List[ToolCall] = self.generate(
-            tools=self.iteration_wide_storage["rec_actions"],
-        )
+        if not self.config.stream:
+            tool_calls: List[ToolCall] = await self.agenerate(
+                tools=self.iteration_wide_storage["rec_actions"],
+            )
+
+            for call in tool_calls:
+                logger.info("[TOOL CALL] : %s", call, extra=_TOOL_CALL)
+
+            for call in tool_calls:
+                if call["function"]["name"] == "exit":
+                    self.exit_call = call
+                    return True
+        else:
+            tool_calls: List[ToolCall] = []
+            async with aclosing(
+                self.astream(tools=self.iteration_wide_storage["rec_actions"])
+            ) as stream:
+                async for chunk in stream:
+                    if chunk["type"] != "tool_call":
+                        continue
+
+                    call = chunk["tool_call"]
+                    logger.info("[TOOL CALL] : %s", call, extra=_TOOL_CALL)
+
+                    # Stop generating as soon as the model decides to exit
+                    if call["function"]["name"] == "exit":
+                        self.exit_call = call
+                        self._cancel_speculation()
+                        return True
+
+                    tool_calls.append(call)
+                    self._speculate(call)
 
-        for call in tool_calls:
-            print(colored(f"[TOOL CALL] : {call}", "cyan"))
+        self.context.add(ToolCalling(calls=tool_calls))
+        self.iteration_wide_storage["tool_calls"] = tool_calls
 
-        for call in tool_calls:
-            if call["function"]["name"] == "exit":
-                return True
+    @iteration_stage("Processing and Tool Calling")
+    async def _single_call(self) -> bool:
+        # Reasoning and tool calls come from one generation, but are still recorded as
+        # a `Processing` item followed by a `ToolCalling` one. Only streams carry both,
+        # so the generation is streamed whatever `config.stream` is.
+        content: list[str] = []
+        tool_calls: List[ToolCall] = []
+        async with aclosing(
+            self.astream(tools=self.iteration_wide_storage["rec_actions"])
+        ) as stream:
+            async for chunk in stream:
+                if chunk["type"] == "content":
+                    content.append(chunk["content"])
+                elif chunk["type"] == "tool_call":
+                    call = chunk["tool_call"]
+                    logger.info("[TOOL CALL] : %s", call, extra=_TOOL_CALL)
+
+                    if call["function"]["name"] == "exit":
+                        self.exit_call = call
+                        break
+
+                    tool_calls.append(call)
+                    self._speculate(call)
+
+        logger.info("[PROCESS]: %s", Preview("".join(content), 1000), extra=_PROCESS)
+        self.context.add(Processing(content="".join(content)))
+        if self.exit_call is not None:
+            self._cancel_speculation()
+            return True
 
         self.context.add(ToolCalling(calls=tool_calls))
         self.iteration_wide_storage["tool_calls"] = tool_calls
+        return False
+
+    def _speculate(self, call: ToolCall):
+        """Start executing a streamed call right away, if its action allows it"""
+        if not self.config.speculative_execution:
+            return
+
+        action = self.action_system.lookup(call["function"]["name"])
+        if not isinstance(action, Action) or not action.metadata.get("speculative"):
+            return
+        try:
+            args = action.args(**json.loads(call["function"]["arguments"]))
+        except (ValueError, TypeError):
+            return  # Left to the regular execution, which reports the error
+
+        speculated = self.iteration_wide_storage.setdefault("speculated", {})
+        speculated[call["id"]] = asyncio.create_task(
+            self.action_system.execute(
+                call["function"]["name"], args, telemetry=self.telemetry
+            )
+        )
+
+    def _cancel_speculation(self):
+        for task in self.iteration_wide_storage.pop("speculated", {}).values():
+            task.cancel()
 
     @iteration_stage("Action Execution")
     async def _action_execution(self):
         calls: List[ToolCall] = self.iteration_wide_storage["tool_calls"]
+        speculated: dict[str, asyncio.Task] = self.iteration_wide_storage.pop(
+            "speculated", {}
+        )
 
-        invocations: List[ActionInvocationWithArgs] = [
-            ActionInvocationWithArgs(
-                action=action_name,
-                args=self.action_system.actions.traverse(action_name).args(
-                    **json.loads(call["function"]["arguments"])
-                ),
-                id=call["id"],
+        invocations: List[ActionInvocationWithArgs] = []
+        errors: dict[str, str] = {}  # Calls that cannot run, reported to the model as their result
+        for call in calls:
+            if call["id"] in speculated:
+                continue
+
+            action_name = call["function"]["name"]
+            action = self.action_system.lookup(action_name)
+            if action is None:
+                errors[call["id"]] = "A nonexistent action was called."
+                continue
+            if not isinstance(action, Action):
+                errors[call["id"]] = "A group was called, not an action."
+                continue
+            try:
+                args = action.args(**json.loads(call["function"]["arguments"]))
+            except (ValueError, TypeError) as e:
+                errors[call["id"]] = repr(e)
+                continue
+            invocations.append(
+                ActionInvocationWithArgs(action=action_name, args=args, id=call["id"])
             )
-            for call in calls
-            if (action_name := call["function"]["name"].replace("-", "."))
-        ]
 
-        res = await self.action_system.invoke_actions(invocations, method="linear")
+        res = await self.action_system.invoke_actions(
+            invocations,
+            method=self.config.action_execution,
+            max_concurrency=self.config.max_concurrent_actions,
+            telemetry=self.telemetry,
+        )
+        if speculated or errors:
+            # Speculated calls were started while the generation went on, merged back in call order
+            done = dict(zip(speculated, await asyncio.gather(*speculated.values())))
+            outcomes = {**res, **errors, **done}
+            res = {call["id"]: outcomes[call["id"]] for call in calls}
 
+        names = {call["id"]: call["function"]["name"] for call in calls}
         for key in res.keys():
-            self.context.add(Results(results=stringify(res[key]), id=key))
-            print(colored(f"[RESULT] : {str(res[key])[:200]}", "magenta"))
+            content = self.action_system.serialize(
+                names[key], res[key], max_chars=self.config.max_result_chars
+            )
+            if self.result_store is not None:
+                content = self.result_store.offload(content)
+            self.context.add(Results(results=content, id=key))
+
+        if logger.isEnabledFor(logging.INFO):
+            for key in res.keys():
+                logger.info("[RESULT] : %s", Preview(res[key]), extra=_RESULT)
 
         # TODO: Implement action execution
         pass
@@ -0,0 +1,122 @@
+import time
+from contextlib import contextmanager
+from typing import Any, Iterator, Literal, NotRequired, Optional, TypedDict
+
+from chetan.core.telemetry.exporters import (
+    Exporter,
+    JSONLExporter,
+    MemoryExporter,
+    PrometheusExporter,
+)
+
+
+class Span(TypedDict):
+    name: str
+    start: float  # Unix time
+    duration: float  # Seconds
+    tags: dict[str, Any]
+    error: NotRequired[str]  # Type of the exception that ended the span
+
+
+class Metric(TypedDict):
+    name: str
+    kind: Literal["counter", "histogram"]
+    value: float
+    time: float  # Unix time
+    tags: dict[str, Any]
+
+
+class Telemetry:
+    """Records spans and metrics, and hands them to exporters
+
+    Without exporters nothing is recorded, so instrumented code costs close to nothing.
+    Bound copies (see `bind`) share the exporters and add their tags to everything they record.
+
+    Recorded by the agent loop, tagged with `agent`:
+    - `iteration` and `stage` spans, per iteration and per loop stage
+    - `action` spans, per executed action
+    - `lm` spans, per generation, and the `lm.ttft` histogram for streamed ones
+    - the `lm.tokens` counter, by `kind` of token
+    - the `errors` counter, by `span` and `error` type
+    """
+
+    exporters: list[Exporter]
+    tags: dict[str, Any]
+
+    def __init__(self, exporters: Optional[list[Exporter]] = None, **tags):
+        """
+        Args:
+            exporters (list[Exporter], optional): Where spans and metrics are sent
+            **tags: Tags added to every span and metric
+        """
+        self.exporters = exporters if exporters is not None else []
+        self.tags = tags
+
+    def bind(self, **tags) -> "Telemetry":
+        """A copy sharing the exporters, with additional tags"""
+        return Telemetry(self.exporters, **{**self.tags, **tags})
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.exporters)
+
+    @contextmanager
+    def span(self, name: str, **tags) -> Iterator[dict[str, Any]]:
+        """Time the enclosed block
+
+        Exceptions escaping the block are recorded on the span and counted in `errors`.
+        Yields the tags of the span, which can still be added to.
+        """
+        if not self.exporters:
+            yield tags
+            return
+
+        tags = {**self.tags, **tags}
+        start, started = time.time(), time.perf_counter()
+        span = Span(name=name, start=start, duration=0.0, tags=tags)
+        try:
+            yield tags
+        except Exception as e:
+            span["error"] = type(e).__name__
+            self.count("errors", span=name, error=span["error"])
+            raise
+        finally:
+            span["duration"] = time.perf_counter() - started
+            for exporter in self.exporters:
+                exporter.export_span(span)
+
+    def count(self, name: str, value: float = 1, **tags):
+        """Add to a counter"""
+        if self.exporters:
+            self._emit(name, "counter", value, tags)
+
+    def observe(self, name: str, value: float, **tags):
+        """Record a measurement, e.g. a latency in seconds"""
+        if self.exporters:
+            self._emit(name, "histogram", value, tags)
+
+    def _emit(self, name: str, kind: str, value: float, tags: dict):
+        metric = Metric(
+            name=name, kind=kind, value=value, time=time.time(), tags={**self.tags, **tags}
+        )
+        for exporter in self.exporters:
+            exporter.export_metric(metric)
+
+    def flush(self):
+        for exporter in self.exporters:
+            exporter.flush()
+
+    def close(self):
+        for exporter in self.exporters:
+            exporter.close()
+
+
+__all__ = [
+    "Exporter",
+    "JSONLExporter",
+    "MemoryExporter",
+    "Metric",
+    "PrometheusExporter",
+    "Span",
+    "Telemetry",
+]
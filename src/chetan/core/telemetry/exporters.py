@@ -0,0 +1,195 @@
+import json
+import os
+import re
+import threading
+from abc import ABC, abstractmethod
+from typing import TYPE_CHECKING, Iterable, Optional
+
+if TYPE_CHECKING:
+    from chetan.core.telemetry import Metric, Span
+
+
+class Exporter(ABC):
+    """Destination of the spans and metrics recorded by a `Telemetry`"""
+
+    @abstractmethod
+    def export_span(self, span: "Span"): ...
+
+    @abstractmethod
+    def export_metric(self, metric: "Metric"): ...
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.flush()
+
+
+class MemoryExporter(Exporter):
+    """Keeps every span and metric in memory, for inspection and tests"""
+
+    def __init__(self):
+        self.spans: list["Span"] = []
+        self.metrics: list["Metric"] = []
+
+    def export_span(self, span: "Span"):
+        self.spans.append(span)
+
+    def export_metric(self, metric: "Metric"):
+        self.metrics.append(metric)
+
+    def durations(self, name: str, **tags) -> list[float]:
+        """Durations of the spans with a name and tags"""
+        return [
+            span["duration"]
+            for span in self.spans
+            if span["name"] == name
+            and all(span["tags"].get(k) == v for k, v in tags.items())
+        ]
+
+    def total(self, name: str, **tags) -> float:
+        """Sum of the values of the metrics with a name and tags"""
+        return sum(
+            metric["value"]
+            for metric in self.metrics
+            if metric["name"] == name
+            and all(metric["tags"].get(k) == v for k, v in tags.items())
+        )
+
+    def clear(self):
+        self.spans.clear()
+        self.metrics.clear()
+
+
+class JSONLExporter(Exporter):
+    """Appends spans and metrics to a file, one JSON object per line
+
+    Lines are buffered and written every `buffer_size` records, on `flush` and on `close`.
+    """
+
+    def __init__(self, path: str, buffer_size: int = 64):
+        """
+        Args:
+            path (str): File to append to
+            buffer_size (int, optional): Number of records buffered before they are written
+        """
+        self.path = path
+        self.buffer_size = buffer_size
+        self._buffer: list[str] = []
+        self._lock = threading.Lock()
+
+    def export_span(self, span: "Span"):
+        self._write({"type": "span", **span})
+
+    def export_metric(self, metric: "Metric"):
+        self._write({"type": "metric", **metric})
+
+    def _write(self, record: dict):
+        line = json.dumps(record, default=str)
+        with self._lock:
+            self._buffer.append(line)
+            if len(self._buffer) >= self.buffer_size:
+                self._flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        if not self._buffer:
+            return
+        with open(self.path, "a") as f:
+            f.write("\n".join(self._buffer) + "\n")
+        self._buffer.clear()
+
+
+_INVALID = re.compile(r"[^a-zA-Z0-9_]")
+
+
+def _escape(value) -> str:
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class PrometheusExporter(Exporter):
+    """Aggregates spans and metrics in the Prometheus text exposition format
+
+    Span durations become `<prefix>_<span>_duration_seconds` summaries, counters become
+    `<prefix>_<name>_total` and histograms `<prefix>_<name>` summaries. Tags become labels,
+    except high cardinality ones listed in `exclude_labels`, by default iteration numbers and
+    the random names of agents. Serve `render()` from an HTTP endpoint, or `write` it for the
+    node exporter textfile collector.
+    """
+
+    def __init__(
+        self,
+        prefix: str = "chetan",
+        exclude_labels: Iterable[str] = ("iteration", "agent"),
+    ):
+        """
+        Args:
+            prefix (str, optional): Prefix of every metric name
+            exclude_labels (Iterable[str], optional): Tags not turned into labels
+        """
+        self.prefix = prefix
+        self.exclude_labels = frozenset(exclude_labels)
+        # Family name -> (type, labels -> [count, sum])
+        self._families: dict[str, tuple[str, dict[tuple, list[float]]]] = {}
+        self._lock = threading.Lock()
+
+    def _name(self, name: str) -> str:
+        return _INVALID.sub("_", f"{self.prefix}_{name}")
+
+    def _labels(self, tags: dict) -> tuple:
+        return tuple(
+            sorted(
+                (_INVALID.sub("_", key), _escape(value))
+                for key, value in tags.items()
+                if key not in self.exclude_labels
+            )
+        )
+
+    def _add(self, family: str, kind: str, labels: tuple, value: float):
+        with self._lock:
+            _, series = self._families.setdefault(family, (kind, {}))
+            entry = series.setdefault(labels, [0, 0.0])
+            entry[0] += 1
+            entry[1] += value
+
+    def export_span(self, span: "Span"):
+        self._add(
+            self._name(f"{span['name']}_duration_seconds"),
+            "summary",
+            self._labels(span["tags"]),
+            span["duration"],
+        )
+
+    def export_metric(self, metric: "Metric"):
+        if metric["kind"] == "counter":
+            family, kind = self._name(f"{metric['name']}_total"), "counter"
+        else:
+            family, kind = self._name(metric["name"]), "summary"
+        self._add(family, kind, self._labels(metric["tags"]), metric["value"])
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            for family, (kind, series) in sorted(self._families.items()):
+                lines.append(f"# TYPE {family} {kind}")
+                for labels, (count, total) in series.items():
+                    rendered = ",".join(f'{k}="{v}"' for k, v in labels)
+                    rendered = f"{{{rendered}}}" if rendered else ""
+                    if kind == "counter":
+                        lines.append(f"{family}{rendered} {total}")
+                    else:
+                        lines.append(f"{family}_count{rendered} {count}")
+                        lines.append(f"{family}_sum{rendered} {total}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: Optional[str] = None):
+        """Atomically write the exposition to a file"""
+        path = path or f"{self.prefix}.prom"
+        with open(f"{path}.tmp", "w") as f:
+            f.write(self.render())
+        os.replace(f"{path}.tmp", path)
@@ -1,4 +1,4 @@
-from typing import TypedDict
+from typing import Literal, NotRequired, TypedDict
 
 
 class FunctionCall(TypedDict):
@@ -10,3 +10,24 @@ class ToolCall(TypedDict):
     id: str
     function: FunctionCall
     type: str = "function"
+
+
+class Usage(TypedDict):
+    prompt_tokens: int
+    completion_tokens: int
+    cached_prompt_tokens: int  # Prompt tokens served from the provider's prompt cache
+
+
+class StreamChunk(TypedDict):
+    """A single event of a streamed generation
+
+    `content` chunks carry a text delta, `tool_call` chunks carry a fully assembled call,
+    and the final `done` chunk carries the whole content, every tool call and the token usage
+    when the provider reports it.
+    """
+
+    type: Literal["content", "tool_call", "done"]
+    content: NotRequired[str]
+    tool_call: NotRequired[ToolCall]
+    tool_calls: NotRequired[list[ToolCall]]
+    usage: NotRequired[Usage]
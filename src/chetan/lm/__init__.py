@@ -1,20 +1,211 @@
+import asyncio
+import importlib
 from abc import ABC, abstractmethod
-from typing import Type, TypedDict, Union
+from contextlib import aclosing, asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import TYPE_CHECKING, AsyncIterator, Iterator, Literal, Optional, Type, TypedDict, Union
 
 from pydantic import BaseModel
 
+from chetan.core.types import StreamChunk, Usage
+from chetan.lm.cache import ResponseCache, decode_response, encode_response, request_key
+from chetan.utils import estimate_tokens
+
+if TYPE_CHECKING:
+    from chetan.lm.limiter import RateLimiter
+
+
+# Session the current generation belongs to, set by `AgentLoop` to its id.
+# Backends serving many sessions at once (see `Scheduler`) key their queues and state on it.
+current_session: ContextVar[str] = ContextVar("chetan_session", default="default")
+
+# Lists collecting the usage of the generations made in the current context, with the
+# model they are collected for, see `LanguageModel.track_usage`
+_usage_sinks: ContextVar[tuple[tuple["LanguageModel", list[Usage]], ...]] = ContextVar(
+    "chetan_usage_sinks", default=()
+)
+
 
 class RawMessage(TypedDict):
     content: str
     role: str
 
 
+def usage_from(usage) -> Optional[Usage]:
+    """Read the `usage` of an OpenAI-compatible completion"""
+    if usage is None:
+        return None
+
+    details = getattr(usage, "prompt_tokens_details", None)
+    return Usage(
+        prompt_tokens=usage.prompt_tokens or 0,
+        completion_tokens=usage.completion_tokens or 0,
+        cached_prompt_tokens=getattr(details, "cached_tokens", None) or 0,
+    )
+
+
+def total_usage(usages: list[Usage]) -> Optional[Usage]:
+    """Sum of reported usages, None when there are none"""
+    if not usages:
+        return None
+    return Usage(
+        prompt_tokens=sum(u["prompt_tokens"] for u in usages),
+        completion_tokens=sum(u["completion_tokens"] for u in usages),
+        cached_prompt_tokens=sum(u["cached_prompt_tokens"] for u in usages),
+    )
+
+
+def _completion_chunks(res, tools) -> list[StreamChunk]:
+    if tools:
+        return [StreamChunk(type="tool_call", tool_call=call) for call in res] + [
+            StreamChunk(type="done", content="", tool_calls=res)
+        ]
+    return [
+        StreamChunk(type="content", content=res),
+        StreamChunk(type="done", content=res, tool_calls=[]),
+    ]
+
+
 class LanguageModel(ABC):
-    def __init__(self, *args, **kwargs):
+    usage: dict[str, int]  # Token usage totals over every raw generation
+    last_usage: Optional[Usage]
+
+    cache: Optional[ResponseCache]
+    cache_mode: Literal["deterministic", "always"]
+    limiter: Optional["RateLimiter"]
+
+    def __init__(
+        self,
+        *args,
+        cache: Optional[ResponseCache] = None,
+        cache_mode: Literal["deterministic", "always"] = "deterministic",
+        limiter: Optional["RateLimiter"] = None,
+        **kwargs,
+    ):
+        """
+        Args:
+            cache (ResponseCache, optional): Serve identical requests from this cache instead of the provider
+            cache_mode (str, optional): "deterministic" only caches requests made with `temperature=0`,
+                "always" caches every request
+            limiter (RateLimiter, optional): Paces the requests of every session using the model to its quotas
+        """
         super().__init__()
         self.args = args
         self.kwargs = kwargs
-    
+        self.cache = cache
+        self.cache_mode = cache_mode
+        self.limiter = limiter
+        self.usage = {
+            "requests": 0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "cached_prompt_tokens": 0,
+        }
+        self.last_usage = None
+
+    def _cache_identity(self) -> str:
+        """Identifies the model in cache keys"""
+        return f"{type(self).__name__}:{getattr(self, 'model', '')}"
+
+    def _temperature(self, kwargs: dict) -> Optional[float]:
+        """The sampling temperature of a request"""
+        return kwargs.get("temperature")
+
+    def _cache_key(
+        self, context, target_model, tools, iterable: bool, args: tuple, kwargs: dict
+    ) -> Optional[str]:
+        if self.cache is None:
+            return None
+        # Sampled generations are expected to differ between calls
+        if self.cache_mode == "deterministic" and self._temperature(kwargs) != 0:
+            return None
+        if target_model is not None and not (
+            isinstance(target_model, type) and issubclass(target_model, BaseModel)
+        ):
+            return None
+
+        return request_key(
+            self._cache_identity(), context, tools, target_model, iterable, args, kwargs
+        )
+
+    def _estimate(self, context: list[RawMessage], kwargs: dict) -> int:
+        max_tokens = kwargs.get("max_tokens") or kwargs.get("max_completion_tokens")
+        return self.limiter.estimate(sum(map(estimate_tokens, context)), max_tokens)
+
+    @contextmanager
+    def track_usage(self) -> Iterator[list[Usage]]:
+        """Collect the usage reported by the generations of this model made within the block
+
+        Only generations made from the current context are collected, e.g. from the current
+        task or the threads it offloads to, so concurrent sessions sharing the model each
+        see their own. `last_usage` is overwritten by whichever request ends last.
+        """
+        usages: list[Usage] = []
+        token = _usage_sinks.set(_usage_sinks.get() + ((self, usages),))
+        try:
+            yield usages
+        finally:
+            _usage_sinks.reset(token)
+
+    @contextmanager
+    def _limited(self, context: list[RawMessage], kwargs: dict):
+        if self.limiter is None:
+            yield
+            return
+
+        ticket = self.limiter.acquire(self._estimate(context, kwargs))
+        usages, error = [], None
+        try:
+            with self.track_usage() as usages:
+                yield
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            self.limiter.release(ticket, total_usage(usages), error)
+
+    @asynccontextmanager
+    async def _alimited(
+        self,
+        context: list[RawMessage],
+        kwargs: dict,
+        usages: Optional[list[Usage]] = None,
+    ):
+        """
+        Args:
+            usages (list[Usage], optional): Filled by the caller with the usage of the request.
+                Streams pass it, since a context variable set in a generator leaks to its consumer.
+        """
+        if self.limiter is None:
+            yield
+            return
+
+        ticket = await self.limiter.aacquire(self._estimate(context, kwargs))
+        error = None
+        try:
+            if usages is None:
+                with self.track_usage() as usages:
+                    yield
+            else:
+                yield
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            self.limiter.release(ticket, total_usage(usages or []), error)
+
+    def _record_usage(self, usage: Optional[Usage]):
+        if usage is None:
+            return
+
+        self.last_usage = usage
+        self.usage["requests"] += 1
+        for key, value in usage.items():
+            self.usage[key] += value
+        for lm, usages in _usage_sinks.get():
+            if lm is self:
+                usages.append(usage)
+
     @abstractmethod
     def _generate_structured(
         self,
@@ -28,6 +219,31 @@ class LanguageModel(ABC):
     @abstractmethod
     def _generate_raw(self, context: list[RawMessage], *args, **kwargs): ...
 
+    async def _agenerate_structured(
+        self,
+        context: list[RawMessage],
+        target_model: Type[BaseModel],
+        iterable: bool,
+        *args,
+        **kwargs,
+    ):
+        # Backends without a native async client fall back to a worker thread,
+        # so the event loop is never blocked by a sync HTTP call
+        return await asyncio.to_thread(
+            self._generate_structured, context, target_model, iterable, *args, **kwargs
+        )
+
+    async def _agenerate_raw(self, context: list[RawMessage], *args, **kwargs):
+        return await asyncio.to_thread(self._generate_raw, context, *args, **kwargs)
+
+    async def _astream_raw(
+        self, context: list[RawMessage], *args, tools: list[dict] = None, **kwargs
+    ) -> AsyncIterator[StreamChunk]:
+        # Backends without streaming support emit the whole completion at once
+        res = await self._agenerate_raw(context, *args, tools=tools, **kwargs)
+        for chunk in _completion_chunks(res, tools):
+            yield chunk
+
     def generate(
         self,
         context: list[RawMessage],
@@ -38,12 +254,152 @@ class LanguageModel(ABC):
         **kwargs,
     ):
         kwargs = {**self.kwargs, **kwargs}
-        if target_model is None:
-            return self._generate_raw(context, *args, tools=tools, **kwargs)
+        key = self._cache_key(context, target_model, tools, iterable, args, kwargs)
+        if key is not None and (cached := self.cache.get(key)) is not None:
+            return decode_response(cached, target_model, iterable)
+
+        if target_model is not None and not issubclass(target_model, BaseModel):
+            return "Invalid target model"
+
+        with self._limited(context, kwargs):
+            if target_model is None:
+                res = self._generate_raw(context, *args, tools=tools, **kwargs)
+            else:
+                res = self._generate_structured(
+                    context, target_model, iterable, *args, **kwargs
+                )
+
+        if key is not None:
+            self.cache.set(key, encode_response(res))
+        return res
+
+    async def agenerate(
+        self,
+        context: list[RawMessage],
+        target_model: Union[Type[BaseModel], None] = None,
+        tools: list[dict] = None,
+        *args,
+        iterable: bool = False,
+        **kwargs,
+    ):
+        """Async counterpart of `generate`, safe to await from the agent loop"""
+        kwargs = {**self.kwargs, **kwargs}
+        key = self._cache_key(context, target_model, tools, iterable, args, kwargs)
+        if key is not None and (cached := self.cache.get(key)) is not None:
+            return decode_response(cached, target_model, iterable)
+
+        if target_model is not None and not issubclass(target_model, BaseModel):
+            return "Invalid target model"
+
+        async with self._alimited(context, kwargs):
+            if target_model is None:
+                res = await self._agenerate_raw(context, *args, tools=tools, **kwargs)
+            else:
+                res = await self._agenerate_structured(
+                    context, target_model, iterable, *args, **kwargs
+                )
+
+        if key is not None:
+            self.cache.set(key, encode_response(res))
+        return res
+
+    async def astream(
+        self,
+        context: list[RawMessage],
+        tools: list[dict] = None,
+        *args,
+        **kwargs,
+    ) -> AsyncIterator[StreamChunk]:
+        """Stream a raw generation
+
+        Yields content deltas as they arrive and each tool call as soon as its arguments
+        are complete, followed by a final `done` chunk. Closing the iterator early
+        (e.g. after an `exit` tool call) stops the generation.
+
+        Cached completions are replayed at once. A completion is only cached when the
+        stream is consumed until its end.
+
+        Args:
+            context (list[RawMessage]): The messages to generate from
+            tools (list[dict], optional): Tools made available to the model
+        """
+        kwargs = {**self.kwargs, **kwargs}
+        key = self._cache_key(context, None, tools, False, args, kwargs)
+        if key is not None and (cached := self.cache.get(key)) is not None:
+            for chunk in _completion_chunks(decode_response(cached, None, False), tools):
+                yield chunk
+            return
+
+        usages: list[Usage] = []
+        async with self._alimited(context, kwargs, usages), aclosing(
+            self._astream_raw(context, *args, tools=tools, **kwargs)
+        ) as stream:
+            async for chunk in stream:
+                if chunk["type"] == "done":
+                    if (usage := chunk.get("usage")) is not None:
+                        usages.append(usage)
+                    self._record_usage(usage)
+                    if key is not None:
+                        res = chunk["tool_calls"] if tools else chunk["content"]
+                        self.cache.set(key, encode_response(res))
+                yield chunk
+
+
+# Backends by name, each imported when first resolved, so that importing chetan only
+# loads the provider SDKs actually used
+_BACKENDS: dict[str, Union[str, Type[LanguageModel]]] = {
+    "openai": "chetan.lm.openai:OpenAILM",
+    "groq": "chetan.lm.groq:GroqLM",
+    "ollama": "chetan.lm.ollama:OllamaLM",
+    "llama_cpp": "chetan.lm.llama_cpp:LlamaCppLM",
+}
+_CLASS_NAMES = {
+    "OpenAILM": "openai",
+    "GroqLM": "groq",
+    "OllamaLM": "ollama",
+    "LlamaCppLM": "llama_cpp",
+}
+
+
+def register_backend(name: str, backend: Union[str, Type[LanguageModel]]):
+    """Make a backend resolvable by name
+
+    Args:
+        name (str): Name of the backend, e.g. in configuration files
+        backend (str | Type[LanguageModel]): The class, or its `module:Class` path to import it lazily
+    """
+    _BACKENDS[name] = backend
+
+
+def get_backend(name: str) -> Type[LanguageModel]:
+    """Resolve a backend class by name, importing its module on first use"""
+    try:
+        backend = _BACKENDS[name]
+    except KeyError:
+        raise ValueError(
+            f"Unknown backend {name}, expected one of {sorted(_BACKENDS)}"
+        ) from None
+    if isinstance(backend, type):
+        return backend
+
+    module, _, attr = backend.partition(":")
+    try:
+        cls = getattr(importlib.import_module(module), attr)
+    except ImportError as e:
+        raise ImportError(
+            f"The {name} backend needs a dependency that is not installed: {e}"
+        ) from e
+    _BACKENDS[name] = cls
+    return cls
+
+
+def load_backend(name: str, *args, **kwargs) -> LanguageModel:
+    """Build a backend by name, e.g. `load_backend("openai", OpenAI(), "gpt-4o-mini")`"""
+    return get_backend(name)(*args, **kwargs)
 
-        if issubclass(target_model, BaseModel):
-            return self._generate_structured(
-                context, target_model, iterable, *args, **kwargs
-            )
 
-        return "Invalid target model"
+def __getattr__(name: str):
+    # `from chetan.lm import OpenAILM` imports the backend module only then
+    if name in _CLASS_NAMES:
+        return get_backend(_CLASS_NAMES[name])
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
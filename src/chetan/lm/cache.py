@@ -0,0 +1,277 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Optional, Type
+
+from pydantic import BaseModel
+
+
+class ResponseCache(ABC):
+    """Store of language model responses, addressed by the hash of their request
+
+    Entries are JSON strings, see `encode_response`. Every backend counts hits, misses,
+    evictions (to stay within its size limits) and expirations (past their `ttl`) in `stats`.
+    """
+
+    ttl: Optional[float]  # Seconds an entry stays valid, forever when not set
+    stats: dict[str, int]
+
+    def __init__(self, ttl: Optional[float] = None):
+        self.ttl = ttl
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        """Look an entry up, counting the hit or miss"""
+        with self._lock:
+            data = self._get(key)
+        self.stats["hits" if data is not None else "misses"] += 1
+        return data
+
+    def set(self, key: str, data: str):
+        with self._lock:
+            self._set(key, data)
+
+    def _expired(self, created: float) -> bool:
+        return self.ttl is not None and time.time() - created > self.ttl
+
+    @abstractmethod
+    def _get(self, key: str) -> Optional[str]: ...
+
+    @abstractmethod
+    def _set(self, key: str, data: str): ...
+
+    @abstractmethod
+    def clear(self): ...
+
+
+class MemoryResponseCache(ResponseCache):
+    """Least recently used responses, kept in memory"""
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        max_bytes: Optional[int] = None,
+        ttl: Optional[float] = None,
+    ):
+        """
+        Args:
+            max_entries (int, optional): Number of responses kept
+            max_bytes (int, optional): Total size of the kept responses, unbounded when not set
+            ttl (float, optional): Seconds a response stays valid, forever when not set
+        """
+        super().__init__(ttl)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries: OrderedDict[str, tuple[float, str]] = OrderedDict()
+
+    def _get(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        created, data = entry
+        if self._expired(created):
+            self._drop(key)
+            self.stats["expirations"] += 1
+            return None
+
+        self._entries.move_to_end(key)
+        return data
+
+    def _set(self, key: str, data: str):
+        if key in self._entries:
+            self._drop(key)
+        self._entries[key] = (time.time(), data)
+        self.size += len(data)
+
+        while self._entries and (
+            len(self._entries) > self.max_entries
+            or (self.max_bytes is not None and self.size > self.max_bytes)
+        ):
+            self._drop(next(iter(self._entries)))
+            self.stats["evictions"] += 1
+
+    def _drop(self, key: str):
+        _, data = self._entries.pop(key)
+        self.size -= len(data)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class DiskResponseCache(ResponseCache):
+    """Responses kept in a SQLite database, so they survive restarts and are shared between processes
+
+    Least recently used responses are evicted once the database holds more than `max_bytes`.
+    The size is read from the database, so it counts the responses written by every process.
+    """
+
+    def __init__(
+        self,
+        path: str = "chetan_lm_cache.db",
+        max_bytes: int = 256 * 1024 * 1024,
+        ttl: Optional[float] = None,
+    ):
+        """
+        Args:
+            path (str, optional): Database file
+            max_bytes (int, optional): Total size of the kept responses
+            ttl (float, optional): Seconds a response stays valid, forever when not set
+        """
+        super().__init__(ttl)
+        self.max_bytes = max_bytes
+
+        # Async generations look the cache up from the event loop, sync ones from any thread
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY, data TEXT, size INTEGER, created REAL, accessed REAL
+            );
+            CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed);
+            """
+        )
+
+    @property
+    def size(self) -> int:
+        """Total size of the kept responses"""
+        (size,) = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()
+        return size
+
+    def _get(self, key: str) -> Optional[str]:
+        row = self._db.execute(
+            "SELECT data, created FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+
+        data, created = row
+        with self._db:
+            if self._expired(created):
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.stats["expirations"] += 1
+                return None
+
+            self._db.execute(
+                "UPDATE responses SET accessed = ? WHERE key = ?", (time.time(), key)
+            )
+        return data
+
+    def _set(self, key: str, data: str):
+        now = time.time()
+        with self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                (key, data, len(data), now, now),
+            )
+            self._evict()
+
+    def _evict(self):
+        # One statement keeps the most recently used responses fitting in `max_bytes`, whichever
+        # process wrote the others
+        evicted = self._db.execute(
+            """
+            DELETE FROM responses WHERE key IN (
+                SELECT key FROM (
+                    SELECT key, SUM(size) OVER (ORDER BY accessed DESC, key) AS kept
+                    FROM responses
+                ) WHERE kept > ?
+            )
+            """,
+            (self.max_bytes,),
+        ).rowcount
+        self.stats["evictions"] += evicted
+
+    def clear(self):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM responses")
+
+    def close(self):
+        self._db.close()
+
+
+@lru_cache(maxsize=256)
+def _schema(target_model: Type[BaseModel]) -> dict:
+    return target_model.model_json_schema()
+
+
+def _canonical(value: Any):
+    if isinstance(value, BaseModel):
+        return value.model_dump(mode="json")
+    if isinstance(value, (set, frozenset)):
+        return sorted(value, key=str)
+    if isinstance(value, type) and issubclass(value, BaseModel):
+        return _schema(value)
+    return str(value)
+
+
+def request_key(
+    model: str,
+    context: list,
+    tools: Optional[list[dict]],
+    target_model: Optional[Type[BaseModel]],
+    iterable: bool,
+    args: tuple,
+    kwargs: dict,
+) -> str:
+    """Canonical hash of a generation request
+
+    Requests that only differ in dict key order or JSON formatting share a key.
+    """
+    payload = {
+        "model": model,
+        "messages": context,
+        "tools": tools,
+        "schema": _schema(target_model) if target_model is not None else None,
+        "iterable": iterable,
+        "args": args,
+        "kwargs": kwargs,
+    }
+    data = json.dumps(
+        payload,
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False,
+        default=_canonical,
+    )
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def encode_response(result) -> str:
+    """Serialize a raw or structured generation result for a `ResponseCache`"""
+    if isinstance(result, BaseModel):
+        value = result.model_dump(mode="json")
+    elif isinstance(result, list):
+        value = [
+            item.model_dump(mode="json") if isinstance(item, BaseModel) else item
+            for item in result
+        ]
+    else:
+        value = result
+    return json.dumps({"value": value}, ensure_ascii=False)
+
+
+def decode_response(
+    data: str, target_model: Optional[Type[BaseModel]], iterable: bool
+):
+    """Rebuild the result `encode_response` serialized"""
+    value = json.loads(data)["value"]
+    if target_model is None:
+        return value
+    if iterable:
+        return [target_model.model_validate(item) for item in value]
+    return target_model.model_validate(value)
@@ -0,0 +1,282 @@
+import asyncio
+import math
+import re
+import threading
+import time
+from typing import Optional
+
+import httpx
+
+from chetan.core.types import Usage
+from chetan.lm.transport import retry_after_seconds
+
+
+class _Bucket:
+    """Token bucket refilled continuously up to its capacity"""
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait(self, amount: float, now: float) -> float:
+        """Seconds until `amount` can be taken, larger amounts only need a full bucket"""
+        self.refill(now)
+        missing = min(amount, self.capacity) - self.level
+        return missing / self.rate if missing > 0 else 0.0
+
+
+class _Ticket:
+    __slots__ = ("tokens", "acquired")
+
+    def __init__(self, tokens: int):
+        self.tokens = tokens
+        self.acquired = time.monotonic()
+
+
+_DURATION = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_UNITS = {"h": 3600, "m": 60, "s": 1, "ms": 0.001}
+
+
+def _duration(value: Optional[str]) -> Optional[float]:
+    """Parse the reset durations of rate limit headers, e.g. `6m0s`, `1.5s` or `20ms`"""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION.findall(value)
+    return sum(float(n) * _UNITS[unit] for n, unit in parts) if parts else None
+
+
+def _int_header(response: httpx.Response, name: str) -> Optional[int]:
+    try:
+        return int(float(response.headers[name]))
+    except (KeyError, ValueError):
+        return None
+
+
+class RateLimiter:
+    """Client-side rate limiting shared by every session of a language model
+
+    Requests wait for room in a requests-per-minute and a tokens-per-minute bucket, where
+    tokens are the estimated prompt tokens plus the expected completion tokens, corrected
+    with the reported usage once the request is done. The number of requests in flight is
+    capped by a limit adapted AIMD style: it grows by one per limit's worth of successful
+    requests, and halves on a rate limited (429) response, at most once per `cooldown`.
+
+    Given to a backend with a `Transport`, the limiter also reads every response (see
+    `observe`): it pauses until the quota resets when `x-ratelimit-remaining-*` reaches
+    zero, and follows `Retry-After` on 429s.
+
+    `stats` reports the requests queued, in flight and throttled, and how long they waited.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None,
+        max_concurrency: int = 32,
+        min_concurrency: int = 1,
+        completion_tokens: int = 256,
+        cooldown: float = 1.0,
+    ):
+        """
+        Args:
+            requests_per_minute (float, optional): Request quota. Unlimited when not set.
+            tokens_per_minute (float, optional): Prompt and completion token quota. Unlimited when not set.
+            max_concurrency (int, optional): Upper bound of the adaptive concurrency limit, and its start
+            min_concurrency (int, optional): Lower bound of the adaptive concurrency limit
+            completion_tokens (int, optional): Completion tokens expected from requests without `max_tokens`
+            cooldown (float, optional): Seconds after a decrease of the concurrency limit during which
+                further rate limited responses, from the same burst, do not decrease it again
+        """
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.completion_tokens = completion_tokens
+        self.cooldown = cooldown
+
+        self._requests = _Bucket(requests_per_minute) if requests_per_minute else None
+        self._tokens = _Bucket(tokens_per_minute) if tokens_per_minute else None
+        self._limit = float(max_concurrency)
+        self._in_flight = 0
+        self._paused_until = 0.0
+        self._decreased = -math.inf
+
+        self._cond = threading.Condition()
+        self._waiters: list[tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+        self._stats = {
+            "acquired": 0,
+            "queued": 0,
+            "throttled": 0,
+            "wait_total": 0.0,
+            "wait_max": 0.0,
+        }
+
+    @property
+    def concurrency(self) -> int:
+        """Current limit of requests in flight"""
+        return int(self._limit)
+
+    def estimate(self, prompt_tokens: int, max_tokens: Optional[int] = None) -> int:
+        """Tokens a request is expected to use"""
+        return prompt_tokens + (max_tokens or self.completion_tokens)
+
+    def _try(self, tokens: int) -> float:
+        """Acquire if possible, or return the seconds to wait, infinite until a release"""
+        if self._in_flight >= int(self._limit):
+            return math.inf
+
+        now = time.monotonic()
+        wait = self._paused_until - now
+        if self._requests is not None:
+            wait = max(wait, self._requests.wait(1, now))
+        if self._tokens is not None:
+            wait = max(wait, self._tokens.wait(tokens, now))
+        if wait > 0:
+            return wait
+
+        if self._requests is not None:
+            self._requests.level -= 1
+        if self._tokens is not None:
+            self._tokens.level -= tokens
+        self._in_flight += 1
+        return 0.0
+
+    def _acquired(self, tokens: int, started: float) -> _Ticket:
+        waited = time.monotonic() - started
+        self._stats["acquired"] += 1
+        self._stats["wait_total"] += waited
+        self._stats["wait_max"] = max(self._stats["wait_max"], waited)
+        return _Ticket(tokens)
+
+    def acquire(self, tokens: int) -> _Ticket:
+        """Wait for room for a request, blocking the calling thread"""
+        started = time.monotonic()
+        with self._cond:
+            self._stats["queued"] += 1
+            try:
+                while (wait := self._try(tokens)) > 0:
+                    self._cond.wait(None if wait == math.inf else wait)
+            finally:
+                self._stats["queued"] -= 1
+            return self._acquired(tokens, started)
+
+    async def aacquire(self, tokens: int) -> _Ticket:
+        """Wait for room for a request, without blocking the event loop"""
+        started = time.monotonic()
+        loop = asyncio.get_running_loop()
+        with self._cond:
+            self._stats["queued"] += 1
+        try:
+            while True:
+                with self._cond:
+                    wait = self._try(tokens)
+                    if wait == 0:
+                        return self._acquired(tokens, started)
+                    waiter = (loop, loop.create_future())
+                    self._waiters.append(waiter)
+                try:
+                    # Woken early by a release, or when the buckets should have refilled
+                    await asyncio.wait({waiter[1]}, timeout=None if wait == math.inf else wait)
+                finally:
+                    with self._cond:
+                        if waiter in self._waiters:
+                            self._waiters.remove(waiter)
+        finally:
+            with self._cond:
+                self._stats["queued"] -= 1
+
+    def _notify(self):
+        self._cond.notify_all()
+        for loop, future in self._waiters:
+            loop.call_soon_threadsafe(_wake, future)
+        self._waiters.clear()
+
+    def release(
+        self,
+        ticket: _Ticket,
+        usage: Optional[Usage] = None,
+        error: Optional[BaseException] = None,
+    ):
+        """Free the slot of a finished request
+
+        Args:
+            ticket: Returned by `acquire`
+            usage (Usage, optional): Reported usage, corrects the estimate taken from the token bucket
+            error (BaseException, optional): Exception the request failed with
+        """
+        with self._cond:
+            self._in_flight -= 1
+            if usage is not None and self._tokens is not None:
+                used = usage["prompt_tokens"] + usage["completion_tokens"]
+                self._tokens.level += ticket.tokens - used
+
+            if getattr(error, "status_code", None) == 429:
+                self._throttle(getattr(error, "response", None))
+            elif error is None:
+                self._limit = min(self.max_concurrency, self._limit + 1 / self._limit)
+            self._notify()
+
+    def _throttle(self, response: Optional[httpx.Response]):
+        now = time.monotonic()
+        self._stats["throttled"] += 1
+        if now - self._decreased >= self.cooldown:
+            self._limit = max(self.min_concurrency, self._limit / 2)
+            self._decreased = now
+
+        retry_after = retry_after_seconds(response.headers) if response is not None else None
+        if retry_after:
+            self._paused_until = max(self._paused_until, now + retry_after)
+
+    def observe(self, response: httpx.Response):
+        """Adapt to a provider response, a `Transport` hook
+
+        Reads rate limited statuses and the `x-ratelimit-*` headers sent by OpenAI, Groq
+        and compatible providers.
+        """
+        with self._cond:
+            if response.status_code == 429:
+                self._throttle(response)
+
+            now = time.monotonic()
+            for kind, bucket in (("requests", self._requests), ("tokens", self._tokens)):
+                remaining = _int_header(response, f"x-ratelimit-remaining-{kind}")
+                if remaining is None:
+                    continue
+                if bucket is not None:
+                    # The provider's count also includes requests made from elsewhere
+                    bucket.refill(now)
+                    bucket.level = min(bucket.level, remaining)
+                if remaining <= 0:
+                    reset = _duration(response.headers.get(f"x-ratelimit-reset-{kind}"))
+                    if reset:
+                        self._paused_until = max(self._paused_until, now + reset)
+            self._notify()
+
+    @property
+    def stats(self) -> dict:
+        """Requests queued and in flight, concurrency limit, and wait times in seconds"""
+        with self._cond:
+            stats = dict(self._stats)
+            stats["in_flight"] = self._in_flight
+            stats["concurrency"] = int(self._limit)
+            stats["wait_mean"] = (
+                stats["wait_total"] / stats["acquired"] if stats["acquired"] else 0.0
+            )
+            stats["paused_for"] = max(0.0, self._paused_until - time.monotonic())
+            if self._tokens is not None:
+                self._tokens.refill(time.monotonic())
+                stats["tokens_available"] = self._tokens.level
+        return stats
+
+
+def _wake(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
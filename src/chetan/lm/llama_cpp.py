@@ -1,28 +1,124 @@
-from typing import List, Optional, Type
+import logging
+from functools import cached_property, partial
+from typing import TYPE_CHECKING, List, Literal, Optional, Sequence, Type, Union
 from pydantic import BaseModel
 from chetan.core.types import FunctionCall, ToolCall
-from chetan.lm import LanguageModel, RawMessage
-from openai.types.chat.chat_completion import ChatCompletion
-import instructor
+from chetan.lm import LanguageModel, RawMessage, usage_from
+from chetan.lm.cache import ResponseCache
+from chetan.lm.scheduler import Scheduler, shared_scheduler
 from llama_cpp import Llama
+from llama_cpp.llama_cache import BaseLlamaCache, LlamaDiskCache, LlamaRAMCache
 
 from chetan.utils import primitive_base_model
 
+if TYPE_CHECKING:
+    import instructor
+    from chetan.lm.limiter import RateLimiter
+    from openai.types.chat.chat_completion import ChatCompletion
+
+logger = logging.getLogger(__name__)
+
+
+class _ObservedCache(BaseLlamaCache):
+    """Counts the prefix lookups llama.cpp makes in a KV state cache"""
+
+    def __init__(self, cache: BaseLlamaCache, stats: dict[str, int]):
+        super().__init__(cache.capacity_bytes)
+        self.cache = cache
+        self.stats = stats
+
+    @property
+    def cache_size(self) -> int:
+        return self.cache.cache_size
+
+    def __getitem__(self, key: Sequence[int]):
+        try:
+            state = self.cache[key]
+        except KeyError:
+            self.stats["misses"] += 1
+            raise
+        self.stats["hits"] += 1
+        self.stats["reused_tokens"] += Llama.longest_token_prefix(
+            state.input_ids.tolist(), key
+        )
+        return state
+
+    def __contains__(self, key: Sequence[int]) -> bool:
+        return key in self.cache
+
+    def __setitem__(self, key: Sequence[int], value):
+        self.stats["saved"] += 1
+        self.cache[key] = value
+
 
 class LlamaCppLM(LanguageModel):
     client: Llama
-    ins_client: instructor.Instructor
 
-    def __init__(self, model: Llama, *args, **kwargs):
+    def __init__(
+        self,
+        model: Llama,
+        *args,
+        cache: Optional[ResponseCache] = None,
+        cache_mode: Literal["deterministic", "always"] = "deterministic",
+        limiter: Optional["RateLimiter"] = None,
+        scheduler: Optional[Scheduler] = None,
+        kv_cache: Union[None, Literal["ram", "disk"], BaseLlamaCache] = None,
+        cache_dir: Optional[str] = None,
+        kv_cache_bytes: int = 2 << 30,
+        **kwargs,
+    ):
+        """
+        Args:
+            model (Llama): The loaded model
+            cache (ResponseCache, optional): See `LanguageModel`
+            cache_mode (str, optional): See `LanguageModel`
+            limiter (RateLimiter, optional): See `LanguageModel`
+            scheduler (Scheduler, optional): Queue requests to the model go through. Defaults to the one
+                shared by every `LlamaCppLM` using the same `Llama`. Pass one to every such `LlamaCppLM`
+                otherwise, a `Llama` must not be called from two schedulers.
+            kv_cache (str | BaseLlamaCache, optional): Keep the KV state of past prompts, and restore the one
+                sharing the longest prefix with a new prompt, so only new tokens are evaluated. "ram" keeps
+                states in memory, "disk" in `cache_dir`, so they survive restarts. Set on the `Llama`, so
+                it applies to every `LlamaCppLM` using it.
+            cache_dir (str, optional): Directory of the "disk" KV cache. Setting it implies `kv_cache="disk"`.
+            kv_cache_bytes (int, optional): Size limit of the KV cache
+            *args, **kwargs: Passed to `instructor.patch`
+        """
+        super().__init__(cache=cache, cache_mode=cache_mode, limiter=limiter)
         self.model = model
-        self.ins_client = instructor.patch(
+
+        self.kv_stats = {"hits": 0, "misses": 0, "reused_tokens": 0, "saved": 0}
+        if cache_dir is not None and kv_cache is None:
+            kv_cache = "disk"
+        if kv_cache == "ram":
+            kv_cache = LlamaRAMCache(kv_cache_bytes)
+        elif kv_cache == "disk":
+            kv_cache = LlamaDiskCache(cache_dir or ".chetan/kv_cache", kv_cache_bytes)
+        if kv_cache is not None:
+            # Sessions interleave on the scheduler, so the state left in the model is often
+            # another session's. The cache brings back the state of this session's prefix.
+            self.model.set_cache(_ObservedCache(kv_cache, self.kv_stats))
+        # A loaded `Llama` is not thread-safe, every call goes through the scheduler's worker thread
+        self.scheduler = scheduler or shared_scheduler(model, name="chetan-llama-cpp")
+        self._patch_options = (args, kwargs)
+
+    # instructor is only imported once a structured generation is made
+    @cached_property
+    def ins_client(self) -> "instructor.Instructor":
+        import instructor
+
+        args, kwargs = self._patch_options
+        return instructor.patch(
             *args,
             create=self.model.create_chat_completion_openai_v1,
             mode=instructor.Mode.JSON_SCHEMA,
             **kwargs,
         )
 
-    def _generate_structured(
+    def _cache_identity(self) -> str:
+        return f"{type(self).__name__}:{self.model.model_path}"
+
+    def _structured_call(
         self,
         context: list[RawMessage],
         target_model: Type[BaseModel],
@@ -30,30 +126,26 @@ class LlamaCppLM(LanguageModel):
         *args,
         **kwargs,
     ):
-
         t = target_model
 
         if iterable:
             t = primitive_base_model(List[target_model])
 
-        print(t)
+        logger.debug("Structured generation of %s", t.__name__)
 
-        res = self.ins_client(
-            response_model=t,
-            messages=context,
-            *args,
-            **kwargs,
-        )
-        return res.value
+        return partial(self.ins_client, response_model=t, messages=context, *args, **kwargs)
 
-    def _generate_raw(
-        self, context: list[RawMessage], *args, tools: Optional[List[dict]], **kwargs
-    ):
-        res: ChatCompletion = self.model.create_chat_completion_openai_v1(
+    def _raw_call(self, context: list[RawMessage], tools: Optional[List[dict]], **kwargs):
+        return partial(
+            self.model.create_chat_completion_openai_v1,
             messages=context,
             tools=tools,
+            **kwargs,
         )
 
+    def _to_output(self, res: "ChatCompletion", tools: Optional[List[dict]]):
+        self._record_usage(usage_from(res.usage))
+
         if tools:
             return [
                 ToolCall(
@@ -64,7 +156,42 @@ class LlamaCppLM(LanguageModel):
                     ),
                     type="function",
                 )
-                for tool_call in res.choices[0].message.tool_calls
+                for tool_call in res.choices[0].message.tool_calls or []
             ]
 
         return res.choices[0].message.content
+
+    def _generate_structured(
+        self,
+        context: list[RawMessage],
+        target_model: Type[BaseModel],
+        iterable: bool,
+        *args,
+        **kwargs,
+    ):
+        call = self._structured_call(context, target_model, iterable, *args, **kwargs)
+        return self.scheduler.run(call).value
+
+    def _generate_raw(
+        self, context: list[RawMessage], *, tools: Optional[List[dict]], **kwargs
+    ):
+        res = self.scheduler.run(self._raw_call(context, tools, **kwargs))
+        return self._to_output(res, tools)
+
+    async def _agenerate_structured(
+        self,
+        context: list[RawMessage],
+        target_model: Type[BaseModel],
+        iterable: bool,
+        *args,
+        **kwargs,
+    ):
+        # llama.cpp has no async API, inference runs on the scheduler's worker thread instead
+        call = self._structured_call(context, target_model, iterable, *args, **kwargs)
+        return (await self.scheduler.arun(call)).value
+
+    async def _agenerate_raw(
+        self, context: list[RawMessage], *, tools: Optional[List[dict]], **kwargs
+    ):
+        res = await self.scheduler.arun(self._raw_call(context, tools, **kwargs))
+        return self._to_output(res, tools)
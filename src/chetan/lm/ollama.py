@@ -1,26 +1,126 @@
-from typing import List, Optional, Type
+import json
+import logging
+from functools import cached_property
+from typing import TYPE_CHECKING, List, Literal, Optional, Type
 from uuid import uuid4
 from pydantic import BaseModel
 from chetan.core.context.iteration import Message
-from chetan.core.types import FunctionCall, ToolCall
+from chetan.core.types import FunctionCall, StreamChunk, ToolCall, Usage
 from chetan.lm import LanguageModel
-from openai import OpenAI
-import instructor
+from chetan.lm.cache import ResponseCache
+from chetan.lm.transport import Transport
+from chetan.utils import Preview
 
 import ollama
 
+if TYPE_CHECKING:
+    import instructor
+
+logger = logging.getLogger(__name__)
+
+
+def _to_tool_call(tool_call) -> ToolCall:
+    return ToolCall(
+        id=str(uuid4()),  # Ollama does not assign ids to tool calls
+        function=FunctionCall(
+            name=tool_call.function.name,
+            # Ollama returns parsed arguments, the loop expects a JSON string like OpenAI's
+            arguments=json.dumps(tool_call.function.arguments),
+        ),
+        type="function",
+    )
+
+
+def _usage(res) -> Usage:
+    return Usage(
+        prompt_tokens=res.get("prompt_eval_count") or 0,
+        completion_tokens=res.get("eval_count") or 0,
+        cached_prompt_tokens=0,  # Not reported by Ollama
+    )
+
+
+def _to_tool_calls(res) -> List[ToolCall]:
+    return [_to_tool_call(tool_call) for tool_call in res["message"]["tool_calls"] or []]
+
 
 class OllamaLM(LanguageModel):
-    ins_client: instructor.Instructor
+    client: ollama.Client
+    async_client: ollama.AsyncClient
     model: str
 
-    def __init__(self, model: str, *args, **kwargs):
-        super().__init__(*args, **kwargs)
+    def __init__(
+        self,
+        model: str,
+        *args,
+        cache: Optional[ResponseCache] = None,
+        cache_mode: Literal["deterministic", "always"] = "deterministic",
+        host: Optional[str] = None,
+        transport: Optional[Transport] = None,
+        **kwargs,
+    ):
+        """
+        Args:
+            model (str): The model name
+            cache (ResponseCache, optional): See `LanguageModel`
+            cache_mode (str, optional): See `LanguageModel`
+            host (str, optional): The Ollama server. Defaults to `OLLAMA_HOST`, or the local server.
+            transport (Transport, optional): Pooled connections, timeouts and retries of every request.
+                Not used by default, as local generations often outlast any timeout, and a timed out
+                generation retried runs again from the start.
+        """
+        super().__init__(*args, cache=cache, cache_mode=cache_mode, **kwargs)
         self.model = model
-        self.ins_client = instructor.from_openai(
-            OpenAI(base_url="http://localhost:11434/v1", api_key="ollama"),
-            *args,
-            **kwargs,
+        self.transport = transport
+
+        if transport is None:
+            self.client = ollama.Client(host)
+            self.async_client = ollama.AsyncClient(host)
+        else:
+            self.client = ollama.Client(
+                host, timeout=transport.timeout, transport=transport.transport
+            )
+            self.async_client = ollama.AsyncClient(
+                host, timeout=transport.timeout, transport=transport.async_transport
+            )
+
+    def _temperature(self, kwargs: dict) -> Optional[float]:
+        # The native API takes sampling parameters in `options`, the OpenAI-compatible one at the top
+        if "temperature" in kwargs:
+            return kwargs["temperature"]
+        return (kwargs.get("options") or {}).get("temperature")
+
+    # Structured generation goes through Ollama's OpenAI-compatible endpoint.
+    # instructor and openai are only imported once a structured generation is made.
+    @property
+    def _openai_base_url(self) -> str:
+        return f"{str(self.client._client.base_url).rstrip('/')}/v1"
+
+    @cached_property
+    def ins_client(self) -> "instructor.Instructor":
+        import instructor
+        from openai import OpenAI
+
+        options = {}
+        if self.transport is not None:
+            options = {"http_client": self.transport.client(), "max_retries": 0}
+        return instructor.from_openai(
+            OpenAI(base_url=self._openai_base_url, api_key="ollama", **options),
+            *self.args,
+            **self.kwargs,
+        )
+
+    @cached_property
+    def async_ins_client(self) -> "instructor.AsyncInstructor":
+        import instructor
+        from openai import AsyncOpenAI
+
+        options = {}
+        if self.transport is not None:
+            options = {"http_client": self.transport.async_client(), "max_retries": 0}
+        return instructor.from_openai(
+            AsyncOpenAI(base_url=self._openai_base_url, api_key="ollama", **options),
+            *self.args,
+            **self.kwargs,
         )
 
     def _generate_structured(
@@ -52,27 +152,98 @@ class OllamaLM(LanguageModel):
         )
         return res
 
-    def _generate_raw(self, context: list[Message], tools: Optional[List[dict]], **kwargs):
-        res = ollama.chat(
+    def _generate_raw(
+        self, context: list[Message], *, tools: Optional[List[dict]], **kwargs
+    ):
+        res = self.client.chat(
             model=self.model,
             messages=context,
             tools=tools,
             **kwargs,
         )
-        
-        print(res)
+
+        logger.debug("Ollama response: %s", Preview(res))
+        self._record_usage(_usage(res))
 
         if tools:
+            return _to_tool_calls(res)
+
+        return res["message"]["content"]
+
+    async def _agenerate_structured(
+        self,
+        context: list[Message],
+        target_model: Type[BaseModel],
+        iterable: bool,
+        *args,
+        **kwargs,
+    ):
+        if iterable:
             return [
-                ToolCall(
-                    id=uuid4(),
-                    function=FunctionCall(
-                        name=tool_call.function.name,
-                        arguments=tool_call.function.arguments,
-                    ),
-                    type="function",
+                x
+                async for x in self.async_ins_client.chat.completions.create_iterable(
+                    response_model=target_model,
+                    messages=context,
+                    model=self.model,
+                    *args,
+                    **kwargs,
                 )
-                for tool_call in res["message"]["tool_calls"]
             ]
 
+        return await self.async_ins_client.chat.completions.create(
+            response_model=target_model,
+            messages=context,
+            model=self.model,
+            *args,
+            **kwargs,
+        )
+
+    async def _agenerate_raw(
+        self, context: list[Message], *, tools: Optional[List[dict]], **kwargs
+    ):
+        res = await self.async_client.chat(
+            model=self.model,
+            messages=context,
+            tools=tools,
+            **kwargs,
+        )
+        self._record_usage(_usage(res))
+
+        if tools:
+            return _to_tool_calls(res)
+
         return res["message"]["content"]
+
+    async def _astream_raw(
+        self, context: list[Message], *, tools: Optional[List[dict]] = None, **kwargs
+    ):
+        response = await self.async_client.chat(
+            model=self.model,
+            messages=context,
+            tools=tools,
+            stream=True,
+            **kwargs,
+        )
+
+        # Ollama streams tool calls whole, each one is complete when it arrives
+        content, calls, usage = [], [], None
+        try:
+            async for chunk in response:
+                if chunk.get("done"):
+                    usage = _usage(chunk)
+
+                if chunk["message"]["content"]:
+                    content.append(chunk["message"]["content"])
+                    yield StreamChunk(type="content", content=chunk["message"]["content"])
+
+                for tool_call in chunk["message"]["tool_calls"] or []:
+                    call = _to_tool_call(tool_call)
+                    calls.append(call)
+                    yield StreamChunk(type="tool_call", tool_call=call)
+        finally:
+            await response.aclose()
+
+        done = StreamChunk(type="done", content="".join(content), tool_calls=calls)
+        if usage is not None:
+            done["usage"] = usage
+        yield done
@@ -1,22 +1,118 @@
-from typing import List, Optional, Type
+from contextlib import aclosing
+from functools import cached_property
+from typing import TYPE_CHECKING, List, Optional, Type
 from pydantic import BaseModel
 from chetan.core.context.iteration import Message
 from chetan.core.types import FunctionCall, ToolCall
-from chetan.lm import LanguageModel
-from openai import NotGiven, OpenAI
+from chetan.lm import LanguageModel, usage_from
+from chetan.lm.streaming import stream_chat_completion
+from chetan.lm.transport import Transport
+from openai import AsyncAzureOpenAI, AsyncOpenAI, AzureOpenAI, NotGiven, OpenAI
 from openai.types.chat.chat_completion import ChatCompletion
-import instructor
+
+if TYPE_CHECKING:
+    import instructor
+
+
+def _async_client_for(client: OpenAI, transport: Optional[Transport]) -> AsyncOpenAI:
+    """Build an async client pointing at the same endpoint, with the same credentials as `client`
+
+    The SDK only copies a client into one of the same kind, so this reads what its `copy()`
+    reads: the public settings, and the custom headers, query and Azure credentials it keeps
+    private.
+    """
+    options = dict(
+        api_key=client.api_key,
+        organization=client.organization,
+        project=client.project,
+        base_url=client.base_url,
+        websocket_base_url=client.websocket_base_url,
+        timeout=client.timeout,
+        max_retries=client.max_retries,
+        default_headers=client._custom_headers,
+        default_query=client._custom_query,
+    )
+    if transport is not None:
+        options.update(
+            http_client=transport.async_client(), timeout=transport.timeout, max_retries=0
+        )
+    if isinstance(client, AzureOpenAI):
+        return AsyncAzureOpenAI(
+            api_version=client._api_version,
+            azure_ad_token=client._azure_ad_token,
+            azure_ad_token_provider=client._azure_ad_token_provider,
+            **options,
+        )
+    return AsyncOpenAI(**options)
+
+
+def _to_tool_calls(res: ChatCompletion) -> List[ToolCall]:
+    return [
+        ToolCall(
+            id=tool_call.id,
+            function=FunctionCall(
+                name=tool_call.function.name,
+                arguments=tool_call.function.arguments,
+            ),
+            type="function",
+        )
+        for tool_call in res.choices[0].message.tool_calls or []
+    ]
+
 
 class OpenAILM(LanguageModel):
     client: OpenAI
-    ins_client: instructor.Instructor
+    async_client: AsyncOpenAI
     model: str
 
-    def __init__(self, client: OpenAI, model: str, *args, **kwargs):
+    def __init__(
+        self,
+        client: OpenAI,
+        model: str,
+        *args,
+        async_client: Optional[AsyncOpenAI] = None,
+        transport: Optional[Transport] = None,
+        stream_usage: bool = True,
+        **kwargs,
+    ):
+        """
+        Args:
+            client (OpenAI): The client used for sync generation
+            model (str): The model name, or the deployment name with Azure
+            async_client (AsyncOpenAI, optional): The client used for async generation. Derived from `client` when not set.
+            transport (Transport, optional): Send requests over this transport's pooled connections, with its
+                timeouts and retries. Replaces the HTTP client of `client` and of the derived async client.
+            limiter (RateLimiter, optional): See `LanguageModel`. With a `transport`, it also follows the
+                rate limit headers of the responses.
+            stream_usage (bool, optional): Ask for token usage in streams. Disable it for servers that do not support `stream_options`.
+        """
         super().__init__(*args, **kwargs)
+        self.stream_usage = stream_usage
+        if transport is not None:
+            # Retries are left to the transport, so they are not made twice
+            client = client.with_options(
+                http_client=transport.client(), timeout=transport.timeout, max_retries=0
+            )
         self.client = client
+        self.async_client = async_client or _async_client_for(client, transport)
         self.model = model
-        self.ins_client = instructor.from_openai(client)
+
+        if transport is not None and self.limiter is not None:
+            # The limiter follows the rate limit headers of this provider's responses
+            transport.add_hook(self.limiter.observe, host=self.client.base_url.host)
+
+    # instructor is only imported once a structured generation is made
+    @cached_property
+    def ins_client(self) -> "instructor.Instructor":
+        import instructor
+
+        return instructor.from_openai(self.client)
+
+    @cached_property
+    def async_ins_client(self) -> "instructor.AsyncInstructor":
+        import instructor
+
+        return instructor.from_openai(self.async_client)
 
     def _generate_structured(
         self,
@@ -58,18 +154,73 @@ class OpenAILM(LanguageModel):
             # tool_choice=("required" if tools else NotGiven()),
             **kwargs,
         )
+        self._record_usage(usage_from(res.usage))
 
         if tools:
+            return _to_tool_calls(res)
+
+        return res.choices[0].message.content
+
+    async def _agenerate_structured(
+        self,
+        context: list[Message],
+        target_model: Type[BaseModel],
+        iterable: bool,
+        *args,
+        **kwargs,
+    ):
+        if iterable:
             return [
-                ToolCall(
-                    id=tool_call.id,
-                    function=FunctionCall(
-                        name=tool_call.function.name,
-                        arguments=tool_call.function.arguments,
-                    ),
-                    type="function",
+                x
+                async for x in self.async_ins_client.chat.completions.create_iterable(
+                    response_model=target_model,
+                    messages=context,
+                    model=self.model,
+                    *args,
+                    **kwargs,
                 )
-                for tool_call in res.choices[0].message.tool_calls
             ]
 
+        return await self.async_ins_client.chat.completions.create(
+            response_model=target_model,
+            messages=context,
+            model=self.model,
+            *args,
+            **kwargs,
+        )
+
+    async def _agenerate_raw(
+        self, context: list[Message], *args, tools: Optional[List[dict]], **kwargs
+    ):
+        res: ChatCompletion = await self.async_client.chat.completions.create(
+            messages=context,
+            model=self.model,
+            *args,
+            tools=tools,
+            **kwargs,
+        )
+        self._record_usage(usage_from(res.usage))
+
+        if tools:
+            return _to_tool_calls(res)
+
         return res.choices[0].message.content
+
+    async def _astream_raw(
+        self, context: list[Message], *args, tools: Optional[List[dict]] = None, **kwargs
+    ):
+        response = await self.async_client.chat.completions.create(
+            messages=context,
+            model=self.model,
+            *args,
+            tools=tools,
+            stream=True,
+            stream_options=(
+                {"include_usage": True} if self.stream_usage else NotGiven()
+            ),
+            **kwargs,
+        )
+
+        async with aclosing(stream_chat_completion(response)) as stream:
+            async for chunk in stream:
+                yield chunk
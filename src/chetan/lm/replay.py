@@ -0,0 +1,299 @@
+import asyncio
+import json
+import threading
+import time
+from collections import deque
+from contextlib import aclosing
+from typing import Callable, List, Literal, Optional, Type, Union
+
+from pydantic import BaseModel
+
+from chetan.core.types import StreamChunk, Usage
+from chetan.lm import LanguageModel, RawMessage, _completion_chunks, total_usage
+from chetan.lm.cache import decode_response, encode_response, request_key
+
+# Seconds to wait before a replayed response: none, the recorded latency, a constant,
+# or a function of the recorded interaction (e.g. sampling a distribution with a seeded `random.Random`)
+Latency = Union[None, Literal["recorded"], float, Callable[[dict], float]]
+
+
+def _key(context, tools, target_model, iterable, args, kwargs) -> str:
+    # The model is left out, so a cassette recorded with one backend replays anywhere
+    return request_key("", context, tools, target_model, iterable, args, kwargs)
+
+
+class RecordingLM(LanguageModel):
+    """Records the generations of a language model to a cassette file, for `ReplayLM`
+
+    Raw text, tool calls, structured outputs and streams are recorded along with their
+    latency and token usage. Every interaction is appended to the cassette as soon as it
+    completes, or is closed early for streams, one JSON object per line.
+    """
+
+    lm: LanguageModel
+    path: str
+
+    def __init__(self, lm: LanguageModel, path: str, *args, **kwargs):
+        """
+        Args:
+            lm (LanguageModel): The language model to record
+            path (str): Cassette file, appended to when it exists
+        """
+        super().__init__(*args, **kwargs)
+        self.lm = lm
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _record(self, key: str, kind: str, res, latency: float, ttft=None, usage=None):
+        interaction = {
+            "key": key,
+            "kind": kind,
+            "response": encode_response(res),
+            "latency": latency,
+            "ttft": ttft,
+            "usage": usage,
+        }
+        with self._lock, open(self.path, "a") as f:
+            f.write(json.dumps(interaction, ensure_ascii=False) + "\n")
+
+    def _inner_usage(self, usages: list[Usage]) -> Optional[Usage]:
+        # Only the usage of the requests made by this call, cached responses report none
+        usage = total_usage(usages)
+        self._record_usage(usage)
+        return usage
+
+    def _generate_structured(
+        self,
+        context: list[RawMessage],
+        target_model: Type[BaseModel],
+        iterable: bool,
+        *args,
+        **kwargs,
+    ):
+        start = time.perf_counter()
+        with self.lm.track_usage() as usages:
+            res = self.lm.generate(context, target_model, None, *args, iterable=iterable, **kwargs)
+        self._record(
+            _key(context, None, target_model, iterable, args, kwargs),
+            "generate",
+            res,
+            time.perf_counter() - start,
+            usage=self._inner_usage(usages),
+        )
+        return res
+
+    def _generate_raw(
+        self, context: list[RawMessage], *args, tools: Optional[List[dict]], **kwargs
+    ):
+        start = time.perf_counter()
+        with self.lm.track_usage() as usages:
+            res = self.lm.generate(context, None, tools, *args, **kwargs)
+        self._record(
+            _key(context, tools, None, False, args, kwargs),
+            "generate",
+            res,
+            time.perf_counter() - start,
+            usage=self._inner_usage(usages),
+        )
+        return res
+
+    async def _agenerate_structured(
+        self,
+        context: list[RawMessage],
+        target_model: Type[BaseModel],
+        iterable: bool,
+        *args,
+        **kwargs,
+    ):
+        start = time.perf_counter()
+        with self.lm.track_usage() as usages:
+            res = await self.lm.agenerate(
+                context, target_model, None, *args, iterable=iterable, **kwargs
+            )
+        self._record(
+            _key(context, None, target_model, iterable, args, kwargs),
+            "generate",
+            res,
+            time.perf_counter() - start,
+            usage=self._inner_usage(usages),
+        )
+        return res
+
+    async def _agenerate_raw(
+        self, context: list[RawMessage], *args, tools: Optional[List[dict]], **kwargs
+    ):
+        start = time.perf_counter()
+        with self.lm.track_usage() as usages:
+            res = await self.lm.agenerate(context, None, tools, *args, **kwargs)
+        self._record(
+            _key(context, tools, None, False, args, kwargs),
+            "generate",
+            res,
+            time.perf_counter() - start,
+            usage=self._inner_usage(usages),
+        )
+        return res
+
+    async def _astream_raw(
+        self, context: list[RawMessage], *args, tools: list[dict] = None, **kwargs
+    ):
+        start, ttft = time.perf_counter(), None
+        key = _key(context, tools, None, False, args, kwargs)
+        content: list[str] = []
+        calls = []
+        done = False
+        try:
+            async with aclosing(self.lm.astream(context, tools, *args, **kwargs)) as stream:
+                async for chunk in stream:
+                    if ttft is None:
+                        ttft = time.perf_counter() - start
+
+                    if chunk["type"] == "content":
+                        content.append(chunk["content"])
+                    elif chunk["type"] == "tool_call":
+                        calls.append(chunk["tool_call"])
+                    else:
+                        done = True
+                        self._record(
+                            key,
+                            "stream",
+                            chunk["tool_calls"] if tools else chunk["content"],
+                            time.perf_counter() - start,
+                            ttft=ttft,
+                            usage=chunk.get("usage"),
+                        )
+                    yield chunk
+        except GeneratorExit:
+            # Streams closed early (e.g. on `exit`) are recorded with what was generated so far,
+            # which is all a replay of the same run consumes
+            if not done:
+                self._record(
+                    key,
+                    "stream",
+                    calls if tools else "".join(content),
+                    time.perf_counter() - start,
+                    ttft=ttft,
+                )
+            raise
+
+
+class ReplayLM(LanguageModel):
+    """Replays the generations recorded by `RecordingLM`, without any network access
+
+    With `match="request"`, each request gets the next response recorded for an identical
+    request, so the replay does not depend on the order of the calls. Use `match="order"`
+    when requests are not reproducible (e.g. they contain random ids), to get the recorded
+    responses in the order they were recorded instead.
+    """
+
+    path: str
+    match: Literal["request", "order"]
+    latency: Latency
+
+    def __init__(
+        self,
+        path: str,
+        *args,
+        match: Literal["request", "order"] = "request",
+        latency: Latency = None,
+        **kwargs,
+    ):
+        """
+        Args:
+            path (str): Cassette file written by `RecordingLM`
+            match (str, optional): How requests are matched to recorded responses
+            latency (Latency, optional): Delay before each response, none when not set. Streams spend the
+                recorded time to first token share of it before their first chunk.
+        """
+        super().__init__(*args, **kwargs)
+        self.path = path
+        self.match = match
+        self.latency = latency
+
+        with open(path) as f:
+            interactions = [json.loads(line) for line in f if line.strip()]
+        self._ordered = deque(interactions)
+        self._by_key: dict[str, deque] = {}
+        for interaction in interactions:
+            self._by_key.setdefault(interaction["key"], deque()).append(interaction)
+        self._lock = threading.Lock()
+
+    def _next(self, key: str) -> dict:
+        with self._lock:
+            queue = self._ordered if self.match == "order" else self._by_key.get(key)
+            if not queue:
+                raise LookupError(
+                    f"No recorded response left for request {key[:12]} in {self.path}"
+                )
+            return queue.popleft()
+
+    def _response(self, interaction: dict, target_model=None, iterable: bool = False):
+        self._record_usage(interaction["usage"])
+        return decode_response(interaction["response"], target_model, iterable)
+
+    def _delay(self, interaction: dict) -> float:
+        if self.latency is None:
+            return 0.0
+        if self.latency == "recorded":
+            return interaction["latency"]
+        if callable(self.latency):
+            return self.latency(interaction)
+        return self.latency
+
+    def _generate_structured(
+        self,
+        context: list[RawMessage],
+        target_model: Type[BaseModel],
+        iterable: bool,
+        *args,
+        **kwargs,
+    ):
+        interaction = self._next(_key(context, None, target_model, iterable, args, kwargs))
+        time.sleep(self._delay(interaction))
+        return self._response(interaction, target_model, iterable)
+
+    def _generate_raw(
+        self, context: list[RawMessage], *args, tools: Optional[List[dict]], **kwargs
+    ):
+        interaction = self._next(_key(context, tools, None, False, args, kwargs))
+        time.sleep(self._delay(interaction))
+        return self._response(interaction)
+
+    async def _agenerate_structured(
+        self,
+        context: list[RawMessage],
+        target_model: Type[BaseModel],
+        iterable: bool,
+        *args,
+        **kwargs,
+    ):
+        interaction = self._next(_key(context, None, target_model, iterable, args, kwargs))
+        await asyncio.sleep(self._delay(interaction))
+        return self._response(interaction, target_model, iterable)
+
+    async def _agenerate_raw(
+        self, context: list[RawMessage], *args, tools: Optional[List[dict]], **kwargs
+    ):
+        interaction = self._next(_key(context, tools, None, False, args, kwargs))
+        await asyncio.sleep(self._delay(interaction))
+        return self._response(interaction)
+
+    async def _astream_raw(
+        self, context: list[RawMessage], *args, tools: list[dict] = None, **kwargs
+    ):
+        interaction = self._next(_key(context, tools, None, False, args, kwargs))
+        delay = self._delay(interaction)
+
+        # The delay is split around the first chunk like the recorded stream was
+        share = (interaction["ttft"] or 0.0) / (interaction["latency"] or 1.0)
+        await asyncio.sleep(delay * share)
+
+        chunks: list[StreamChunk] = _completion_chunks(
+            decode_response(interaction["response"], None, False), tools
+        )
+        if interaction["usage"] is not None:
+            chunks[-1]["usage"] = interaction["usage"]
+        for i, chunk in enumerate(chunks):
+            if i == len(chunks) - 1:
+                await asyncio.sleep(delay * (1 - share))
+            yield chunk
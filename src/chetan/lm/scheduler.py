@@ -0,0 +1,239 @@
+import asyncio
+import threading
+import time
+import weakref
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from typing import Callable, Optional, TypeVar
+
+from chetan.lm import current_session
+
+T = TypeVar("T")
+
+
+class SchedulerFull(RuntimeError):
+    """Raised when a request cannot be queued because the scheduler is at capacity"""
+
+
+class _Job:
+    __slots__ = ("fn", "future", "session", "enqueued")
+
+    def __init__(self, fn: Callable, session: str):
+        self.fn = fn
+        self.future = Future()
+        self.session = session
+        self.enqueued = time.perf_counter()
+
+
+class Scheduler:
+    """Queues requests from many sessions in front of a model that runs one request at a time
+
+    Requests run on a single dedicated worker thread. Sessions (see `current_session`) are
+    served round robin, one request per turn, so a busy agent cannot starve the others.
+    Submitting blocks, or fails with `SchedulerFull`, once `max_pending` requests are queued
+    in total or `max_pending_per_session` for the session.
+
+    `stats` reports the number of requests and how long they waited in the queue and ran.
+    """
+
+    def __init__(
+        self,
+        max_pending: int = 64,
+        max_pending_per_session: Optional[int] = None,
+        name: str = "chetan-scheduler",
+        max_tracked_sessions: int = 1024,
+    ):
+        """
+        Args:
+            max_pending (int, optional): Requests queued at once, over all sessions
+            max_pending_per_session (int, optional): Requests queued at once per session. Unbounded when not set.
+            name (str, optional): Name of the worker thread
+            max_tracked_sessions (int, optional): Sessions whose wait times `stats` reports, the least
+                recently served are dropped beyond that
+        """
+        self.max_pending = max_pending
+        self.max_pending_per_session = max_pending_per_session
+        self.name = name
+        self.max_tracked_sessions = max_tracked_sessions
+
+        self._cond = threading.Condition()
+        self._queues: dict[str, deque[_Job]] = {}
+        self._ready: deque[str] = deque()  # Sessions with queued requests, in serving order
+        self._pending = 0
+        self._closed = False
+        self._worker: Optional[threading.Thread] = None
+
+        self._stats = {
+            "submitted": 0,
+            "completed": 0,
+            "failed": 0,
+            "cancelled": 0,
+            "rejected": 0,
+            "wait_total": 0.0,
+            "wait_max": 0.0,
+            "run_total": 0.0,
+        }
+        # Session -> [requests, total wait, max wait], least recently served first
+        self._session_waits: OrderedDict[str, list[float]] = OrderedDict()
+
+    @property
+    def stats(self) -> dict:
+        """Counters, queue depth and wait times in seconds, overall and per session"""
+        with self._cond:
+            stats = dict(self._stats)
+            started = stats["completed"] + stats["failed"]
+            stats["queued"] = self._pending
+            stats["wait_mean"] = stats["wait_total"] / started if started else 0.0
+            stats["sessions"] = {
+                session: {"requests": n, "wait_mean": total / n, "wait_max": longest}
+                for session, (n, total, longest) in self._session_waits.items()
+            }
+        return stats
+
+    def _has_room(self, session: str) -> bool:
+        if self._pending >= self.max_pending:
+            return False
+        return self.max_pending_per_session is None or len(
+            self._queues.get(session, ())
+        ) < self.max_pending_per_session
+
+    def submit(
+        self,
+        fn: Callable[[], T],
+        *,
+        session: Optional[str] = None,
+        timeout: Optional[float] = None,
+    ) -> "Future[T]":
+        """Queue a request
+
+        Args:
+            fn (Callable): The request, called on the worker thread
+            session (str, optional): Session the request belongs to. Defaults to `current_session`.
+            timeout (float, optional): Seconds to wait for room in the queue, 0 to never wait.
+                Waits as long as needed when not set.
+
+        Returns:
+            Future: Resolved with the result of `fn` once it ran
+        """
+        session = session or current_session.get()
+        future = self._enqueue(fn, session, timeout)
+        if future is None:
+            with self._cond:
+                self._stats["rejected"] += 1
+            raise SchedulerFull(
+                f"{self.name} is at capacity, session {session} cannot queue more requests"
+            )
+        return future
+
+    def _enqueue(
+        self, fn: Callable, session: str, timeout: Optional[float]
+    ) -> Optional[Future]:
+        with self._cond:
+            if not self._cond.wait_for(
+                lambda: self._closed or self._has_room(session), timeout
+            ):
+                return None
+            if self._closed:
+                raise RuntimeError(f"{self.name} is closed")
+
+            job = _Job(fn, session)
+            queue = self._queues.setdefault(session, deque())
+            if not queue:
+                self._ready.append(session)
+            queue.append(job)
+            self._pending += 1
+            self._stats["submitted"] += 1
+
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._work, name=self.name, daemon=True)
+                self._worker.start()
+            self._cond.notify_all()
+        return job.future
+
+    def run(self, fn: Callable[[], T], *, timeout: Optional[float] = None) -> T:
+        """Queue a request and wait for its result"""
+        return self.submit(fn, timeout=timeout).result()
+
+    async def arun(self, fn: Callable[[], T], *, timeout: Optional[float] = None) -> T:
+        """Queue a request and await its result, without blocking the event loop
+
+        Cancelling the awaiting task drops the request if it did not start yet.
+        """
+        session = current_session.get()
+        future = self._enqueue(fn, session, 0)
+        if future is None:
+            # Waiting for room in the queue blocks, so it happens off the event loop
+            future = await asyncio.to_thread(
+                self.submit, fn, session=session, timeout=timeout
+            )
+        return await asyncio.wrap_future(future)
+
+    def _work(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._ready or self._closed)
+                if not self._ready:
+                    return  # Closed, and every queued request was served
+
+                session = self._ready.popleft()
+                queue = self._queues[session]
+                job = queue.popleft()
+                if queue:
+                    self._ready.append(session)
+                else:
+                    del self._queues[session]
+                self._pending -= 1
+                self._cond.notify_all()  # Submitters may be waiting for room
+
+            if not job.future.set_running_or_notify_cancel():
+                with self._cond:
+                    self._stats["cancelled"] += 1
+                continue
+
+            started = time.perf_counter()
+            try:
+                job.future.set_result(job.fn())
+                outcome = "completed"
+            except BaseException as e:
+                job.future.set_exception(e)
+                outcome = "failed"
+
+            wait = started - job.enqueued
+            with self._cond:
+                self._stats[outcome] += 1
+                self._stats["wait_total"] += wait
+                self._stats["wait_max"] = max(self._stats["wait_max"], wait)
+                self._stats["run_total"] += time.perf_counter() - started
+
+                waits = self._session_waits.setdefault(job.session, [0, 0.0, 0.0])
+                self._session_waits.move_to_end(job.session)
+                if len(self._session_waits) > self.max_tracked_sessions:
+                    self._session_waits.popitem(last=False)
+                waits[0] += 1
+                waits[1] += wait
+                waits[2] = max(waits[2], wait)
+
+    def close(self, wait: bool = True):
+        """Stop accepting requests. Queued ones are still served."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if wait and self._worker is not None:
+            self._worker.join()
+
+
+_shared: "weakref.WeakKeyDictionary[object, Scheduler]" = weakref.WeakKeyDictionary()
+_shared_lock = threading.Lock()
+
+
+def shared_scheduler(model: object, name: str = "chetan-scheduler") -> Scheduler:
+    """The scheduler of a model, created on first use and shared by every caller passing it
+
+    The scheduler is closed, and its worker thread stopped, once the model is garbage collected.
+    """
+    with _shared_lock:
+        scheduler = _shared.get(model)
+        if scheduler is None:
+            scheduler = _shared[model] = Scheduler(name=name)
+            weakref.finalize(model, scheduler.close, False)
+    return scheduler
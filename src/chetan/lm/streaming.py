@@ -0,0 +1,100 @@
+from typing import Optional
+
+from chetan.core.types import FunctionCall, StreamChunk, ToolCall
+from chetan.lm import usage_from
+
+
+class ToolCallAssembler:
+    """Assembles `ToolCall`s from streamed OpenAI-style `tool_calls` fragments
+
+    Providers stream calls one at a time: the first fragment of a call carries its
+    `index`, `id` and function name, the following ones append to its arguments.
+    A call is complete as soon as a fragment for the next index arrives, or the stream ends.
+    """
+
+    def __init__(self):
+        self.calls: list[ToolCall] = []
+        self._current: Optional[int] = None
+        self._id: Optional[str] = None
+        self._name: str = ""
+        self._arguments: list[str] = []
+
+    def feed(self, fragments) -> list[ToolCall]:
+        """Consume the `tool_calls` fragments of a delta
+
+        Args:
+            fragments: The `delta.tool_calls` of a streamed chunk, may be None
+
+        Returns:
+            list[ToolCall]: The calls completed by these fragments
+        """
+        completed = []
+        for fragment in fragments or []:
+            if fragment.index != self._current:
+                if self._current is not None:
+                    completed.append(self._close())
+                self._current = fragment.index
+
+            if fragment.id:
+                self._id = fragment.id
+            if fragment.function is not None:
+                if fragment.function.name:
+                    self._name += fragment.function.name
+                if fragment.function.arguments:
+                    self._arguments.append(fragment.function.arguments)
+
+        return completed
+
+    def flush(self) -> list[ToolCall]:
+        """Complete the pending call once the stream has ended"""
+        if self._current is None:
+            return []
+        self._current = None
+        return [self._close()]
+
+    def _close(self) -> ToolCall:
+        call = ToolCall(
+            id=self._id,
+            function=FunctionCall(name=self._name, arguments="".join(self._arguments)),
+            type="function",
+        )
+        self.calls.append(call)
+        self._id, self._name, self._arguments = None, "", []
+        return call
+
+
+async def stream_chat_completion(response):
+    """Translate an OpenAI-compatible async chunk stream into `StreamChunk`s
+
+    The response is closed when the consumer stops iterating early.
+    """
+    assembler = ToolCallAssembler()
+    content = []
+    usage = None
+    try:
+        async for chunk in response:
+            # OpenAI reports usage in a last chunk without choices, Groq in `x_groq`
+            usage = getattr(chunk, "usage", None) or usage
+            x_groq = getattr(chunk, "x_groq", None)
+            if x_groq is not None and x_groq.usage is not None:
+                usage = x_groq.usage
+            if not chunk.choices:
+                continue
+
+            delta = chunk.choices[0].delta
+            if delta.content:
+                content.append(delta.content)
+                yield StreamChunk(type="content", content=delta.content)
+
+            for call in assembler.feed(delta.tool_calls):
+                yield StreamChunk(type="tool_call", tool_call=call)
+
+        for call in assembler.flush():
+            yield StreamChunk(type="tool_call", tool_call=call)
+    finally:
+        await response.close()
+
+    done = StreamChunk(type="done", content="".join(content), tool_calls=assembler.calls)
+    if usage is not None:
+        done["usage"] = usage_from(usage)
+    yield done
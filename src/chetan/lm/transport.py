@@ -0,0 +1,373 @@
+import asyncio
+import email.utils
+import logging
+import random
+import threading
+import time
+import weakref
+from typing import Callable, Optional, Union
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+
+class RetryPolicy:
+    """When and how long to wait before retrying a failed request
+
+    Rate limited (429), overloaded and failing (5xx) responses are retried, as are requests
+    that could not connect or whose connection was reset. Requests timing out while waiting
+    for their response are not, the server may still be running them. Waits grow exponentially with full
+    jitter, so sessions retrying at once spread out, unless the server sets `Retry-After`.
+    """
+
+    def __init__(
+        self,
+        max_retries: int = 3,
+        base_delay: float = 0.5,
+        max_delay: float = 30.0,
+        max_retry_after: float = 120.0,
+        statuses: frozenset[int] = frozenset({408, 409, 429, 500, 502, 503, 504}),
+    ):
+        """
+        Args:
+            max_retries (int, optional): Retries after the first attempt
+            base_delay (float, optional): Upper bound of the first wait, in seconds, doubled on every retry
+            max_delay (float, optional): Upper bound of any backoff wait, in seconds
+            max_retry_after (float, optional): Longest `Retry-After` honored, in seconds. Responses asking
+                for a longer wait are returned as they are.
+            statuses (frozenset[int], optional): Response statuses that are retried
+        """
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retry_after = max_retry_after
+        self.statuses = statuses
+
+    def backoff(self, attempt: int) -> float:
+        """Jittered wait before retry number `attempt`, counted from 0"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+
+    def delay(self, attempt: int, response: Optional[httpx.Response]) -> Optional[float]:
+        """Seconds to wait before retrying, None if the request must not be retried
+
+        Args:
+            attempt (int): Number of retries made so far
+            response (httpx.Response, optional): The failed response, None when the request raised
+        """
+        if attempt >= self.max_retries:
+            return None
+        if response is None:
+            return self.backoff(attempt)
+        if response.status_code not in self.statuses:
+            return None
+
+        retry_after = retry_after_seconds(response.headers)
+        if retry_after is None:
+            return self.backoff(attempt)
+        return retry_after if retry_after <= self.max_retry_after else None
+
+
+def retry_after_seconds(headers: httpx.Headers) -> Optional[float]:
+    """Wait asked for by `retry-after-ms` or `Retry-After`, in seconds or as an HTTP date"""
+    if (value := headers.get("retry-after-ms")) is not None:
+        try:
+            return max(float(value) / 1000, 0.0)
+        except ValueError:
+            pass
+
+    value = headers.get("retry-after")
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(email.utils.parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+# Reading or writing failed after the connection was made, e.g. it was reset by the server
+_RETRIED_ERRORS = (httpx.TransportError,)
+# The server may still be working on the request, e.g. a long generation, which a retry
+# would run again from the start
+_NOT_RETRIED_ERRORS = (httpx.ReadTimeout,)
+
+
+def _replayable(request: httpx.Request) -> bool:
+    # Streamed bodies are consumed by the first attempt
+    return isinstance(request.stream, httpx.ByteStream)
+
+
+class _RetryTransport(httpx.BaseTransport):
+    def __init__(self, owner: "Transport", pool: httpx.HTTPTransport):
+        self.owner = owner
+        self.pool = pool
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        owner, attempt = self.owner, 0
+        owner._start()
+        try:
+            while True:
+                try:
+                    response = self.pool.handle_request(request)
+                except _NOT_RETRIED_ERRORS:
+                    owner._count("failures")
+                    raise
+                except _RETRIED_ERRORS as e:
+                    wait = owner.retry.delay(attempt, None) if _replayable(request) else None
+                    if wait is None:
+                        owner._count("failures")
+                        raise
+                    owner._retrying(request, attempt, wait, repr(e))
+                else:
+                    owner._observe(request, response)
+                    wait = owner.retry.delay(attempt, response) if _replayable(request) else None
+                    if wait is None:
+                        return response
+                    response.close()
+                    owner._retrying(request, attempt, wait, response.status_code)
+                time.sleep(wait)
+                attempt += 1
+        finally:
+            owner._end()
+
+    def close(self):
+        # The pool is shared by every client of the transport and left open, see `Transport.close`
+        self.pool = None
+
+
+class _AsyncRetryTransport(httpx.AsyncBaseTransport):
+    def __init__(self, owner: "Transport"):
+        self.owner = owner
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        owner, attempt = self.owner, 0
+        # Connections belong to the event loop they were opened on, see `Transport._loop_pool`
+        pool = owner._loop_pool()
+        owner._start()
+        try:
+            while True:
+                try:
+                    response = await pool.handle_async_request(request)
+                except _NOT_RETRIED_ERRORS:
+                    owner._count("failures")
+                    raise
+                except _RETRIED_ERRORS as e:
+                    wait = owner.retry.delay(attempt, None) if _replayable(request) else None
+                    if wait is None:
+                        owner._count("failures")
+                        raise
+                    owner._retrying(request, attempt, wait, repr(e))
+                else:
+                    owner._observe(request, response)
+                    wait = owner.retry.delay(attempt, response) if _replayable(request) else None
+                    if wait is None:
+                        return response
+                    await response.aclose()
+                    owner._retrying(request, attempt, wait, response.status_code)
+                await asyncio.sleep(wait)
+                attempt += 1
+        finally:
+            owner._end()
+
+    async def aclose(self):
+        pass
+
+
+class Transport:
+    """Connection pools, timeouts and retries shared by language model clients
+
+    Every client built by a transport, sync or async, sends its requests through the same
+    keep-alive connection pool of that kind, so sessions reuse warm connections instead of
+    opening their own. Failed requests are retried following `retry`.
+
+    Async connections are bound to the event loop they were opened on, so async clients use
+    a pool per running loop, e.g. one per `asyncio.run`.
+
+    Hooks (see `add_hook`) see every response, retried ones included, e.g. to follow rate limits.
+    Closing a client leaves the pools open, close the transport once every client is done.
+    `stats` reports request counters and pool occupancy, to size `max_connections` for the
+    number of concurrent sessions.
+    """
+
+    def __init__(
+        self,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 30.0,
+        timeout: Union[float, httpx.Timeout] = httpx.Timeout(60.0, connect=5.0),
+        retry: Optional[RetryPolicy] = None,
+    ):
+        """
+        Args:
+            max_connections (int, optional): Connections open at once per pool, requests beyond wait for one
+            max_keepalive_connections (int, optional): Idle connections kept open per pool
+            keepalive_expiry (float, optional): Seconds an idle connection is kept open
+            timeout (float | httpx.Timeout, optional): Default timeout of requests, in seconds.
+                Backends accepting a `timeout` argument override it per request.
+            retry (RetryPolicy, optional): Retry policy. Defaults apply when not set.
+        """
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.timeout = timeout
+        self.retry = retry or RetryPolicy()
+
+        self._lock = threading.Lock()
+        self._hooks: list[tuple[Optional[str], Callable[[httpx.Response], None]]] = []
+        self._pool: Optional[httpx.HTTPTransport] = None
+        # Pools of the event loops async requests were made on, dropped with their loop
+        self._async_pools: weakref.WeakKeyDictionary[
+            asyncio.AbstractEventLoop, httpx.AsyncHTTPTransport
+        ] = weakref.WeakKeyDictionary()
+        self._stats = {
+            "requests": 0,
+            "retries": 0,
+            "failures": 0,
+            "in_flight": 0,
+            "peak_in_flight": 0,
+        }
+
+    @property
+    def transport(self) -> httpx.BaseTransport:
+        """Sync transport over the shared pool, for clients built elsewhere"""
+        with self._lock:
+            if self._pool is None:
+                self._pool = httpx.HTTPTransport(limits=self.limits)
+        return _RetryTransport(self, self._pool)
+
+    @property
+    def async_transport(self) -> httpx.AsyncBaseTransport:
+        """Async transport over the shared pool of the running event loop, for clients built elsewhere"""
+        return _AsyncRetryTransport(self)
+
+    def _loop_pool(self) -> httpx.AsyncHTTPTransport:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            pool = self._async_pools.get(loop)
+            if pool is None:
+                for other in [l for l in self._async_pools if l.is_closed()]:
+                    # Their connections cannot be closed gracefully anymore
+                    del self._async_pools[other]
+                pool = self._async_pools[loop] = httpx.AsyncHTTPTransport(limits=self.limits)
+        return pool
+
+    def client(self, **kwargs) -> httpx.Client:
+        """A sync client over the shared pool, e.g. for `OpenAI(http_client=...)`"""
+        return httpx.Client(transport=self.transport, timeout=self.timeout, **kwargs)
+
+    def async_client(self, **kwargs) -> httpx.AsyncClient:
+        """An async client over the shared pool, e.g. for `AsyncOpenAI(http_client=...)`"""
+        return httpx.AsyncClient(
+            transport=self.async_transport, timeout=self.timeout, **kwargs
+        )
+
+    def add_hook(self, hook: Callable[[httpx.Response], None], host: Optional[str] = None):
+        """Call `hook` with every response, before its body is read
+
+        Args:
+            hook (Callable[[httpx.Response], None]): Called on the thread or event loop of the request
+            host (str, optional): Only responses from this host. All hosts when not set.
+        """
+        self._hooks.append((host, hook))
+
+    def _observe(self, request: httpx.Request, response: httpx.Response):
+        for host, hook in self._hooks:
+            if host is None or host == request.url.host:
+                hook(response)
+
+    def _count(self, key: str):
+        with self._lock:
+            self._stats[key] += 1
+
+    def _start(self):
+        with self._lock:
+            self._stats["requests"] += 1
+            self._stats["in_flight"] += 1
+            self._stats["peak_in_flight"] = max(
+                self._stats["peak_in_flight"], self._stats["in_flight"]
+            )
+
+    def _end(self):
+        with self._lock:
+            self._stats["in_flight"] -= 1
+
+    def _retrying(self, request: httpx.Request, attempt: int, wait: float, reason):
+        self._count("retries")
+        logger.warning(
+            "Retrying %s %s in %.2fs (attempt %d, %s)",
+            request.method,
+            request.url,
+            wait,
+            attempt + 1,
+            reason,
+        )
+
+    @property
+    def stats(self) -> dict:
+        """Request counters, and open and idle connections per pool
+
+        `in_flight` counts requests waiting for their response headers, streamed bodies
+        keep their connection busy until they are read.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            async_pools = list(self._async_pools.values())
+        stats["sync"] = _pool_stats([self._pool] if self._pool is not None else [])
+        stats["async"] = _pool_stats(async_pools)
+        stats["async"]["pools"] = len(async_pools)
+        stats["sync"]["max_connections"] = stats["async"]["max_connections"] = (
+            self.limits.max_connections
+        )
+        return stats
+
+    def close(self):
+        """Close the sync pool"""
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.close()
+
+    async def aclose(self):
+        """Close the sync pool and the async pool of the running event loop
+
+        Pools of other event loops are dropped, their connections close with their loop.
+        """
+        self.close()
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            pool = self._async_pools.pop(loop, None)
+            self._async_pools.clear()
+        if pool is not None:
+            await pool.aclose()
+
+
+def _pool_stats(pools: list) -> dict:
+    """Open and idle connections of httpx pools, None where httpx internals changed"""
+    try:
+        # httpx does not expose its connection pool publicly
+        connections = [c for pool in pools for c in pool._pool.connections]
+        return {
+            "connections": len(connections),
+            "idle": sum(1 for c in connections if c.is_idle()),
+        }
+    except (AttributeError, TypeError):
+        return {"connections": None, "idle": None}
+
+
+_default: Optional[Transport] = None
+_default_lock = threading.Lock()
+
+
+def default_transport() -> Transport:
+    """The transport shared by the backends that are not given one"""
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = Transport()
+        return _default
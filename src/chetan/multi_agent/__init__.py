@@ -1,7 +1,127 @@
-from chetan.core.loop import AgentLoop
+import asyncio
+import time
+from typing import AsyncIterator, Optional, TypedDict, Union
+
+from chetan.core.context import ContextManager
+from chetan.core.context.iteration import UserMessage
+from chetan.core.loop import AgentLoop, AgentLoopConfig
+from chetan.core.types import ToolCall
+
+
+class AgentResult(TypedDict):
+    index: int  # Position of the agent's entry in the config list
+    config: dict
+    agent: AgentLoop  # The finished loop, with its context
+    exit_call: Optional[ToolCall]  # The `exit` call that ended the loop, None if it ran out of iterations
+    error: Optional[BaseException]
+    duration: float  # Seconds
 
 
 class HomologousAgents:
-    def __init__(self, agent_arch: AgentLoop, config: list[dict]):
+    """Runs copies of an agent loop concurrently, one per config entry
+
+    Each copy is an isolated `AgentLoop` with its own context, action system and iteration
+    storage, built after `agent_arch`. They share its language model, and so its client's
+    connection pool, and run on the current event loop.
+
+    Config entries may set:
+    - `task` (str or list[str]): User messages the agent starts with
+    - `max_iter` (int): Iteration limit of the run
+    - any `AgentLoopConfig` field, overriding the one of `agent_arch`
+    """
+
+    _RUN_KEYS = frozenset({"task", "max_iter"})
+
+    def __init__(
+        self,
+        agent_arch: AgentLoop,
+        config: list[dict],
+        max_concurrency: Optional[int] = None,
+    ):
+        """
+        Args:
+            agent_arch (AgentLoop): The agent loop every copy is built after
+            config (list[dict]): One entry per agent
+            max_concurrency (int, optional): Maximum number of agents running at once. Unbounded when not set.
+        """
+        unknown = {
+            key
+            for entry in config
+            for key in entry
+            if key not in self._RUN_KEYS and key not in AgentLoopConfig.model_fields
+        }
+        if unknown:
+            raise ValueError(f"Unknown agent config keys: {sorted(unknown)}")
+
         self.agent_arch = agent_arch
         self.config = config
+        self.max_concurrency = max_concurrency
+
+    def spawn(self, config: dict) -> AgentLoop:
+        """Build an isolated agent loop for a config entry"""
+        arch = self.agent_arch
+        overrides = {k: v for k, v in config.items() if k not in self._RUN_KEYS}
+
+        agent = AgentLoop(
+            arch.lm,
+            ctx_manager=ContextManager(
+                token_budget=arch.context.token_budget,
+                keep_recent=arch.context.keep_recent,
+                summarizer=arch.context.summarizer,
+            ),
+            action_system=arch.action_system.fork(),
+            config=arch.config.model_copy(update=overrides),
+            on_stream=arch.on_stream,
+            telemetry=arch.telemetry,
+            result_store=arch.result_store,
+        )
+
+        task: Union[str, list[str]] = config.get("task", [])
+        for content in [task] if isinstance(task, str) else task:
+            agent.context.add(UserMessage(content=content))
+        return agent
+
+    async def stream(self) -> AsyncIterator[AgentResult]:
+        """Run every agent, yielding each result as soon as its agent finishes
+
+        A failing agent does not stop the others, its exception is in the result.
+        Agents still running are cancelled when the iteration is stopped early. The results
+        an agent stored in the shared `ResultStore` are discarded once it finishes.
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrency or len(self.config) or 1)
+
+        async def run(index: int, config: dict) -> AgentResult:
+            async with semaphore:
+                agent = self.spawn(config)
+                started, error = time.perf_counter(), None
+                try:
+                    await agent(max_iter=config.get("max_iter"))
+                except Exception as e:
+                    error = e
+                finally:
+                    if agent.result_store is not None:
+                        agent.result_store.discard(agent.session)
+                return AgentResult(
+                    index=index,
+                    config=config,
+                    agent=agent,
+                    exit_call=agent.exit_call,
+                    error=error,
+                    duration=time.perf_counter() - started,
+                )
+
+        tasks = [
+            asyncio.create_task(run(index, config))
+            for index, config in enumerate(self.config)
+        ]
+        try:
+            for finished in asyncio.as_completed(tasks):
+                yield await finished
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def run(self) -> list[AgentResult]:
+        """Run every agent and return the results in config order"""
+        results = [result async for result in self.stream()]
+        return sorted(results, key=lambda result: result["index"])
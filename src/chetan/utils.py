@@ -1,8 +1,11 @@
 import inspect
+import logging
 import random
-from typing import Callable
+import reprlib
+from typing import Callable, Optional
 
 from pydantic import BaseModel, create_model
+from termcolor import colored
 
 
 def rand_code_name_pairs():
@@ -111,3 +114,72 @@ def stringify(a):
     if isinstance(a, bool):
         return "true" if a else "false"
     return str(a)
+
+
+def estimate_tokens(message: dict) -> int:
+    """
+    Roughly estimate the number of prompt tokens a chat message takes, at ~4 characters per token.
+    """
+    chars = 0
+    content = message.get("content")
+    if content:
+        chars += len(content) if isinstance(content, str) else len(str(content))
+    for call in message.get("tool_calls", ()):
+        chars += len(call["function"]["name"]) + len(call["function"]["arguments"])
+    return chars // 4 + 4  # Role and message framing
+
+
+_PREVIEW = reprlib.Repr()
+_PREVIEW.maxlevel = 3
+_PREVIEW.maxdict = _PREVIEW.maxlist = _PREVIEW.maxtuple = _PREVIEW.maxset = 8
+_PREVIEW.maxstring = _PREVIEW.maxother = 200
+
+
+class Preview:
+    """Bounded preview of a value for log messages
+
+    Only built when the message is actually emitted, and never walks the whole value,
+    so logging a huge result costs nothing when the level is off.
+    """
+
+    __slots__ = ("value", "limit")
+
+    def __init__(self, value, limit: int = 200):
+        self.value = value
+        self.limit = limit
+
+    def __str__(self) -> str:
+        value = self.value
+        if isinstance(value, str):
+            text = value
+        else:
+            if isinstance(value, BaseModel):
+                value = dict(value)  # The fields, without serializing the model
+            text = _PREVIEW.repr(value)
+
+        if len(text) <= self.limit:
+            return text
+        return text[: self.limit] + "..."
+
+
+class ColoredFormatter(logging.Formatter):
+    """Colors records with the termcolor color passed in `extra={"color": ...}`"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        message = super().format(record)
+        color = getattr(record, "color", None)
+        return colored(message, color) if color else message
+
+
+def log_to_console(
+    level: int = logging.INFO, fmt: Optional[str] = None
+) -> logging.Handler:
+    """
+    Show the agent loop progress (stages, tool calls, results) on stderr, in color.
+    """
+    handler = logging.StreamHandler()
+    handler.setFormatter(ColoredFormatter(fmt or "%(message)s"))
+    logger = logging.getLogger("chetan")
+    logger.addHandler(handler)
+    logger.setLevel(level)
+    return handler
@@ -0,0 +1,57 @@
+from chetan.lm.cache import DiskResponseCache, MemoryResponseCache
+from chetan.lm.ollama import OllamaLM
+
+
+def test_memory_cache_evicts_least_recently_used():
+    cache = MemoryResponseCache(max_entries=2)
+    cache.set("a", "1")
+    cache.set("b", "2")
+    assert cache.get("a") == "1"
+    cache.set("c", "3")
+
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == ("1", "3")
+    assert cache.stats["evictions"] == 1
+
+
+def test_disk_caches_sharing_a_database_agree_on_its_size(tmp_path):
+    path = str(tmp_path / "cache.db")
+    first, second = DiskResponseCache(path, max_bytes=250), DiskResponseCache(path, max_bytes=250)
+    try:
+        first.set("a", "x" * 100)
+        second.set("b", "y" * 100)
+        assert first.size == second.size == 200
+
+        second.set("a", "x" * 50)
+        assert first.size == 150
+        assert first.get("b") == "y" * 100
+
+        # Past max_bytes, with responses written by the other cache
+        first.set("c", "z" * 150)
+        assert first.stats["evictions"] == 1
+        assert second.get("a") is None
+        assert (second.get("b"), second.get("c")) == ("y" * 100, "z" * 150)
+        assert second.size == 250
+    finally:
+        first.close()
+        second.close()
+
+
+def test_disk_cache_expires_entries(tmp_path):
+    cache = DiskResponseCache(str(tmp_path / "cache.db"), ttl=-1)
+    try:
+        cache.set("a", "1")
+        assert cache.get("a") is None
+        assert cache.stats["expirations"] == 1
+        assert cache.size == 0
+    finally:
+        cache.close()
+
+
+def test_ollama_options_temperature_is_deterministic():
+    lm = OllamaLM("llama3", cache=MemoryResponseCache())
+    context = [{"role": "user", "content": "hi"}]
+
+    assert lm._cache_key(context, None, None, False, (), {"options": {"temperature": 0}})
+    assert lm._cache_key(context, None, None, False, (), {"options": {"temperature": 0.7}}) is None
+    assert lm._cache_key(context, None, None, False, (), {"temperature": 0})
@@ -0,0 +1,57 @@
+import datetime
+from uuid import uuid4
+
+import pytest
+
+from chetan.core.context import codec
+from chetan.core.context.iteration import (
+    Iteration,
+    PersistentContext,
+    PreludeItem,
+    Processing,
+    Results,
+    ToolCalling,
+    UserMessage,
+)
+from chetan.core.types import FunctionCall, ToolCall
+
+
+def context() -> PersistentContext:
+    call = ToolCall(id="call_0", type="function", function=FunctionCall(name="search", arguments="{}"))
+    iteration = Iteration(counter=1)
+    for item in (
+        PreludeItem(content={"actions": ["search"]}, tag="Recommendation"),
+        Processing(content="Searching"),
+        ToolCalling(calls=[call]),
+        Results(results={"hits": [1, 2]}, id="call_0"),
+    ):
+        iteration.add(item)
+    aware = UserMessage(
+        content="Go", timestamp=datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+    )
+    return PersistentContext(items=[UserMessage(content="Hi"), iteration, aware])
+
+
+@pytest.mark.parametrize("format", ["marshal", "jsonl"])
+def test_round_trips(format):
+    original = context()
+    loaded = codec.loads(codec.dumps(original, format), format)
+
+    assert [type(e) for e in loaded.items] == [type(e) for e in original.items]
+    for decoded, item in zip(loaded.items[1].items, original.items[1].items):
+        assert decoded.__dict__ == item.__dict__
+    assert loaded.items[0].__dict__ == original.items[0].__dict__
+    assert loaded.items[2].timestamp == original.items[2].timestamp
+    assert loaded.items[1].items[2].export() == original.items[1].items[2].export()
+
+
+def test_decoded_items_behave_like_models():
+    item = codec.decode_item(codec.encode_item(Processing(content="a")))
+    other = codec.decode_item(codec.encode_item(Processing(content="b")))
+
+    item.content = "changed"
+    item.id = uuid4()
+    assert other.content == "b"
+    assert item.model_fields_set == set(Processing.model_fields)
+    assert item.export()["content"] == "changed"
+    assert other.export()["content"] == "b"
@@ -0,0 +1,49 @@
+from chetan.core.context import ContextManager
+from chetan.core.context.iteration import PreludeItem, Processing, UserMessage
+
+
+def test_window_keeps_pinned_listing():
+    context = ContextManager(keep_recent=1)
+    context.add(UserMessage(content="Find the latest release notes"))
+
+    listing = "Recommended available actions:\n" + "\n".join(
+        f"- 'action_{i}': Does thing number {i}" for i in range(20)
+    )
+    for iteration in range(12):
+        context.iteration(iteration)
+        if iteration == 0:
+            context.add(PreludeItem(content=listing, tag="Recommendation"), pinned=True)
+        context.add(Processing(content=f"Step {iteration}: " + "reasoning " * 300))
+
+    for budget in (3000, 1200):
+        view = context.window(budget)
+        assert any(
+            "Recommended available actions" in (message.get("content") or "")
+            for message in view
+        )
+        # The first iteration's own processing did not fit, only its listing is kept
+        assert not any(
+            (message.get("content") or "").startswith("Step 0:") for message in view
+        )
+
+
+def test_window_releases_compacted_iterations():
+    context = ContextManager(keep_recent=1, token_budget=1500)
+    context.add(UserMessage(content="Summarize the logs"))
+    for iteration in range(20):
+        context.iteration(iteration)
+        context.add(PreludeItem(content="Listing", tag="Recommendation"), pinned=iteration == 0)
+        context.add(Processing(content=f"Step {iteration}: " + "reasoning " * 300))
+        context.window()
+
+    # Bodies of compacted iterations are gone, the pinned listing and recent iterations stay
+    assert context.exported[3] is None
+    assert context.exported[2]["content"] == "Listing"
+    assert context.exported[-1]["content"].startswith("Step 19:")
+
+    view = context.window()
+    assert None not in view
+    contents = [message["content"] for message in view]
+    assert "Listing" in contents
+    assert any(content.startswith("Step 18:") for content in contents)
+    assert not any("Step 0:" in content for content in contents)
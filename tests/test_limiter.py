@@ -0,0 +1,72 @@
+import asyncio
+
+import httpx
+
+from chetan.lm.limiter import RateLimiter, _duration
+
+
+class RateLimited(Exception):
+    status_code = 429
+    response = None
+
+
+def test_parses_reset_durations():
+    assert _duration("6m0s") == 360
+    assert _duration("1.5s") == 1.5
+    assert _duration("20ms") == 0.02
+    assert _duration("2") == 2
+    assert _duration("") is None
+
+
+def test_waiters_are_woken_by_a_release():
+    limiter = RateLimiter(max_concurrency=2)
+
+    async def run():
+        first = await limiter.aacquire(10)
+        second = await limiter.aacquire(10)
+        third = asyncio.create_task(limiter.aacquire(10))
+        await asyncio.sleep(0.01)
+        assert not third.done() and limiter.stats["queued"] == 1
+
+        limiter.release(first)
+        await asyncio.wait_for(third, 1)
+        limiter.release(second)
+        limiter.release(third.result())
+
+    asyncio.run(run())
+    assert limiter.stats["in_flight"] == 0
+    assert limiter.stats["acquired"] == 3
+
+
+def test_concurrency_halves_once_per_burst_of_429s():
+    limiter = RateLimiter(max_concurrency=8, cooldown=60)
+
+    for _ in range(3):
+        limiter.release(limiter.acquire(1), error=RateLimited())
+    assert limiter.concurrency == 4
+    assert limiter.stats["throttled"] == 3
+
+    for _ in range(8):
+        limiter.release(limiter.acquire(1))
+    assert limiter.concurrency == 5
+
+
+def test_reported_usage_corrects_the_token_estimate():
+    limiter = RateLimiter(tokens_per_minute=1000)
+    ticket = limiter.acquire(limiter.estimate(100, max_tokens=400))
+    assert limiter.stats["tokens_available"] < 501
+
+    usage = {"prompt_tokens": 100, "completion_tokens": 50, "cached_prompt_tokens": 0}
+    limiter.release(ticket, usage=usage)
+    assert 850 <= limiter.stats["tokens_available"] < 851
+
+
+def test_pauses_until_the_provider_quota_resets():
+    limiter = RateLimiter(requests_per_minute=100)
+    response = httpx.Response(
+        200,
+        headers={"x-ratelimit-remaining-requests": "0", "x-ratelimit-reset-requests": "2s"},
+    )
+
+    limiter.observe(response)
+    assert 1.9 < limiter.stats["paused_for"] <= 2
@@ -0,0 +1,38 @@
+from openai import AsyncAzureOpenAI, AzureOpenAI, OpenAI
+
+from chetan.lm.openai import _async_client_for
+
+
+def test_async_client_keeps_the_client_settings():
+    client = OpenAI(
+        api_key="key",
+        organization="org",
+        project="proj",
+        base_url="http://localhost:8000/v1",
+        default_headers={"X-Tenant": "a"},
+        default_query={"tenant": "a"},
+    )
+
+    derived = _async_client_for(client, None)
+    assert (derived.api_key, derived.organization, derived.project) == ("key", "org", "proj")
+    assert derived.base_url == client.base_url
+    assert derived.default_headers["X-Tenant"] == "a"
+    assert derived.default_query == {"tenant": "a"}
+
+
+def test_async_client_keeps_azure_credentials():
+    def provider():
+        return "token"
+
+    client = AzureOpenAI(
+        azure_endpoint="https://example.openai.azure.com",
+        api_version="2024-06-01",
+        azure_ad_token_provider=provider,
+        project="proj",
+    )
+
+    derived = _async_client_for(client, None)
+    assert isinstance(derived, AsyncAzureOpenAI)
+    assert derived.base_url == client.base_url
+    assert derived.project == "proj"
+    assert derived._azure_ad_token_provider is provider
@@ -0,0 +1,59 @@
+import asyncio
+import json
+
+from pydantic import BaseModel
+
+from chetan import AgentLoop
+from chetan.actions import Action, ActionSystem
+from chetan.core.types import FunctionCall, ToolCall
+from chetan.lm import LanguageModel
+from chetan.lm.replay import RecordingLM, ReplayLM
+
+
+class ScriptedLM(LanguageModel):
+    """Reasons, then calls `exit` followed by a call it never gets to stream"""
+
+    def _generate_structured(self, context, target_model, iterable, *args, **kwargs):
+        raise NotImplementedError
+
+    def _generate_raw(self, context, *args, tools=None, **kwargs):
+        if not tools:
+            return "Nothing left to do."
+        return [
+            ToolCall(
+                id=f"call_{i}",
+                type="function",
+                function=FunctionCall(name=name, arguments="{}"),
+            )
+            for i, name in enumerate(["exit", "unreachable"])
+        ]
+
+
+class NoArgs(BaseModel):
+    pass
+
+
+def loop(lm: LanguageModel) -> AgentLoop:
+    actions = ActionSystem()
+    actions.register(
+        Action(name="exit", description="End the run", args=NoArgs, output=None, fn=lambda: None)
+    )
+    return AgentLoop(lm, action_system=actions)
+
+
+def test_replays_streamed_run_ending_in_exit(tmp_path):
+    cassette = tmp_path / "run.jsonl"
+
+    recorded = loop(RecordingLM(ScriptedLM(), str(cassette)))
+    asyncio.run(recorded())
+    assert recorded.exit_call["function"]["name"] == "exit"
+
+    interactions = [json.loads(line) for line in cassette.read_text().splitlines()]
+    assert [i["kind"] for i in interactions] == ["stream", "stream"]
+    # The tool calling stream was closed on `exit`, before its other call
+    calls = json.loads(interactions[1]["response"])["value"]
+    assert [c["function"]["name"] for c in calls] == ["exit"]
+
+    replayed = loop(ReplayLM(str(cassette)))
+    asyncio.run(replayed())
+    assert replayed.exit_call == recorded.exit_call
@@ -0,0 +1,44 @@
+from chetan import AgentLoop
+from chetan.actions.results import ResultStore
+from chetan.lm import current_session
+from chetan.lm.replay import ReplayLM
+
+
+def test_pages_through_stored_result(tmp_path):
+    store = ResultStore(str(tmp_path), threshold=100, preview=10, page_size=64)
+    content = "".join(f"line {i}\n" for i in range(100))
+
+    placeholder = store.offload(content, session="a")
+    assert placeholder.startswith(content[:10])
+    handle = placeholder.split("stored as ")[1].split(".")[0]
+
+    pages, offset = [], 0
+    while True:
+        page = store.read(handle, offset, session="a")
+        header, body = page.split("\n", 1)
+        pages.append(body)
+        if "end of result" in header:
+            break
+        offset = int(header.rsplit(" ", 1)[1].rstrip("]"))
+    assert "".join(pages) == content
+    assert "line 42" in store.search(handle, "LINE 42", session="a")
+
+
+def test_loops_sharing_a_code_name_keep_their_results(tmp_path):
+    cassette = tmp_path / "empty.jsonl"
+    cassette.write_text("")
+    first, second = AgentLoop(ReplayLM(str(cassette))), AgentLoop(ReplayLM(str(cassette)))
+    second.id = first.id
+    assert first.session != second.session
+
+    store = ResultStore(str(tmp_path / "results"), threshold=10)
+    token = current_session.set(first.session)
+    try:
+        placeholder = store.offload("x" * 100)
+        handle = placeholder.split("stored as ")[1].split(".")[0]
+    finally:
+        current_session.reset(token)
+
+    # The second loop finishing must not take the first one's results with it
+    store.discard(second.session)
+    assert store.read(handle, session=first.session).endswith("x" * 100)
@@ -0,0 +1,43 @@
+import gc
+import threading
+
+from chetan.lm.scheduler import Scheduler, shared_scheduler
+
+
+class Model:
+    pass
+
+
+def test_serves_sessions_round_robin():
+    scheduler = Scheduler()
+    order = []
+    gate = threading.Event()
+
+    # Hold the worker until every request is queued
+    blocker = scheduler.submit(gate.wait, session="blocker")
+    futures = [
+        scheduler.submit(lambda s=session, i=i: order.append((s, i)), session=session)
+        for session, count in (("busy", 3), ("quiet", 1))
+        for i in range(count)
+    ]
+    gate.set()
+    blocker.result()
+    for future in futures:
+        future.result()
+    scheduler.close()
+
+    assert order == [("busy", 0), ("quiet", 0), ("busy", 1), ("busy", 2)]
+
+
+def test_shares_one_scheduler_per_model():
+    first, second = Model(), Model()
+    scheduler = shared_scheduler(first)
+    assert shared_scheduler(first) is scheduler
+    assert shared_scheduler(second) is not scheduler
+
+    scheduler.run(lambda: None)
+    del first
+    gc.collect()
+    # Closed with its model, the worker thread exits
+    scheduler._worker.join(timeout=5)
+    assert not scheduler._worker.is_alive()
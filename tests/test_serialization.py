@@ -0,0 +1,61 @@
+import json
+
+from pydantic import BaseModel, Field, field_serializer
+
+from chetan.actions.serialization import ResultSerializer, bounded_json
+
+
+class Page(BaseModel):
+    title: str
+    items: list
+
+
+class Tagged(BaseModel):
+    name: str = Field(serialization_alias="label")
+    tags: set[str]
+    body: str
+
+    @field_serializer("tags")
+    def _sorted(self, tags: set[str]) -> list[str]:
+        return sorted(tags)
+
+
+def test_nested_truncation_keeps_the_nested_entries():
+    text = ResultSerializer(Page)({"title": "a", "items": list(range(1000))}, max_chars=80)
+
+    value = json.loads(text)
+    assert value["title"] == "a"
+    *items, marker = value["items"]
+    assert items == list(range(len(items))) and len(items) > 10
+    assert marker == f"... {1000 - len(items)} more items"
+
+
+def test_deeply_nested_truncation_is_valid_json():
+    value = {"a": {"b": {"c": [[i] * 50 for i in range(100)]}}}
+    for max_chars in (10, 30, 80, 200, 1000):
+        text = bounded_json(value, max_chars)
+        json.loads(text)
+        assert len(text) <= max_chars + 3 * 24
+
+    assert "[0,0,0" in bounded_json(value, 80)
+
+
+def test_truncated_model_fields_are_dumped_by_the_model_serializer():
+    result = Tagged(name="n", tags={"b", "a"}, body="x" * 1000)
+    serializer = ResultSerializer(Tagged)
+
+    assert json.loads(serializer(result)) == {"name": "n", "tags": ["a", "b"], "body": "x" * 1000}
+    value = json.loads(serializer(result, max_chars=200))
+    assert value["name"] == "n" and value["tags"] == ["a", "b"]
+    assert value["body"].endswith("... (1000 characters)")
+
+
+def test_results_of_another_model_are_validated_from_their_dump():
+    class Other(BaseModel):
+        title: str
+        items: tuple
+
+    assert json.loads(ResultSerializer(Page)(Other(title="t", items=(1, 2)))) == {
+        "title": "t",
+        "items": [1, 2],
+    }
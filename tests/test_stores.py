@@ -0,0 +1,51 @@
+import pytest
+
+from chetan.core.context import ContextManager
+from chetan.core.context.codec import encode_entry
+from chetan.core.context.iteration import Iteration, Processing, ToolCalling, UserMessage
+from chetan.core.context.store import (
+    CompactContextStore,
+    MemoryContextStore,
+    SQLiteContextStore,
+)
+
+STORES = {
+    "memory": lambda path: MemoryContextStore(),
+    "compact": lambda path: CompactContextStore(cache_size=1),
+    "sqlite": lambda path: SQLiteContextStore(str(path), cache_size=1),
+}
+
+
+def fill(context: ContextManager, iterations: int):
+    context.add(UserMessage(content="Start"))
+    for i in range(iterations):
+        context.iteration(i)
+        context.add(Processing(content=f"Step {i}"))
+        context.add(ToolCalling(calls=[]))
+
+
+@pytest.mark.parametrize("kind", STORES)
+def test_stores_the_persistent_context(kind, tmp_path):
+    store = STORES[kind](tmp_path / "context.db")
+    context = ContextManager(store=store)
+    fill(context, 5)
+
+    assert len(store) == 6
+    assert isinstance(store[0], UserMessage)
+    assert [type(item) for item in store[2].items] == [Processing, ToolCalling]
+    assert store[-1].items[0].content == "Step 4"
+    assert [e.items[0].content for e in store if isinstance(e, Iteration)] == [
+        f"Step {i}" for i in range(5)
+    ]
+
+
+def test_sqlite_store_resumes_a_session(tmp_path):
+    path = str(tmp_path / "context.db")
+    store = SQLiteContextStore(path)
+    fill(ContextManager(store=store), 3)
+    rows = [encode_entry(entry) for entry in store]
+    store.close()
+
+    resumed = SQLiteContextStore(path, session=store.session)
+    assert [encode_entry(entry) for entry in resumed] == rows
+    assert resumed.last().items[0].content == "Step 2"
@@ -0,0 +1,59 @@
+import httpx
+import pytest
+
+from chetan.lm.transport import RetryPolicy, Transport, _RetryTransport
+
+
+def transport_over(handler) -> tuple[Transport, httpx.Client]:
+    transport = Transport(retry=RetryPolicy(max_retries=2, base_delay=0))
+    client = httpx.Client(transport=_RetryTransport(transport, httpx.MockTransport(handler)))
+    return transport, client
+
+
+def test_retries_overloaded_responses():
+    statuses = iter([503, 429, 200])
+    transport, client = transport_over(lambda request: httpx.Response(next(statuses)))
+
+    assert client.post("http://lm.test/v1", json={"prompt": "hi"}).status_code == 200
+    assert transport.stats["retries"] == 2
+
+
+def test_gives_up_after_max_retries():
+    transport, client = transport_over(lambda request: httpx.Response(503))
+
+    assert client.get("http://lm.test/v1").status_code == 503
+    assert transport.stats["retries"] == 2
+
+
+def test_does_not_retry_read_timeouts():
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        raise httpx.ReadTimeout("generation still running", request=request)
+
+    transport, client = transport_over(handler)
+    with pytest.raises(httpx.ReadTimeout):
+        client.post("http://lm.test/v1", json={"prompt": "hi"})
+    assert len(calls) == 1
+    assert transport.stats["failures"] == 1
+
+
+def test_retries_connection_errors():
+    attempts = iter([httpx.ConnectError("refused"), None])
+
+    def handler(request):
+        if (error := next(attempts)) is not None:
+            raise error
+        return httpx.Response(200)
+
+    transport, client = transport_over(handler)
+    assert client.get("http://lm.test/v1").status_code == 200
+    assert transport.stats["retries"] == 1
+
+
+def test_closing_a_client_drops_its_pool_reference():
+    retrying = Transport().transport
+    client = httpx.Client(transport=retrying)
+    client.close()
+    assert retrying.pool is None